@@ -75,11 +75,24 @@ def unit_tests():
 @main.command()
 @click.pass_context
 @click.option("--tests", default='', help="Pattern to match test names to run.")
-def integration_tests(ctx, tests):
+@click.option("--cassette", default='', help="File in which the responses are recorded and replayed.")
+@click.option("--record", is_flag=True, help="Record the responses in the cassette again.")
+@click.option("--in-process", is_flag=True, help="Call the flask app in-process instead of through HTTP.")
+@click.option("--lambda", "call_lambda", is_flag=True, help="Call the AWS Lambda handlers directly, without flask.")
+def integration_tests(ctx, tests, cassette, record, in_process, call_lambda):
     """
-    Run the integration tests. Note: the flask app must already run in parallel.
+    Run the integration tests. Note: the flask app must already run in parallel,
+    unless it is called in-process, the Lambda handlers are called directly or
+    all the responses are replayed from a cassette.
     """
     tests_pattern = f'test*{tests}*.py'
+    if in_process:
+        os.environ['WSGI_APP'] = 'example_app:app'
+    if call_lambda:
+        os.environ['LAMBDA_ROUTES'] = 'lambda_routes:ROUTES'
+    if cassette:
+        os.environ['CASSETTE'] = cassette
+        os.environ['CASSETTE_RECORD'] = '1' if record else '0'
         
     tests_dir = relative_path(['src', 'integration-tests'])
     tests = unittest.TestLoader().discover(tests_dir, pattern=tests_pattern)
@@ -0,0 +1,120 @@
+import argparse
+import copy
+import importlib.util
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'integration-tests'))
+
+import resto
+
+
+############################################################################
+#
+# Benchmark of the resto JSON diff engine on deep and wide documents.
+#
+# Run it with the path to another version of resto.py to compare with it:
+#
+#     python bench_diff_engine.py --baseline path/to/old/resto.py
+
+
+def deep_document(depth: int) -> (dict, dict):
+    """
+    Create an expected and received document nested depth levels deep,
+    with a difference at the bottom.
+    """
+    expected = {'leaf': 1, 'items': [1, 2, 3]}
+    received = {'leaf': 2, 'items': [3, 2, 1]}
+    for i in range(depth):
+        expected = {'name': f'level {i}', 'child': expected}
+        received = {'name': f'level {i}', 'child': received}
+    return expected, received
+
+
+def deep_list_document(depth: int) -> (dict, dict):
+    """
+    Create an expected and received document where each level is a list
+    holding the next level, with a difference at the bottom.
+    """
+    expected = {'leaf': 1}
+    received = {'leaf': 2}
+    for i in range(depth):
+        expected = {'name': f'level {i}', 'children': [expected]}
+        received = {'name': f'level {i}', 'children': [received]}
+    return expected, received
+
+
+def wide_document(width: int) -> (dict, dict):
+    """
+    Create an expected and received document with many keys and a list of
+    many records, a tenth of which differ.
+    """
+    expected = {f'key {i}': f'value {i}' for i in range(width)}
+    expected['records'] = [{'id': i, 'name': f'name {i}', 'tags': ['a', 'b']} for i in range(width // 10)]
+    received = copy.deepcopy(expected)
+    for record in received['records'][::10]:
+        record['name'] += ' changed'
+    return expected, received
+
+
+def load_module(path: str):
+    """
+    Load a version of resto from the given file path.
+    """
+    spec = importlib.util.spec_from_file_location('baseline_resto', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_diff(module, expected, received, repeat: int) -> float:
+    """
+    Time the diff of the documents with the given resto module.
+    Return the best time in seconds, or None if the diff failed.
+    """
+    try:
+        return min(timeit.repeat(lambda: module._diff_values(expected, received), number=1, repeat=repeat))
+    except RecursionError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the resto JSON diff engine.')
+    parser.add_argument('--baseline', help='Path to another resto.py to compare with.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing repetitions.')
+    args = parser.parse_args()
+
+    baseline = load_module(args.baseline) if args.baseline else None
+
+    cases = [
+        ('deep 200', deep_document(200)),
+        ('deep 400', deep_document(400)),
+        ('deep 5000', deep_document(5000)),
+        ('lists 16', deep_list_document(16)),
+        ('wide 2000', wide_document(2000)),
+        ('wide 20000', wide_document(20000)),
+    ]
+
+    print(f'{"document":<12} {"current":>12} {"baseline":>12} {"speedup":>8}')
+    for name, (expected, received) in cases:
+        current = time_diff(resto, expected, received, args.repeat)
+        line = f'{name:<12} {_format_time(current):>12}'
+        if baseline:
+            base = time_diff(baseline, expected, received, args.repeat)
+            speedup = f'{base / current:.2f}x' if base and current else '-'
+            line += f' {_format_time(base):>12} {speedup:>8}'
+        print(line)
+
+
+def _format_time(seconds: float) -> str:
+    """
+    Format a time in milliseconds, or tell that the diff failed.
+    """
+    if seconds is None:
+        return 'recursion'
+    return f'{seconds * 1000:.2f} ms'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'integration-tests'))
+
+import resto
+from json_generators import DocumentShape, generate_documents
+
+
+############################################################################
+#
+# Benchmark suite of Expected.diff_json() and Expected.matches_json() on
+# synthetic documents.
+#
+# The results are saved as JSON in the results folder, in a file named after
+# the current git commit. They are compared with the results of another
+# commit, by default the most recent other results file, and the cases that
+# are slower by more than the threshold are reported as regressions:
+#
+#     python bench_expected.py --compare abc1234 --threshold 0.2
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+# Cases of the suite, by name, each varying one parameter of the default shape.
+CASES = {
+    'default': DocumentShape(),
+    'deep': DocumentShape(depth=30, width=5, list_length=5),
+    'wide': DocumentShape(depth=1, width=5000, list_length=0),
+    'long lists': DocumentShape(depth=1, width=5, list_length=1000, mismatch_ratio=0.01),
+    'identical': DocumentShape(depth=3, list_length=200, mismatch_ratio=0.0),
+    'many mismatches': DocumentShape(depth=3, list_length=50, mismatch_ratio=0.5),
+    'wildcards': DocumentShape(depth=3, list_length=100, wildcard_density=0.3),
+}
+
+
+# Cases timing Expected.matches_json() instead, which stops at the first difference.
+MATCHES_CASES = {
+    'matches lists': DocumentShape(depth=1, width=5, list_length=1000, mismatch_ratio=0.01),
+    'matches equal': DocumentShape(depth=3, list_length=200, mismatch_ratio=0.0),
+}
+
+
+def time_case(shape: DocumentShape, repeat: int, strict: bool, matches: bool = False) -> float:
+    """
+    Time Expected.diff_json(), or Expected.matches_json() if matches is True,
+    on the documents of the given shape.
+    The JSON is compiled before the timing, like on the later calls of a test.
+    Return the best time in seconds.
+    """
+    expected, received = generate_documents(shape)
+    exp = resto.Expected(out_json=expected, out_json_strict=strict)
+    exp.compile_json()
+    compare = exp.matches_json if matches else exp.diff_json
+    return min(timeit.repeat(lambda: compare(received), number=1, repeat=repeat))
+
+
+def current_commit() -> str:
+    """
+    Get the short hash of the current git commit, or 'unknown' outside of git.
+    """
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(repeat: int, strict: bool) -> dict:
+    """
+    Run all the cases of the suite. Return the results by case name.
+    """
+    results = {}
+    for name, shape in CASES.items():
+        results[name] = {'shape': shape.to_dict(), 'seconds': time_case(shape, repeat, strict)}
+    for name, shape in MATCHES_CASES.items():
+        results[name] = {'shape': shape.to_dict(), 'seconds': time_case(shape, repeat, strict, matches=True)}
+    return results
+
+
+def save_results(commit: str, results: dict) -> str:
+    """
+    Save the results of a commit in the results folder. Return the file path.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{commit}.json')
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'results': results}, f, indent=2)
+    return path
+
+
+def load_results(commit: str = None, exclude: str = None) -> dict:
+    """
+    Load the results of a commit, or of the most recent commit other than
+    the excluded one when no commit is given. Return None if there are none.
+    """
+    if commit:
+        path = os.path.join(RESULTS_DIR, f'{commit}.json')
+        if not os.path.exists(path):
+            return None
+    else:
+        paths = [p for p in glob.glob(os.path.join(RESULTS_DIR, '*.json')) if os.path.basename(p) != f'{exclude}.json']
+        if not paths:
+            return None
+        path = max(paths, key=os.path.getmtime)
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_regressions(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Find the cases slower than in the baseline by more than the threshold ratio.
+    Return a list of tuples of (case name, baseline seconds, current seconds).
+    """
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base or base['shape'] != result['shape']:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + threshold):
+            regressions.append((name, base['seconds'], result['seconds']))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark Expected.diff_json() and matches_json() on synthetic documents.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing repetitions.')
+    parser.add_argument('--compare', help='Commit whose results are compared, by default the latest other one.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slow-down ratio reported as a regression.')
+    parser.add_argument('--not-strict', action='store_true', help='Do not compare the JSON strictly.')
+    args = parser.parse_args()
+
+    commit = current_commit()
+    results = run_suite(args.repeat, not args.not_strict)
+    baseline = load_results(args.compare, exclude=commit)
+    print(f'Results saved to {save_results(commit, results)}')
+
+    base_results = baseline['results'] if baseline else {}
+    base_name = baseline['commit'] if baseline else '-'
+    print(f'{"case":<16} {commit:>12} {base_name:>12}')
+    for name, result in results.items():
+        base = base_results.get(name)
+        base_time = _format_time(base['seconds']) if base else '-'
+        print(f'{name:<16} {_format_time(result["seconds"]):>12} {base_time:>12}')
+
+    regressions = find_regressions(results, base_results, args.threshold)
+    for name, base_seconds, seconds in regressions:
+        print(f'REGRESSION: {name} went from {_format_time(base_seconds)} to {_format_time(seconds)}')
+    return 1 if regressions else 0
+
+
+def _format_time(seconds: float) -> str:
+    """
+    Format a time in milliseconds.
+    """
+    return f'{seconds * 1000:.2f} ms'
+
+
+if __name__ == '__main__':
+    sys.exit(main())
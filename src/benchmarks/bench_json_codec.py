@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask-app'))
+
+import json_codec
+
+
+############################################################################
+#
+# Benchmark of the JSON backends of json_codec on the bodies returned by
+# the list end-points of the example app, like /dogs and /houses.
+#
+#     python bench_json_codec.py --items 10000
+
+
+def dogs_body(count: int) -> dict:
+    """
+    Create the body returned by the /dogs GET end-point with the given number of dogs.
+    """
+    dogs = [{'id': i, 'first_name': f'Dog {i}', 'last_name': f'Breed {i % 20}'} for i in range(count)]
+    return {'total_item_count': count, 'dogs': dogs}
+
+
+def houses_body(count: int) -> dict:
+    """
+    Create the body returned by the /houses GET end-point with the given number of houses.
+    """
+    houses = [{'id': i, 'name': f'House {i}'} for i in range(count)]
+    return {'houses': houses}
+
+
+def time_backend(backend: str, body: dict, repeat: int) -> (float, float):
+    """
+    Time the encoding and the decoding of the body with the given backend.
+    Return the best times in seconds.
+    """
+    json_codec.set_backend(backend)
+    text = json_codec.dumps(body)
+    encode = min(timeit.repeat(lambda: json_codec.dumps(body), number=1, repeat=repeat))
+    decode = min(timeit.repeat(lambda: json_codec.loads(text), number=1, repeat=repeat))
+    return encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON backends on list end-point bodies.')
+    parser.add_argument('--items', type=int, default=10000, help='Number of items in the lists.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing repetitions.')
+    args = parser.parse_args()
+
+    backends = json_codec.available_backends()
+    if json_codec.ORJSON not in backends:
+        print('orjson is not installed: only the json backend is timed.')
+
+    cases = [
+        ('dogs', dogs_body(args.items)),
+        ('houses', houses_body(args.items)),
+    ]
+
+    print(f'{"body":<8} {"backend":<8} {"encode":>12} {"decode":>12}')
+    for name, body in cases:
+        for backend in backends:
+            encode, decode = time_backend(backend, body, args.repeat)
+            print(f'{name:<8} {backend:<8} {_format_time(encode):>12} {_format_time(decode):>12}')
+
+
+def _format_time(seconds: float) -> str:
+    """
+    Format a time in milliseconds.
+    """
+    return f'{seconds * 1000:.2f} ms'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import copy
+import random
+
+
+############################################################################
+#
+# Synthetic JSON documents for the resto diff engine benchmarks.
+#
+# The documents are generated from a seed, so that the same parameters
+# always give the same documents, from one commit to the next.
+
+
+class DocumentShape():
+    """
+    Parameters of a generated pair of expected and received documents.
+
+    Configurable parameters:
+      - depth: the number of levels of nested dicts.
+      - width: the number of simple values in each dict.
+      - list_length: the number of records in the list of each dict.
+      - mismatch_ratio: the ratio of simple values that differ in the received document.
+      - wildcard_density: the ratio of expected texts that are wildcards.
+      - seed: the seed of the random generator.
+    """
+    def __init__(
+            self,
+            depth: int = 3,
+            width: int = 10,
+            list_length: int = 20,
+            mismatch_ratio: float = 0.1,
+            wildcard_density: float = 0.0,
+            seed: int = 0):
+        self.depth = depth
+        self.width = width
+        self.list_length = list_length
+        self.mismatch_ratio = mismatch_ratio
+        self.wildcard_density = wildcard_density
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def generate_documents(shape: DocumentShape) -> (dict, dict):
+    """
+    Generate an expected and a received document with the given shape.
+    The received document is a copy of the expected one with some of its
+    simple values changed and its list items shuffled. Then some of the
+    expected texts are replaced by wildcards matching the received ones.
+    """
+    rng = random.Random(shape.seed)
+    received = _generate_dict(rng, shape, shape.depth)
+    expected = copy.deepcopy(received)
+    _mismatch(rng, received, shape.mismatch_ratio)
+    _add_wildcards(rng, expected, shape.wildcard_density)
+    return expected, received
+
+
+def _generate_dict(rng: random.Random, shape: DocumentShape, depth: int) -> dict:
+    """
+    Generate a dict with simple values, a list of records and, unless it is
+    the last level, a nested dict.
+    """
+    value = {}
+    for i in range(shape.width):
+        value[f'key {i}'] = _generate_simple(rng, i)
+    value['records'] = [
+        {'id': i, 'name': f'record {i}', 'score': rng.random(), 'tags': ['a', 'b', str(i % 7)]}
+        for i in range(shape.list_length)
+    ]
+    if depth > 1:
+        value['child'] = _generate_dict(rng, shape, depth - 1)
+    return value
+
+
+def _generate_simple(rng: random.Random, i: int):
+    """
+    Generate a simple value, alternating texts, numbers and booleans.
+    """
+    kind = i % 3
+    if kind == 0:
+        return f'text {rng.randrange(1000)}'
+    elif kind == 1:
+        return rng.randrange(1000)
+    else:
+        return rng.random() < 0.5
+
+
+def _simple_paths(value, path = ()):
+    """
+    List the paths of all the simple values in a document, in order.
+    """
+    paths = []
+    stack = [(path, value)]
+    while stack:
+        path, value = stack.pop()
+        if type(value) is dict:
+            stack.extend((path + (k,), v) for k, v in value.items())
+        elif type(value) is list:
+            stack.extend((path + (i,), v) for i, v in enumerate(value))
+        else:
+            paths.append(path)
+    paths.sort(key=repr)
+    return paths
+
+
+def _set_path(document, path: tuple, value) -> None:
+    """
+    Set the value found at the given path in the document.
+    """
+    for k in path[:-1]:
+        document = document[k]
+    document[path[-1]] = value
+
+
+def _get_path(document, path: tuple):
+    """
+    Get the value found at the given path in the document.
+    """
+    for k in path:
+        document = document[k]
+    return document
+
+
+def _mismatch(rng: random.Random, document: dict, ratio: float) -> None:
+    """
+    Change a ratio of the simple values of the document, then shuffle its lists.
+    """
+    for path in _simple_paths(document):
+        if rng.random() < ratio:
+            old = _get_path(document, path)
+            if type(old) is str:
+                new = old + ' changed'
+            elif type(old) is bool:
+                new = not old
+            else:
+                new = old + 1
+            _set_path(document, path, new)
+
+    stack = [document]
+    while stack:
+        value = stack.pop()
+        items = value.values() if type(value) is dict else value
+        for v in items:
+            if type(v) in (dict, list):
+                stack.append(v)
+        if type(value) is list:
+            rng.shuffle(value)
+
+
+def _add_wildcards(rng: random.Random, document: dict, density: float) -> None:
+    """
+    Replace a ratio of the texts of the document by wildcards matching them.
+    """
+    if density <= 0:
+        return
+    for path in _simple_paths(document):
+        text = _get_path(document, path)
+        if type(text) is str and rng.random() < density:
+            _set_path(document, path, '*' if rng.random() < 0.5 else '~' + text[:4])
@@ -1,5 +1,3 @@
-import json
-
 from flask import Flask, request, Response
 
 
@@ -32,7 +30,8 @@ def get_event(**kwargs) -> dict:
         for k, v in request.headers.items():
             event['headers'][k] = v
     if request.is_json:
-        event['body'] = json.dumps(request.get_json())
+        # The body is already JSON, so it is passed as is instead of being decoded and encoded again.
+        event['body'] = request.get_data(as_text=True)
     if kwargs:
         event['pathParameters'] = {}
         for k, v in kwargs.items():
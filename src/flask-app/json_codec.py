@@ -0,0 +1,92 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+############################################################################
+#
+# JSON encoding and decoding.
+#
+# The JSON is encoded and decoded with orjson when it is installed, since it
+# is much faster, and with the standard json module otherwise. The backend
+# can also be chosen explicitly, for example to compare them.
+
+
+# Names of the available backends.
+JSON = 'json'
+ORJSON = 'orjson'
+
+_backend = ORJSON if orjson is not None else JSON
+
+
+def available_backends() -> list:
+    """
+    List the names of the backends that can be used.
+    """
+    return [JSON, ORJSON] if orjson is not None else [JSON]
+
+
+def get_backend() -> str:
+    """
+    Get the name of the backend in use.
+    """
+    return _backend
+
+
+def set_backend(backend: str) -> None:
+    """
+    Choose the backend used to encode and decode JSON.
+    Raise a ValueError if it is not available.
+    """
+    global _backend
+    if backend not in available_backends():
+        raise ValueError(f'JSON backend {backend} is not available.')
+    _backend = backend
+
+
+def dumps(value) -> str:
+    """
+    Encode a value as a JSON text.
+    The values orjson cannot encode, like very large integers, are encoded by the json module.
+    """
+    if _backend == ORJSON:
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(value)
+
+
+# Translation replacing the digits with 0 and everything else with spaces,
+# to find the numbers of 19 digits or more, which orjson cannot decode exactly.
+_DIGITS = bytes(48 if 48 <= b <= 57 else 32 for b in range(256))
+_LONG_NUMBER = b'0' * 19
+
+
+def _has_long_number(text) -> bool:
+    """
+    Check if a JSON text has a number of 19 digits or more, maybe in a string.
+    """
+    if type(text) is str:
+        text = text.encode('utf-8', 'surrogatepass')
+    elif type(text) is not bytes:
+        return False
+    return _LONG_NUMBER in text.translate(_DIGITS)
+
+
+def loads(text):
+    """
+    Decode a JSON text, given as a str or as bytes.
+    Raise a ValueError if the text is not valid JSON.
+    The texts orjson cannot decode like the json module, like the integers
+    above 64 bits, NaN and Infinity, are decoded by the json module.
+    """
+    if _backend == ORJSON and not _has_long_number(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
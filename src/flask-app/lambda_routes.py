@@ -0,0 +1,23 @@
+import dogs
+import houses
+import login
+
+
+############################################################################
+#
+# Routes of the AWS Lambda handlers, by URL pattern, the same as the flask
+# app routes. They are used by the resto Lambda transport to call the
+# handlers directly, without the flask app:
+#
+#     Config(lambda_routes='lambda_routes:ROUTES')
+
+
+ROUTES = {
+    '/login': login.login_handler,
+    '/refresh_token': login.refresh_token_handler,
+    '/logout': login.logout_handler,
+    '/dogs': dogs.dogs_handler,
+    '/dogs/<int:id>': dogs.dogs_handler,
+    '/houses': houses.houses_handler,
+    '/houses/<int:id>': houses.houses_handler,
+}
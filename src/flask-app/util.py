@@ -1,10 +1,11 @@
-import json
 import traceback
 import enum
 from functools import wraps
 
 import marshmallow
 
+import json_codec
+
 
 ############################################################################
 #
@@ -90,7 +91,7 @@ def extract_json_body(event) -> dict:
         raise ExpectedProblemException('Missing POST JSON body.', ErrorCode.NO_JSON_BODY)
 
     try:
-        json_dict = json.loads(body)
+        json_dict = json_codec.loads(body)
     except Exception as e:
         raise ExpectedProblemException(f'Invalid POST JSON body: {body}. (Error: {e})', ErrorCode.INVALID_JSON_BODY)
 
@@ -141,7 +142,7 @@ def return_body(body: dict, status_code: int, headers: dict = None) -> dict:
     Create the dictionary to return the body of a web request, with optional headers.
     """
     # All these dictionary entries are specified by the AWS SAM framework.
-    result = { 'statusCode': status_code, 'body': json.dumps(body) }
+    result = { 'statusCode': status_code, 'body': json_codec.dumps(body) }
 
     # Note: normally, we would allow configuring the CORS headers.
     result_headers = {
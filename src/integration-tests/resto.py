@@ -1,7 +1,46 @@
 import requests
+import asyncio
+import atexit
 import json
 import enum
+import gzip
+import importlib
+import io
+import hashlib
 import os
+import collections
+import copy
+import heapq
+import math
+import multiprocessing
+import http.client
+import random
+import re
+import sys
+import threading
+import weakref
+import concurrent.futures
+import datetime
+import time
+import urllib.parse
+
+from urllib3.util.retry import Retry
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The JSON codec of the flask app, on the path when run by the manager.
+try:
+    import json_codec
+except ImportError:
+    json_codec = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 
 ############################################################################
@@ -21,28 +60,510 @@ class Config():
     Configurable parameters:
       - base_url: the base URL from which all other are relative.
                   defaults to http://localhost:3000
+      - cassette: the path of the file where the responses are recorded
+                  and from which they are replayed. See Cassette.
+                  defaults to the CASSETTE environment variable, if set.
+      - record: if the responses are recorded again instead of replayed.
+                defaults to true if the CASSETTE_RECORD environment variable is set to 1.
+      - pool_connections: the number of hosts whose connections are kept.
+      - pool_maxsize: the maximum number of connections kept per host.
+      - keep_alive: if the connections are kept open between the calls.
+      - retries: the number of times a request is retried after a connection error.
+      - backoff_factor: the factor of the exponential delay between the retries, in seconds.
+      - app: the WSGI app to which the requests are sent in-process, without
+             any server, or the name of its module and attribute, like
+             'example_app:app'. See WSGIAdapter.
+             defaults to the WSGI_APP environment variable, if set.
+      - lambda_routes: the dict of URL patterns, like '/dogs/<int:id>', to the
+                       AWS Lambda handlers to which the requests are sent
+                       in-process, bypassing the web app, or the name of its
+                       module and attribute. See LambdaAdapter.
+                       defaults to the LAMBDA_ROUTES environment variable, if set.
+
+    The configs with the same base URL and connection settings share their
+    requests sessions, so that their connections are reused. The sessions are
+    kept in a registry of the Config class, with one session per thread since
+    a session cannot be shared between threads.
     """
-    def __init__(self, base_url: str = None):
+    # Sessions of the calling thread, by base URL and connection settings.
+    _thread_sessions = threading.local()
+
+    # Base URL and connection settings of the open sessions of all the threads.
+    # The sessions of the threads that ended are forgotten.
+    _session_keys = weakref.WeakKeyDictionary()
+    _sessions_lock = threading.Lock()
+
+    def __init__(
+            self,
+            base_url: str = None,
+            cassette: str = None,
+            record: bool = None,
+            pool_connections: int = 10,
+            pool_maxsize: int = 10,
+            keep_alive: bool = True,
+            retries: int = 0,
+            backoff_factor: float = 0.0,
+            app = None,
+            lambda_routes: dict = None):
         if not base_url:
             base_url = _get_config('BACKENDURL', 'http://localhost:3000')
         self.base_url = base_url
+        if not cassette:
+            cassette = _get_config('CASSETTE')
+        if record is None:
+            record = (_get_config('CASSETTE_RECORD') == '1')
+        self.cassette = _get_cassette(cassette, record) if cassette else None
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        if not app:
+            app = _get_config('WSGI_APP')
+        self.app = _import_attribute(app) if isinstance(app, str) else app
+        if not lambda_routes:
+            lambda_routes = _get_config('LAMBDA_ROUTES')
+        self.lambda_routes = _import_attribute(lambda_routes) if isinstance(lambda_routes, str) else lambda_routes
 
     def build_full_url(self, url: str) -> str:
         full_url = self.base_url + url
         return full_url
 
+    def is_in_process(self) -> bool:
+        """
+        Verify if the requests are sent to a WSGI app or Lambda handlers in-process.
+        """
+        return bool(self.app or self.lambda_routes)
+
+    def get_session(self) -> requests.Session:
+        """
+        Get the requests session of the calling thread for the base URL and
+        connection settings, since a session cannot be shared between threads.
+        It is created on the first call.
+        """
+        key = self._session_key()
+        sessions = getattr(Config._thread_sessions, 'sessions', None)
+        if sessions is None:
+            sessions = Config._thread_sessions.sessions = {}
+        session = sessions.get(key)
+        if session is None or session not in Config._session_keys:
+            session = self._new_session()
+            sessions[key] = session
+            with Config._sessions_lock:
+                Config._session_keys[session] = key
+        return session
+
+    def close(self) -> None:
+        """
+        Close the sessions of all the threads for the base URL and connection
+        settings, and their connections, and the file of the cassette.
+        """
+        key = self._session_key()
+        with Config._sessions_lock:
+            sessions = [session for session, k in Config._session_keys.items() if k == key]
+            for session in sessions:
+                del Config._session_keys[session]
+        for session in sessions:
+            session.close()
+        if self.cassette:
+            self.cassette.close()
+
+    def sized_for(self, workers: int) -> 'Config':
+        """
+        Get a config whose connection pool keeps at least one connection per
+        worker. Return this config if its pool is already large enough, else
+        a copy with a larger pool_maxsize.
+        """
+        if self.pool_maxsize >= workers:
+            return self
+        config = copy.copy(self)
+        config.pool_maxsize = workers
+        return config
+
+    def _session_key(self) -> tuple:
+        routes = tuple(self.lambda_routes.items()) if self.lambda_routes else None
+        return (self.base_url, self.pool_connections, self.pool_maxsize, self.keep_alive, self.retries, self.backoff_factor, self.app, routes)
+
+    def _new_session(self) -> requests.Session:
+        """
+        Create a requests session tuned with the connection settings.
+        """
+        session = requests.Session()
+        if self.lambda_routes:
+            adapter = LambdaAdapter(self.lambda_routes)
+        elif self.app:
+            adapter = WSGIAdapter(self.app)
+        else:
+            # Without retries, keep the default of requests, which does not retry the reads
+            # so that their timeouts are raised as requests.ReadTimeout.
+            retries = Retry(total=self.retries, backoff_factor=self.backoff_factor) if self.retries else requests.adapters.DEFAULT_RETRIES
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+
+def _import_attribute(name: str):
+    """
+    Import a module attribute given by the name of its module and attribute, like 'example_app:app'.
+    Raise a ValueError if the name is not in that form.
+    """
+    module, _, attribute = name.partition(':')
+    if not module or not attribute:
+        raise ValueError(f'{name} is not the name of a module attribute, like module:attribute.')
+    return getattr(importlib.import_module(module), attribute)
+
+
+############################################################################
+#
+# In-process transport
+#
+# The requests can be sent straight to a WSGI app, like the flask app, in the
+# same process, without any server, or even straight to the AWS Lambda
+# handlers, without the web app. The adapters are transport adapters of the
+# requests session, so the calls receive the same requests responses as
+# through HTTP, and are compared the same way.
+
+
+class WSGIAdapter(requests.adapters.BaseAdapter):
+    """
+    Transport adapter of a requests session sending the requests to a WSGI app.
+    The cookies set by the app are not kept by the session.
+    """
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        start = time.perf_counter()
+        environ = _wsgi_environ(request)
+
+        status_line = []
+        headers = []
+        chunks = []
+        def start_response(status: str, response_headers: list, exc_info=None):
+            if exc_info and status_line:
+                raise exc_info[1].with_traceback(exc_info[2])
+            status_line[:] = [status]
+            headers[:] = response_headers
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        code, _, reason = status_line[0].partition(' ')
+        return _build_response(self, request, int(code), reason, headers, b''.join(chunks), start)
+
+    def close(self):
+        pass
+
+
+class LambdaAdapter(requests.adapters.BaseAdapter):
+    """
+    Transport adapter of a requests session calling AWS Lambda handlers.
+
+    The handler is chosen by the URL path, from a dict of URL patterns to
+    handlers. The patterns are like the flask routes: '/dogs/<int:id>' gives
+    the id as an integer path parameter, '/dogs/<name>' as a text. The handler
+    is given the same event as the AWS emulator of the flask app gives, and
+    its result is converted to a response like the emulator and flask do.
+    A request without a matching route receives a 404 response.
+    """
+    def __init__(self, routes: dict):
+        super().__init__()
+        self.routes = [(_compile_route(pattern), handler) for pattern, handler in routes.items()]
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(request.url)
+        path = urllib.parse.unquote(url.path)
+        for (regex, converters), handler in self.routes:
+            match = regex.fullmatch(path)
+            if match:
+                path_params = {k: converters[k](v) for k, v in match.groupdict().items()}
+                result = handler(_lambda_event(request, url, path_params), {})
+                break
+        else:
+            return _build_response(self, request, 404, 'NOT FOUND', [], b'', start)
+
+        body = result['body']
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+        for name, value in (result.get('headers') or {}).items():
+            # Like the flask app, make the relative locations absolute.
+            if name.lower() == 'location':
+                value = urllib.parse.urljoin(request.url, value)
+            headers.append((name, value))
+        code = result['statusCode']
+        return _build_response(self, request, code, http.client.responses.get(code, '').upper(), headers, body, start)
+
+    def close(self):
+        pass
+
+
+# Regular expressions and converters of the path parameters of the routes, by type.
+_ROUTE_CONVERTERS = {
+    'string': (r'[^/]+', str),
+    'int': (r'\d+', int),
+    'path': (r'.+', str),
+}
+
+
+def _compile_route(pattern: str) -> tuple:
+    """
+    Compile a route URL pattern into a regular expression and the converters of its path parameters.
+    """
+    regex = ''
+    converters = {}
+    pos = 0
+    for match in re.finditer(r'<(?:(\w+):)?(\w+)>', pattern):
+        kind, name = match.group(1) or 'string', match.group(2)
+        expr, converters[name] = _ROUTE_CONVERTERS[kind]
+        regex += re.escape(pattern[pos:match.start()]) + f'(?P<{name}>{expr})'
+        pos = match.end()
+    regex += re.escape(pattern[pos:])
+    return re.compile(regex), converters
+
+
+def _lambda_event(request: requests.PreparedRequest, url: urllib.parse.SplitResult, path_params: dict) -> dict:
+    """
+    Build the AWS Lambda event of a prepared request, like aws_emulator.get_event().
+    """
+    event = {
+        'httpMethod': request.method,
+    }
+    query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+    if query:
+        event['queryStringParameters'] = {k: v[0] for k, v in query.items()}
+    if request.headers:
+        event['headers'] = {k.title(): v for k, v in request.headers.items()}
+    content_type = request.headers.get('Content-Type', '').split(';')[0].strip()
+    if request.body is not None and (content_type == 'application/json' or content_type.endswith('+json')):
+        body = request.body
+        event['body'] = body.decode('utf-8') if isinstance(body, bytes) else body
+    if path_params:
+        event['pathParameters'] = path_params
+    return event
+
+
+def _build_response(
+        adapter: requests.adapters.BaseAdapter,
+        request: requests.PreparedRequest,
+        status_code: int,
+        reason: str,
+        headers: list,
+        content: bytes,
+        start: float) -> requests.Response:
+    """
+    Build the requests response of an in-process request.
+    The values of the repeated headers are joined by commas, like urllib3 does.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    for name, value in headers:
+        if name in response.headers:
+            value = response.headers[name] + ', ' + value
+        response.headers[name] = value
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = content
+    response._content_consumed = True
+    response.raw = io.BytesIO(content)
+    response.url = request.url
+    response.request = request
+    response.connection = adapter
+    response.elapsed = datetime.timedelta(seconds=time.perf_counter() - start)
+    return response
+
+
+def _wsgi_environ(request: requests.PreparedRequest) -> dict:
+    """
+    Build the WSGI environment of a prepared request.
+    """
+    url = urllib.parse.urlsplit(request.url)
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': urllib.parse.unquote_to_bytes(url.path).decode('latin-1'),
+        'QUERY_STRING': url.query,
+        'SERVER_NAME': url.hostname or 'localhost',
+        'SERVER_PORT': str(url.port or (443 if url.scheme == 'https' else 80)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': url.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ[key] = value
+        elif key != 'CONTENT_LENGTH':
+            environ['HTTP_' + key] = value
+    return environ
+
+
+############################################################################
+#
+# Recorded responses
+
+
+class RecordedResponse():
+    """
+    A response already read, either replayed from a cassette or received
+    by the asyncio client. It has the status_code, headers and content of
+    a requests response.
+    """
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _join_headers(headers) -> dict:
+    """
+    Convert the multi-dict headers of an aiohttp response to a dict, joining
+    the values of a repeated header with ', ', like requests does.
+    """
+    joined = requests.structures.CaseInsensitiveDict()
+    for name in headers.keys():
+        if name not in joined:
+            joined[name] = ', '.join(headers.getall(name))
+    return joined
+
+
+class Cassette():
+    """
+    Records the responses of the REST calls in a file and replays them.
+
+    The responses are kept by method, full URL, request parameters and JSON
+    body. The request headers are not part of the key, so that the
+    authorization tokens can change. Since the same request can get different
+    responses, for example before and after a POST, the responses of the same
+    request are replayed in the order they were recorded.
+
+    A request that was not recorded is sent to the server and its response
+    is recorded. When recording again, all the requests are sent to the server
+    and the earlier recordings are replaced. The file is compressed with gzip
+    when its name ends with .gz.
+
+    Each recorded response is appended to the file as a line of JSON, so that
+    recording a long suite does not rewrite the file. The file stays open
+    until the cassette is closed, at the latest when the program exits.
+    """
+    def __init__(self, path: str, record: bool = False):
+        self.path = path
+        self.record = record
+        self._responses = {}
+        self._replayed = collections.Counter()
+        self._lock = threading.Lock()
+        self._file = None
+        self._truncate = record
+        if not record and os.path.exists(path):
+            self._responses = self._load()
+        atexit.register(self.close)
+
+    def play(self, method: 'Method', url: str, params: dict, in_json, send):
+        """
+        Replay the next recorded response of a request to the full URL, or
+        call send to get the response from the server and record it.
+        """
+        key = json.dumps([method.name, url, params, in_json], sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            responses = self._responses.setdefault(key, [])
+            index = self._replayed[key]
+            self._replayed[key] += 1
+            if index < len(responses):
+                status_code, headers, body = responses[index]
+                return RecordedResponse(status_code, headers, body.encode('utf-8', 'surrogateescape'))
+
+        with send() as response:
+            recorded = RecordedResponse(response.status_code, dict(response.headers), response.content)
+        entry = (recorded.status_code, dict(recorded.headers), recorded.content.decode('utf-8', 'surrogateescape'))
+        with self._lock:
+            responses.append(entry)
+            self._append(key, entry)
+        return recorded
+
+    def close(self) -> None:
+        """
+        Close the file of the cassette. It is opened again to record other responses.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self) -> dict:
+        responses = {}
+        with self._open('rt') as f:
+            for line in f:
+                if line.strip():
+                    key, status_code, headers, body = json.loads(line)
+                    responses.setdefault(key, []).append((status_code, headers, body))
+        return responses
+
+    def _append(self, key: str, entry: tuple) -> None:
+        if self._file is None:
+            # The earlier recordings are only replaced by the first recorded response.
+            self._file = self._open('wt' if self._truncate else 'at')
+            self._truncate = False
+        self._file.write(json.dumps([key, *entry], separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def _open(self, mode: str):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode[0], encoding='utf-8')
+
+
+_cassettes = {}
+def _get_cassette(path: str, record: bool) -> Cassette:
+    """
+    Get the cassette of a file, shared by all the configurations using it.
+    """
+    key = (os.path.abspath(path), record)
+    if key not in _cassettes:
+        _cassettes[key] = Cassette(path, record)
+    return _cassettes[key]
+
 
 ############################################################################
 #
 # Expected responses
 
 
-_requests_session = None
-def _get_session() -> requests.Session:
-    global _requests_session
-    if not _requests_session:
-        _requests_session = requests.Session()
-    return _requests_session
+def _loads_json(content: bytes):
+    """
+    Decode a received JSON body, with the JSON codec of the flask app when it
+    can be imported, since it uses orjson when it is installed, and with the
+    json module otherwise.
+    """
+    if json_codec is not None:
+        return json_codec.loads(content)
+    return json.loads(content)
 
 
 class Method(enum.Enum):
@@ -52,6 +573,42 @@ class Method(enum.Enum):
     DELETE = 4
 
 
+class ListMatching(enum.Enum):
+    """
+    Strategy used to pair the expected and received list items that do not match perfectly.
+
+      - GREEDY: pair the items with the smallest differences first.
+      - OPTIMAL: find the pairing with the minimal total difference,
+                 considering only the best few candidates of each expected item.
+      - ORDERED: compare the items in order, reporting the items deleted
+                 from or inserted into the expected list and the items that
+                 changed in place. The items are never matched by key.
+      - FUZZY: like GREEDY, but for large lists, each expected item is only
+               compared with the few received items sharing the most of their
+               keys and values, found by locality-sensitive hashing. It is much
+               faster but may not find the closest items.
+    """
+    GREEDY = 1
+    OPTIMAL = 2
+    ORDERED = 3
+    FUZZY = 4
+
+
+class KeyedList(list):
+    """
+    Marker for an expected list whose items are matched by key.
+
+    The key is the name of a key of the items, or a tuple of the names
+    leading to a key in nested dicts. An expected item is only compared with
+    the received item having the same key value, or is reported missing if
+    there is none. The items without a key value, or with a wildcard one,
+    are matched like the items of other lists.
+    """
+    def __init__(self, key, items: list = ()):
+        list.__init__(self, items)
+        self.key = key
+
+
 class Expected():
     """
     Describe the expected response to a REST request.
@@ -67,6 +624,12 @@ class Expected():
             out_json: dict = None,
             out_json_strict: bool = True,
             status_code: int = 200,
+            list_matching: ListMatching = ListMatching.GREEDY,
+            list_candidates: int = 5,
+            list_key = None,
+            list_workers: int = 0,
+            instrument: bool = False,
+            diff_cache_size: int = 0,
             **kwargs):
         self.method = method
         self.url = url
@@ -77,21 +640,40 @@ class Expected():
         self.out_json = out_json
         self.out_json_strict = out_json_strict
         self.status_code = status_code
+        self.list_matching = list_matching
+        self.list_candidates = list_candidates
+        self.list_key = list_key
+        self.list_workers = list_workers
+        self.instrument = instrument
+        self.diff_cache = DiffCache(diff_cache_size) if diff_cache_size else None
+
+        self._compiled_json = None
+        self._compiled_headers = None
+        self.compile_headers()
 
         self.received_headers = {}
         self.received_json = {}
         self.received_code = 0
+        self.diff_stats = None
 
         for k, v in kwargs.items():
             setattr(self, k, v)
 
-    def call(self, config: Config) -> dict:
+    def call(self, config: Config, fail_fast: bool = False, compact: bool = False, max_entries: int = None) -> dict:
         """
         Call the rest API. Return the diff with the expected status code, JSON and headers.
+
+        With fail_fast, stop at the first difference without building the diff.
+        The status code is checked first, then the headers and then the JSON.
+        Return an empty dict if everything matches, else a dict with a single
+        item: either the status code pair or the expected headers or JSON.
+
+        With compact, return the diff as a Diff instead of a dict, keeping at
+        most max_entries differences. See Diff.
         """
         full_url = config.build_full_url(self.url)
 
-        session = _get_session()
+        session = config.get_session()
 
         methods = {
             Method.GET: session.get,
@@ -100,30 +682,149 @@ class Expected():
             Method.DELETE: session.delete,
         }
         meth = methods[self.method]
-        
-        with meth(full_url, params=self.params, headers=self.in_headers, json=self.in_json, stream=False) as response:
-            diff = {}
 
+        if config.cassette:
+            send = lambda: meth(full_url, params=self.params, headers=self.in_headers, json=self.in_json, stream=False)
+            response = config.cassette.play(self.method, full_url, self.params, self.in_json, send)
+        else:
+            response = meth(full_url, params=self.params, headers=self.in_headers, json=self.in_json, stream=False)
+
+        with response as response:
+            return self._diff_response(response, fail_fast, compact, max_entries)
+
+    async def async_call(
+            self,
+            config: Config,
+            fail_fast: bool = False,
+            compact: bool = False,
+            max_entries: int = None,
+            session = None) -> dict:
+        """
+        Call the rest API from asyncio. Return the same diff as call().
+
+        When aiohttp is installed, the request is sent with the given
+        aiohttp.ClientSession, whose connections are reused from one call to
+        the next, or else with a new session. Otherwise, or when the config
+        sends the requests in-process or has a cassette, call() is run in a
+        thread of the event loop executor.
+        """
+        if aiohttp is None or config.cassette or config.is_in_process():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: self.call(config, fail_fast, compact, max_entries))
+
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.async_call(config, fail_fast, compact, max_entries, session)
+
+        full_url = config.build_full_url(self.url)
+        async with session.request(
+                self.method.name, full_url, params=self.params, headers=self.in_headers, json=self.in_json) as response:
+            response = RecordedResponse(response.status, _join_headers(response.headers), await response.read())
+        return self._diff_response(response, fail_fast, compact, max_entries)
+
+    def _diff_response(self, response, fail_fast: bool, compact: bool, max_entries: int) -> dict:
+        """
+        Compare a received response with the expected one. See call().
+        """
+        diff = Diff(max_entries) if compact else {}
+
+        # A body identical to an earlier one reuses its decoded JSON and its comparison.
+        cache_key = self._diff_cache_key(response.content, fail_fast, compact, max_entries)
+        cached = self.diff_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self.received_json = cached[0]
+        else:
             try:
-                self.received_json = response.json()
+                self.received_json = _loads_json(response.content)
             except:
                 self.received_json = {}
-            self.received_headers = response.headers
-            self.received_code = response.status_code
+        self.received_headers = response.headers
+        self.received_code = response.status_code
+
+        if fail_fast:
+            first_diff = self._first_diff(lambda: self._compare_json(cache_key, cached, True))
+            if compact:
+                diff.update(first_diff)
+                return diff
+            return first_diff
 
-            diff.update(self.diff_json(self.received_json))
-            diff.update(self.diff_headers(self.received_headers))
+        diff.update(self._compare_json(cache_key, cached, False, Diff(max_entries) if compact else None))
+        diff.update(self.diff_headers(self.received_headers))
 
-            if self.received_code != self.status_code:
-                diff['status_code'] = (self.status_code, self.received_code)
+        if self.received_code != self.status_code:
+            diff.update({ 'status_code': (self.status_code, self.received_code) })
 
         return diff
 
-    def diff_json(self, received_json: dict ) -> dict:
+    def matches(self, config: Config) -> bool:
+        """
+        Call the rest API. Return True if the status code, JSON and headers
+        all match the expected ones. Stop at the first difference.
+        """
+        return not self.call(config, fail_fast=True)
+
+    def _first_diff(self, matches_json = None) -> dict:
+        """
+        Find the first difference with the received status code, headers and JSON.
+        The JSON is verified by calling matches_json, when given. See call().
+        """
+        if self.received_code != self.status_code:
+            return { 'status_code': (self.status_code, self.received_code) }
+        if not self.matches_headers(self.received_headers):
+            return { 'headers': self.out_headers }
+        if not (matches_json() if matches_json else self.matches_json(self.received_json)):
+            return { 'json': self.out_json }
+        return {}
+
+    def _diff_cache_key(self, content: bytes, fail_fast: bool, compact: bool = False, max_entries: int = None):
+        """
+        Create the key of a received body in the diff cache: the compiled
+        expectation, the hash of the body and the options changing the comparison.
+        Return None if there is no diff cache.
+        """
+        if self.diff_cache is None or type(content) is not bytes:
+            return None
+        options = (fail_fast, compact, max_entries if compact else None, self.out_json_strict, self.list_matching, self.list_candidates, _key_path(self.list_key))
+        return (self.compile_json(), hashlib.blake2b(content, digest_size=16).digest(), options)
+
+    def _compare_json(self, cache_key, cached, fail_fast: bool, diff: 'Diff' = None):
+        """
+        Compare the received JSON, unless the comparison was cached, and cache it.
+        Return the diff, or if it matches with fail_fast. With a Diff, the
+        differences are added to it, see diff_json().
+        """
+        if cached is not None:
+            self.diff_stats = None
+            return cached[1]
+        if fail_fast:
+            result = self.matches_json(self.received_json)
+        else:
+            result = self.diff_json(self.received_json, diff)
+        if cache_key is not None:
+            self.diff_cache.put(cache_key, (self.received_json, result))
+        return result
+
+    def diff_json(self, received_json: dict, diff: 'Diff' = None) -> dict:
         """
         Compare the received JSON to the expected one.
         Return a dictionary of differing items.
+
+        When a Diff is given, the differences are added to it as they are found
+        instead, stopping once it is full, and the Diff is returned. The nested
+        dicts are then compared without building their nested difference.
         """
+        if diff is not None:
+            compiled = self.compile_json() if self.out_json is not None else None
+            if compiled is None or type(compiled.root) is not _DictMatcher or type(received_json) is not dict:
+                diff.update(self.diff_json(received_json))
+                return diff
+            ctx = self._diff_context(compiled)
+            if self.out_json_strict:
+                _run_strict_diff(_compact_strict_dicts_frame(compiled.root, received_json, diff, ctx), ctx)
+            else:
+                _run_diff(_compact_frame(compiled.root, received_json, (), diff, None, ctx), ctx)
+            return diff
+
         if received_json is None:
             return {} if self.out_json is None else dict(self.out_json)
         
@@ -134,20 +835,88 @@ class Expected():
                 return {}
 
         diff = {}
+        compiled = self.compile_json()
+        ctx = self._diff_context(compiled)
+
+        if self.out_json_strict and type(compiled.root) is _DictMatcher and type(received_json) is dict:
+            expected_diff, _, rev_diff, _ = _run_strict_diff(_strict_dicts_frame(compiled.root, received_json, ctx), ctx)
+            diff.update(rev_diff)
+            diff.update(expected_diff)
+            return diff
 
         if self.out_json_strict:
-            rev_diff, _ = _diff_dicts(received_json, self.out_json)
+            rev_diff, _ = _diff_dicts(received_json, self.out_json, ctx)
             diff.update(rev_diff)
         
-        expected_diff, _ = _diff_dicts(self.out_json, received_json)
+        expected_diff, _ = _run_diff(_root_frame(compiled.root, received_json, ctx), ctx)
         diff.update(expected_diff)
         
         return diff
 
+    def matches_json(self, received_json: dict) -> bool:
+        """
+        Verify if the received JSON matches the expected one, stopping at the first difference.
+        Return the same as checking that diff_json() is empty, but much faster when it is not.
+        """
+        if received_json is None:
+            return not self.out_json
+
+        if self.out_json is None:
+            return not (self.out_json_strict and received_json)
+
+        compiled = self.compile_json()
+        ctx = self._diff_context(compiled)
+
+        # Like in diff_json(), a received dict is reversed as a dict, which
+        # always matches when empty. A non empty one never matches an
+        # expected document that is not a dict, whatever the direction.
+        if self.out_json_strict and type(received_json) is not dict:
+            return all(_run_strict_matches(_strict_values_matches_frame(compiled.root, received_json), ctx))
+        if self.out_json_strict and type(compiled.root) is _DictMatcher:
+            return all(_run_strict_matches(_strict_dicts_matches_frame(compiled.root, received_json, False), ctx))
+
+        return _run_matches(_root_matches_frame(compiled.root, received_json, ctx), ctx)
+
+    def _diff_context(self, compiled: '_CompiledExpectation') -> '_DiffContext':
+        """
+        Create the diff context used to compare the received JSON.
+        When instrumented, the statistics of the comparison are kept in diff_stats.
+        """
+        ctx = _DiffContext(self.list_matching, self.list_candidates, compiled.canonical_forms, self.list_key, self.list_workers)
+        if self.instrument:
+            ctx.stats = DiffStats(compiled.root)
+        self.diff_stats = ctx.stats
+        return ctx
+
+    def compile_json(self) -> '_CompiledExpectation':
+        """
+        Compile the expected JSON into a tree of matchers, on first use.
+        The compiled form is reused by all later calls, as long as out_json
+        and the list matching are not replaced. It must not be modified in place once used.
+        """
+        ordered = (self.list_matching == ListMatching.ORDERED)
+        if self._compiled_json is None or self._compiled_json.source is not self.out_json or self._compiled_json.ordered != ordered:
+            self._compiled_json = _CompiledExpectation(self.out_json, ordered)
+        return self._compiled_json
+
+    def compile_headers(self) -> list:
+        """
+        Lower-case the names of the expected headers and compile their values
+        into matchers, when the Expected is built. They are compiled again if
+        out_headers is replaced. Return the list of (lower-case name, matcher).
+        """
+        if self._compiled_headers is None or self._compiled_headers[0] is not self.out_headers:
+            headers = []
+            for k, v in (self.out_headers or {}).items():
+                headers.append((k.lower() if type(k) is str else k, _compile_simple(v)))
+            self._compiled_headers = (self.out_headers, headers)
+        return self._compiled_headers[1]
+
     def diff_headers(self, received_headers: dict) -> dict:
         """
         Compare the received headers to the expected ones.
-        Return a dictionary of differing items.
+        The header names are not case-sensitive.
+        Return a dictionary of differing items, by lower-case name.
         """
         if not received_headers:
             return {} if not self.out_headers else dict(self.out_headers)
@@ -155,206 +924,2926 @@ class Expected():
         if not self.out_headers:
             return {}
 
-        diff, _ = _diff_dicts(_lowercase_keys(self.out_headers), _lowercase_keys(received_headers))
+        diff = {}
+        for name, matcher in self.compile_headers():
+            value = _find_header(received_headers, name)
+            if value is _MISSING:
+                diff[name] = matcher.value
+            elif not _header_matches(matcher, value):
+                diff[name] = (matcher.value, value)
         
         return diff
 
+    def matches_headers(self, received_headers: dict) -> bool:
+        """
+        Verify if the received headers match the expected ones, stopping at the first difference.
+        """
+        if not received_headers or not self.out_headers:
+            return not self.out_headers
+
+        for name, matcher in self.compile_headers():
+            value = _find_header(received_headers, name)
+            if value is _MISSING or not _header_matches(matcher, value):
+                return False
+        return True
 
-############################################################################
-#
-# JSON diff helpers
 
+# Marker for a header or a dict key that was not received, or for a
+# difference without a received value, since None could be a received value.
+_MISSING = object()
 
-def _diff_values(expected, received) -> (object, int):
+
+def _find_header(received_headers: dict, name: str):
     """
-    Compare an expected value with a received one.
-    Return a pair containing the difference between the values and the size of the difference.
+    Find the value of a received header by its lower-case name, without
+    copying the received headers. The headers of the requests responses are
+    already case-insensitive, other dicts are searched by lower-case name.
+    Return _MISSING if there is no such header.
     """
-    if type(expected) is dict:
-        if type(received) is dict:
-            return _diff_dicts(expected, received)
-        sub_diff = received
-    elif type(expected) is list:
-        if type(received) is list: 
-            return _diff_lists(expected, received)
-        sub_diff = received
-    elif type(expected) is str:
-        if type(received) is str:
-            return _diff_str(expected, received)
-        sub_diff = (expected, received)
-    elif expected != received:
-        sub_diff = (expected, received)
-    else:
-        return (None, 0)
+    if isinstance(received_headers, requests.structures.CaseInsensitiveDict) or name in received_headers:
+        return received_headers.get(name, _MISSING)
+    for k, v in received_headers.items():
+        if type(k) is str and k.lower() == name:
+            return v
+    return _MISSING
+
+
+def _header_matches(matcher: '_Matcher', value) -> bool:
+    """
+    Verify if the value of a received header matches the expected one.
+    """
+    if matcher.is_text:
+        return bool(matcher.matches_value(value))
+    return matcher.value == value
+
 
-    return (sub_diff, _diff_size(received) + _diff_size(expected))
+############################################################################
+#
+# Concurrent calls
+#
+# Independent expected responses can be called concurrently from asyncio,
+# with a limit on the number of calls in progress, or from a pool of threads.
+# The asyncio calls share a single aiohttp session, when aiohttp is installed,
+# so that its connections are reused from one call to the next. The threads
+# each use their own requests session of the config.
+#
+# The same Expected must not be given twice, since it keeps the last received
+# response.
 
 
-def _diff_str(expected: str, received: str) -> (object, int):
+async def async_call_all(
+        expecteds: list,
+        config: Config,
+        concurrency: int = 10,
+        fail_fast: bool = False,
+        compact: bool = False,
+        max_entries: int = None) -> list:
     """
-    Compare an expected text with a received one.
+    Call the rest API of all the expected responses concurrently, with at
+    most the given number of calls in progress. Return the diffs in the same
+    order as the expected responses. See Expected.call().
+    """
+    semaphore = asyncio.Semaphore(concurrency)
 
-    If the expected text starts with '~', then the rest of the text only
-    needs to be contained in the received text.
+    async def call(exp: Expected, session):
+        async with semaphore:
+            return await exp.async_call(config, fail_fast, compact, max_entries, session)
 
-    If the expected text is '*', then it matches anything, including an empty text.
+    if aiohttp is None or config.cassette or config.is_in_process():
+        return await asyncio.gather(*[call(exp, None) for exp in expecteds])
 
-    Return a pair containing the difference between the values and the size of the difference.
-    For text we return both texts if they differ, else None. The size is always 2 when they differ.
-    """
-    if expected.startswith('~'):
-        matches = (expected[1:] in received)
-    elif received.startswith('~'):
-        matches = (received[1:] in expected)
-    elif expected == '*' or received == '*':
-        matches = True
-    else:
-        matches = (expected == received)
-    
-    if matches:
-        return (None, 0)
-    else:
-        return ((expected, received), 2)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        return await asyncio.gather(*[call(exp, session) for exp in expecteds])
 
 
-def _lowercase_keys(in_dict: dict) -> dict:
+def call_all(
+        expecteds: list,
+        config: Config,
+        concurrency: int = 10,
+        fail_fast: bool = False,
+        compact: bool = False,
+        max_entries: int = None) -> list:
     """
-    Create a new dict but with all string keys converted to lower-case.
+    Call the rest API of all the expected responses concurrently, from a new
+    asyncio event loop. Return the diffs in the same order. See async_call_all().
     """
-    lc_dict = {}
-    for k, v in in_dict.items():
-        if type(k) is str:
-            k = k.lower()
-        lc_dict[k] = k
-    return lc_dict
+    return asyncio.run(async_call_all(expecteds, config, concurrency, fail_fast, compact, max_entries))
 
 
-def _diff_dicts(expected: dict, received: dict) -> (dict, int):
+def run_batch(
+        expecteds: list,
+        config: Config,
+        workers: int = 4,
+        fail_fast: bool = False,
+        compact: bool = False,
+        max_entries: int = None) -> list:
     """
-    Compare an expected dictionary with a received one.
-    The extra keys in the received one are ignored.
-    Return a pair containing the difference between the dicts and the size of the difference.
+    Call the rest API of all the expected responses in a pool of threads.
+    Return the diffs in the same order as the expected responses. See
+    Expected.call().
+
+    Each thread uses its own session of the config, whose connection pool
+    is sized to keep at least one connection per worker. See Config.sized_for().
     """
-    diff = {}
-    size = 0
+    config = config.sized_for(workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(exp.call, config, fail_fast, compact, max_entries) for exp in expecteds]
+        return [future.result() for future in futures]
 
-    # Protect against None
-    if received is None:
-        return (None, 1)
 
-    for k, v in expected.items():
-        if k not in received:
-            diff[k] = v
-            size += _diff_size(v)
-        else:
-            rv = received[k]
-            sub_diff, sub_size = _diff_values(v, rv)
-            if sub_diff:
-                diff[k] = sub_diff
-                size += sub_size
+############################################################################
+#
+# Diff cache
 
-    return (diff, size)
 
-def _diff_size(value) -> int:
+class DiffCache():
     """
-    Calculate the size of an value.
-    It's the recursive size of all containers.
-    The existence of the value itself is always counted as one, so for example empty list have size 1.
+    Cache of the comparisons of received JSON bodies, kept by an Expected
+    built with a diff_cache_size.
+
+    The comparisons are kept by compiled expectation and by hash of the raw
+    received body, so that receiving a body identical to an earlier one
+    skips decoding and comparing it. The least recently used comparisons are
+    dropped once there are max_size of them. The cached decoded JSON and diffs
+    are shared by all the calls receiving the same body, so they must not be
+    modified.
+
+    The number of cache hits and misses are counted in hits and misses.
+    The cache can be shared by the threads of a load test. See run_load().
     """
-    size = 1
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the cached value of a key, or None, and count the hit or miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        """
+        Cache the value of a key, dropping the least recently used one when full.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop all the cached values and reset the hit and miss counts.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
 
-    if type(value) is dict:
-        for k, v in value.items():
-            size += _diff_size(v)
-    elif type(value) is list:
-        for v in value:
-            size += _diff_size(v)
+    def __len__(self) -> int:
+        return len(self._entries)
 
-    return size
+
+############################################################################
+#
+# Load testing
+#
+# A closed-loop load test replays a weighted mix of expected responses with
+# a number of virtual users during a given time. Each virtual user is a thread
+# calling one expected response after the other, waiting for each response
+# before sending the next request, so the load adapts to the server speed.
+#
+# The latencies are kept in histograms with a bounded relative error, like
+# HDR histograms, so that the percentiles are precise without keeping every
+# latency, and the histograms of the virtual users can be merged.
 
 
-def _diff_lists(expected: list, received: list) -> list:
+class LatencyHistogram():
     """
-    Compare an expected list with a received one.
-    The extra items in the received one are ignored.
-    Return a pair containing the difference between the lists and the size of the difference.
+    Histogram of latencies, recorded in microseconds.
+
+    The latencies are counted in buckets by powers of two, each divided into
+    2 ** sub_bucket_bits linear sub-buckets, so that the relative error of
+    the percentiles is at most 2 ** (1 - sub_bucket_bits), about 1.6% with
+    the default 7 bits.
     """
-    diff = []
-    size = 0
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self._counts = collections.Counter()
+
+    def record(self, seconds: float) -> None:
+        """
+        Record a latency, in seconds.
+        """
+        value = max(0, int(seconds * 1000000))
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        self._counts[(shift, value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """
+        Add the latencies recorded in another histogram with the same sub-buckets.
+        """
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError('The histograms must have the same number of sub-buckets to be merged.')
+        self._counts.update(other._counts)
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Get the latency, in seconds, below which the given percent of the
+        latencies are, rounded up to its sub-bucket. Return 0 when empty.
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        # The buckets sorted by shift, then sub-bucket, are sorted by latency.
+        for (shift, sub), count in sorted(self._counts.items()):
+            seen += count
+            if seen >= target:
+                return min(((sub + 1) << shift) - 1, self.max) / 1000000
+        return self.max / 1000000
+
+    def mean(self) -> float:
+        """
+        Get the mean latency, in seconds. Return 0 when empty.
+        """
+        return self.total / self.count / 1000000 if self.count else 0.0
 
-    # Protect from being passed None
-    if received is None:
-        return (None, 1)
 
-    # We will be tracking each item that is already matched.
-    expected_matched = [False for e in expected]
-    received_matched = [False for r in received]
+class LoadStats():
+    """
+    Statistics of the calls of one expected response of a load test.
 
-    # First, we do perfect matches, keeping track of best matches.
-    # For each item, we keep a list of tuples (best match size, best match index)
-    # Perfect matches will be recorded in the _matched list above.
-    expected_matches = [[] for e in expected]
-    for ei in range(0, len(expected)):
-        v = expected[ei]
-        for ri in range(0, len(received)):
-            # Verify if the received item has already been perfectly matched.
-            if received_matched[ri]:
-                continue
+      - label: the method and URL of the expected response.
+      - calls: the number of calls.
+      - errors: the number of calls that raised an exception, like a connection error.
+      - diffs: the number of calls whose response differed from the expected one.
+      - latencies: the LatencyHistogram of the calls, including the errors.
+    """
+    def __init__(self, label: str):
+        self.label = label
+        self.calls = 0
+        self.errors = 0
+        self.diffs = 0
+        self.latencies = LatencyHistogram()
 
-            # Try to perfectly match the expected and received item.
-            # If we find a perfect match, keep only that match in the list of matches.
-            rv = received[ri]
-            sub_diff, sub_size = _diff_values(v, rv)
-            if not sub_diff:
-                received_matched[ri] = True
-                expected_matched[ei] = True
-                expected_matches[ei] = [(0, ri)]
-                break
+    def merge(self, other: 'LoadStats') -> None:
+        self.calls += other.calls
+        self.errors += other.errors
+        self.diffs += other.diffs
+        self.latencies.merge(other.latencies)
 
-            # Record the imperfect match size.
-            expected_matches[ei].append((sub_size, ri))
+    def error_rate(self) -> float:
+        return self.errors / self.calls if self.calls else 0.0
 
-    # Now, we do imperfect matches.
+    def diff_rate(self) -> float:
+        return self.diffs / self.calls if self.calls else 0.0
 
-    # Sort all matches in order of difference sizes.
-    best_matches = []
-    for ei in range(0, len(expected)):
-        matches = expected_matches[ei]
-        for match in matches:
-            best_matches.append((match[0], ei, match[1]))
-    best_matches.sort()
 
-    # In the best match order, compare the expected value and its best-matching received value.
-    # Only use each value once.
-    for bm in best_matches:
-        ei = bm[1]
-        if expected_matched[ei]:
-            continue
+class LoadReport():
+    """
+    Result of a load test: the LoadStats of each expected response of the
+    mix, in the same order, their total and the duration in seconds.
+    """
+    def __init__(self, stats: list, duration: float):
+        self.stats = stats
+        self.duration = duration
+        self.total = LoadStats('total')
+        for s in stats:
+            self.total.merge(s)
+
+    def throughput(self, stats: LoadStats = None) -> float:
+        """
+        Get the number of calls per second, of the given stats or of all the calls.
+        """
+        stats = stats or self.total
+        return stats.calls / self.duration if self.duration else 0.0
 
-        ri = bm[2]
-        if received_matched[ri]:
-            continue
+    def format(self) -> str:
+        """
+        Format the report as a text table, with the latencies in milliseconds.
+        """
+        lines = [f'{"expected":<32} {"calls":>8} {"calls/s":>9} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9} {"errors":>7} {"diffs":>7}']
+        for s in self.stats + [self.total]:
+            h = s.latencies
+            lines.append(
+                f'{s.label[:32]:<32} {s.calls:>8} {self.throughput(s):>9.1f} '
+                f'{h.percentile(50) * 1000:>9.2f} {h.percentile(90) * 1000:>9.2f} {h.percentile(99) * 1000:>9.2f} '
+                f'{h.max / 1000:>9.2f} {s.error_rate():>7.1%} {s.diff_rate():>7.1%}')
+        return '\n'.join(lines)
 
-        v = expected[ei]
-        rv = received[ri]
 
-        sub_diff, sub_size = _diff_values(v, rv)
-        diff.append(sub_diff)
-        size += sub_size
+def run_load(mix: list, config: Config, users: int = 10, duration: float = 10.0, seed: int = None) -> LoadReport:
+    """
+    Run a closed-loop load test: each of the virtual users calls expected
+    responses chosen at random from the mix, one after the other, until the
+    duration in seconds has passed. The mix is a list of pairs of an Expected
+    and its weight. Return the LoadReport.
+
+    The responses are only verified up to their first difference. Each
+    virtual user calls its own copies of the expected responses, which
+    share their compiled JSON and their diff cache.
+    """
+    expecteds = [exp for exp, weight in mix]
+    weights = [weight for exp, weight in mix]
+    for exp in expecteds:
+        exp.compile_json()
+
+    def virtual_user(user: int, deadline: float) -> list:
+        rng = random.Random(None if seed is None else seed + user)
+        copies = [copy.copy(exp) for exp in expecteds]
+        stats = [LoadStats(_load_label(exp)) for exp in expecteds]
+        while time.perf_counter() < deadline:
+            i = rng.choices(range(len(copies)), weights)[0]
+            start = time.perf_counter()
+            try:
+                diff = copies[i].call(config, fail_fast=True)
+            except Exception:
+                stats[i].errors += 1
+            else:
+                stats[i].diffs += bool(diff)
+            stats[i].calls += 1
+            stats[i].latencies.record(time.perf_counter() - start)
+        return stats
+
+    config = config.sized_for(users)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(virtual_user, user, start + duration) for user in range(users)]
+        user_stats = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    stats = [LoadStats(_load_label(exp)) for exp in expecteds]
+    for per_user in user_stats:
+        for s, u in zip(stats, per_user):
+            s.merge(u)
+    return LoadReport(stats, elapsed)
+
+
+def _load_label(exp: Expected) -> str:
+    return f'{exp.method.name} {exp.url}'
+
+
+############################################################################
+#
+# Compact differences
+
+
+class DiffEntry(collections.namedtuple('DiffEntry', ('path', 'expected', 'received'))):
+    """
+    A single difference of a Diff: the JSON pointer of the differing value,
+    along with its expected value and its received value.
+    """
+    __slots__ = ()
+
+
+class _Index(int):
+    """
+    Marker for the index of a list item in the path of a difference, so that
+    integer keys of dicts are not mistaken for list indexes.
+    """
+    __slots__ = ()
+
+
+class Diff():
+    """
+    Compact form of the difference between an expected value and a received one.
+
+    The difference is kept as a flat list of differing values, each with the
+    path leading to it, instead of the nested dicts and lists mirroring the
+    compared values. The differences can be iterated as DiffEntry, giving the
+    JSON pointer of each value (RFC 6901), like '/dogs/0/name'. The nested
+    form, as returned by Expected.diff_json(), is only built when asked for
+    with to_nested().
+
+    The pairs of (expected, received) values give the expected and received
+    values of an entry. Other values, like the missing keys, are given as the
+    expected value, received as None. The list indexes in the paths are the
+    indexes in the nested difference, since the items of unordered lists are
+    paired whatever their order.
+
+    With max_entries, only the first differences are kept. The truncated
+    attribute tells if some were dropped. Expected.diff_json() adds the
+    differences as it finds them and stops comparing once one is dropped.
+    """
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries
+        self.truncated = False
+        self._entries = []
+        self._keys = set()
+        self._nested = None
+
+    def update(self, nested) -> None:
+        """
+        Add the differences of a nested difference, as returned by
+        Expected.diff_json(), diff_headers() or call(), or of another Diff.
+        Like dict.update(), the differences under a key of the nested
+        difference replace the earlier ones under the same key.
+        """
+        if type(nested) is Diff:
+            self._remove_keys(nested._keys)
+            for entry in nested._entries:
+                self._append(*entry)
+            if nested.truncated:
+                self.truncated = True
+        elif nested:
+            if type(nested) is dict:
+                self._remove_keys(nested.keys())
+            self._add((), nested)
+
+    def _remove_keys(self, keys) -> None:
+        """
+        Remove the differences under the given keys of the nested difference.
+        """
+        if self._keys.isdisjoint(keys):
+            return
+        keys = set(keys)
+        self._entries = [e for e in self._entries if not (e[0] and e[0][0] in keys)]
+        self._keys -= keys
+        self._nested = None
+
+    def _add(self, path: tuple, nested) -> None:
+        """
+        Add the differences of a nested difference found at the given path.
+        """
+        # Walk the nested difference in order, without recursion, like the
+        # diff helpers. The items are pushed in reverse since the last pushed
+        # item is the first one popped.
+        stack = [(path, nested)]
+        while stack:
+            path, value = stack.pop()
+            tv = type(value)
+            if (tv is dict or tv is list or tv is KeyedList) and value:
+                if tv is dict:
+                    items = [(path + (k,), v) for k, v in value.items()]
+                else:
+                    items = [(path + (_Index(i),), v) for i, v in enumerate(value)]
+                items.reverse()
+                stack.extend(items)
+            elif tv is tuple and len(value) == 2:
+                self._append(path, value[0], value[1])
+            else:
+                self._append(path, value, _MISSING)
+            if self.truncated:
+                return
+
+    def _append(self, path: tuple, expected, received) -> None:
+        """
+        Add a single difference, unless there are already max_entries.
+        The received value is _MISSING for a difference given as a single value.
+        """
+        if self.max_entries is not None and len(self._entries) >= self.max_entries:
+            self.truncated = True
+            return
+        self._nested = None
+        self._entries.append((path, expected, received))
+        if path:
+            self._keys.add(path[0])
+
+    @property
+    def entries(self) -> list:
+        """
+        The list of all the differences, as DiffEntry.
+        """
+        return list(self)
+
+    def __iter__(self):
+        for path, expected, received in self._entries:
+            yield DiffEntry(_json_pointer(path), expected, None if received is _MISSING else received)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __repr__(self) -> str:
+        return 'Diff(%r)' % (self.entries,)
+
+    def to_nested(self):
+        """
+        Convert to the nested form of the difference, as returned by
+        Expected.diff_json(). It is built on first use and then kept.
+        """
+        if self._nested is not None:
+            return self._nested
+
+        if not self._entries:
+            self._nested = {}
+            return self._nested
+
+        # Each leaf is placed along its path, creating the containers leading
+        # to it: a list when the next part of the path is a list index, else a dict.
+        root = [] if self._entries[0][0] and type(self._entries[0][0][0]) is _Index else {}
+        for path, expected, received in self._entries:
+            value = expected if received is _MISSING else (expected, received)
+            if not path:
+                root = value
+                continue
+            container = root
+            for i in range(0, len(path) - 1):
+                key = path[i]
+                child = _nested_child(container, key)
+                if child is None:
+                    child = [] if type(path[i + 1]) is _Index else {}
+                    _set_nested_child(container, key, child)
+                container = child
+            _set_nested_child(container, path[-1], value)
+
+        self._nested = root
+        return root
+
+
+def _nested_child(container, key):
+    """
+    Get the child of a container being built by Diff.to_nested(), or None.
+    """
+    if type(container) is list:
+        return container[key] if key < len(container) else None
+    return container.get(key)
+
+
+def _set_nested_child(container, key, value) -> None:
+    """
+    Set the child of a container being built by Diff.to_nested().
+    """
+    if type(container) is list:
+        if key < len(container):
+            container[key] = value
+        else:
+            container.append(value)
+    else:
+        container[key] = value
+
+
+def _json_pointer(path: tuple) -> str:
+    """
+    Convert the path of a difference to a JSON pointer, escaping '~' and '/' in the keys.
+    """
+    return ''.join('/' + str(k).replace('~', '~0').replace('/', '~1') for k in path)
+
+
+############################################################################
+#
+# Diff statistics
+
+
+class DiffStats():
+    """
+    Statistics of the comparison of a received JSON with an expected one,
+    kept in Expected.diff_stats when the Expected is instrumented.
+
+      - comparisons: the number of pairs of values compared.
+      - text_matches: the number of texts matched against expected texts.
+      - size_computations: the number of values whose size was measured.
+      - largest_candidate_matrix: the largest number of pairs of list items
+                                  considered when pairing the items of a list.
+      - path_times: the time spent comparing each expected dict and list,
+                    in seconds by JSON pointer, including their nested values.
+                    A value compared many times, like a list item compared
+                    with many candidates, gets the total time.
+
+    The items of lists compared in a pool of processes are not counted.
+    """
+    def __init__(self, root: '_Matcher' = None):
+        self.comparisons = 0
+        self.text_matches = 0
+        self.size_computations = 0
+        self.largest_candidate_matrix = 0
+        self.path_times = {}
+        self._paths = _matcher_paths(root) if root is not None else {}
+        self._timers = []
+
+    def start_frame(self, expected: '_Matcher') -> None:
+        """
+        Start timing the comparison of an expected dict or list, or of the
+        whole JSON when None, which is timed under the empty JSON pointer.
+        """
+        path = '' if expected is None else self._paths.get(id(expected))
+        self._timers.append((path, time.perf_counter()))
+
+    def stop_frame(self) -> None:
+        """
+        Stop timing the comparison of the last expected dict or list started.
+        The comparisons of the values that are not part of the expected JSON are not kept.
+        """
+        path, start = self._timers.pop()
+        if path is not None:
+            self.path_times[path] = self.path_times.get(path, 0.0) + time.perf_counter() - start
+
+    def record_candidates(self, count: int) -> None:
+        """
+        Record the number of pairs of list items considered when pairing the items of a list.
+        """
+        if count > self.largest_candidate_matrix:
+            self.largest_candidate_matrix = count
+
+
+def _matcher_paths(root: '_Matcher') -> dict:
+    """
+    Find the JSON pointer of each dict and list matcher of a compiled expectation.
+    Return a dict of the JSON pointers by matcher identity.
+    """
+    paths = {}
+    stack = [(root, ())]
+    while stack:
+        matcher, path = stack.pop()
+        tm = type(matcher)
+        if tm is _DictMatcher:
+            paths[id(matcher)] = _json_pointer(path)
+            stack.extend((v, path + (k,)) for k, v in matcher.items)
+        elif tm is _ListMatcher:
+            paths[id(matcher)] = _json_pointer(path)
+            stack.extend((v, path + (i,)) for i, v in enumerate(matcher.items))
+    return paths
+
+
+############################################################################
+#
+# Compiled expectations
+#
+# The expected values are compiled into a tree of matchers. Each matcher
+# node knows how to compare its kind of value, and keeps the pre-calculated
+# size and fingerprint of its expected value. Texts using the wildcard
+# conventions get specialized matchers, and compiled regular expressions
+# (re.compile()) can be used as expected texts.
+
+
+class _Matcher():
+    """
+    Matcher for an expected simple value, like a number, a boolean or None.
+    It also is the base class of the other matchers.
+
+    Each matcher keeps the expected value itself, to report differences,
+    along with its diff size and its fingerprint.
+    """
+    __slots__ = ('value', 'size', 'fingerprint')
+
+    is_container = False
+    is_text = False
+
+    def __init__(self, value, size: int = 1, fingerprint = None):
+        self.value = value
+        self.size = size
+        self.fingerprint = fingerprint
+
+
+class _DictMatcher(_Matcher):
+    """
+    Matcher for an expected dictionary. Keeps the list of (key, matcher) of its items.
+    """
+    __slots__ = ('items',)
+
+    is_container = True
+
+    def __init__(self, value: dict, items: list, size: int, fingerprint):
+        _Matcher.__init__(self, value, size, fingerprint)
+        self.items = items
+
+
+class _ListMatcher(_Matcher):
+    """
+    Matcher for an expected list. Keeps the list of matchers of its items,
+    and the key by which they are matched, if any. See KeyedList.
+    """
+    __slots__ = ('items', 'key')
+
+    is_container = True
+
+    def __init__(self, value: list, items: list, size: int, fingerprint, key = None):
+        _Matcher.__init__(self, value, size, fingerprint)
+        self.items = items
+        self.key = key
+
+
+class _TextMatcher(_Matcher):
+    """
+    Matcher for an expected text that must be received exactly.
+
+    A received text can also use the wildcard conventions: if it starts
+    with '~', then the rest of the text only needs to be contained in the
+    expected text, and if it is '*', then it matches anything.
+    """
+    __slots__ = ()
+
+    is_text = True
+
+    def __init__(self, value: str):
+        _Matcher.__init__(self, value, 1, value)
+
+    def matches_value(self, received) -> bool:
+        """
+        Verify if the received value matches. Return None if it is not a text.
+        A received compiled regular expression is matched against the
+        expected text, like the other received wildcards.
+        """
+        if type(received) is str:
+            return self.matches(received)
+        elif type(received) is re.Pattern and type(self.value) is str:
+            return received.search(self.value) is not None
+        else:
+            return None
+
+    def matches(self, received: str) -> bool:
+        if received.startswith('~'):
+            return received[1:] in self.value
+        return received == self.value or received == '*'
+
+
+class _AnyTextMatcher(_TextMatcher):
+    """
+    Matcher for the expected text '*', which matches any text, including an empty text.
+    """
+    __slots__ = ()
+
+    def __init__(self, value: str):
+        _Matcher.__init__(self, value)
+
+    def matches(self, received: str) -> bool:
+        if received.startswith('~'):
+            return received[1:] in self.value
+        return True
+
+
+class _ContainsTextMatcher(_TextMatcher):
+    """
+    Matcher for an expected text starting with '~'. The rest of the
+    text only needs to be contained in the received text.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, value: str):
+        _Matcher.__init__(self, value)
+        self.text = value[1:]
+
+    def matches(self, received: str) -> bool:
+        return self.text in received
+
+
+class _PatternMatcher(_TextMatcher):
+    """
+    Matcher for an expected compiled regular expression.
+    It matches the received texts in which the pattern is found.
+    Use ^ and $ in the pattern to match the whole text.
+    """
+    __slots__ = ()
+
+    def __init__(self, value: re.Pattern):
+        _Matcher.__init__(self, value)
+
+    def matches(self, received: str) -> bool:
+        return self.value.search(received) is not None
+
+
+class _CompiledExpectation():
+    """
+    The compiled form of an expected value, with the canonical forms used to
+    number the fingerprints of its containers. See _DiffContext.
+    The fingerprints of the lists depend on the order of their items when ordered.
+    """
+    def __init__(self, source, ordered: bool = False):
+        self.source = source
+        self.ordered = ordered
+        self.canonical_forms = {}
+        self.root = _compile(source, self.canonical_forms, ordered)
+
+
+# Types of the expected values that are compiled into container matchers.
+_CONTAINER_TYPES = (dict, list, KeyedList)
+
+
+def _compile(value, canonical_forms: dict, ordered: bool = False) -> _Matcher:
+    """
+    Compile an expected value into a tree of matchers.
+    The fingerprints of the containers are numbered in the given canonical forms.
+    """
+    if type(value) not in _CONTAINER_TYPES:
+        return _compile_simple(value)
+
+    # Compile the containers in post-order, like _diff_size().
+    matchers = {}
+    stack = [(value, False)]
+    while stack:
+        container, children_done = stack.pop()
+        is_dict = (type(container) is dict)
+        if children_done:
+            items = []
+            size = 1
+            fps = []
+            for v in (container.values() if is_dict else container):
+                if type(v) in _CONTAINER_TYPES:
+                    item = matchers[id(v)]
+                else:
+                    item = _compile_simple(v)
+                items.append(item)
+                size += item.size
+                fps.append(item.fingerprint)
+            if is_dict:
+                fingerprint = _canonical_fingerprint(container.keys(), fps, canonical_forms)
+                items = list(zip(container.keys(), items))
+                matchers[id(container)] = _DictMatcher(container, items, size, fingerprint)
+            else:
+                fingerprint = _canonical_fingerprint(None, fps, canonical_forms, ordered)
+                key = _key_path(container.key) if type(container) is KeyedList else None
+                matchers[id(container)] = _ListMatcher(container, items, size, fingerprint, key)
+        elif id(container) not in matchers:
+            stack.append((container, True))
+            for v in (container.values() if is_dict else container):
+                if type(v) in _CONTAINER_TYPES and id(v) not in matchers:
+                    stack.append((v, False))
+
+    return matchers[id(value)]
+
+
+def _compile_simple(value) -> _Matcher:
+    """
+    Compile an expected value that is neither a dict nor a list into a matcher.
+    """
+    if type(value) is str:
+        if value.startswith('~'):
+            return _ContainsTextMatcher(value)
+        elif value == '*':
+            return _AnyTextMatcher(value)
+        else:
+            return _TextMatcher(value)
+    elif type(value) is re.Pattern:
+        return _PatternMatcher(value)
+    else:
+        return _Matcher(value, 1, _fingerprint(value, None))
+
+
+############################################################################
+#
+# JSON diff helpers
+#
+# The diff helpers compare deeply nested values without recursion, so that
+# deep documents do not hit the Python recursion limit. Comparing two dicts
+# or two lists is done by a frame: a generator that yields each pair of
+# (expected matcher, received value) it needs compared and receives back the
+# pair of (difference, size). The frames are kept on an explicit stack by
+# _run_diff(), which compares the simple values directly and only creates
+# new frames for nested dicts and lists.
+
+
+class _DiffContext():
+    """
+    Options and caches shared by the diff helpers while they compare two values.
+
+    The sizes and fingerprints of the dicts and lists are cached by object
+    identity, so each sub-tree is measured only once. This is only valid while
+    the compared values are alive and unmodified, so a context must not
+    outlive a diff.
+
+    The canonical forms of the dicts and lists are numbered, so that the
+    fingerprint of a container only refers to the numbers of its nested
+    containers. This keeps fingerprints flat, however deep the values are.
+    The numbering starts from a copy of the canonical forms of a compiled
+    expectation, so that its fingerprints can be compared with received ones.
+
+    The list key is the key by which the items of all lists are matched,
+    unless a list has its own. See KeyedList. When the lists are ordered,
+    their fingerprints depend on the order of their items.
+
+    With more than one list worker, the items of large lists are compared
+    in a pool of that many processes. See _score_pairs_in_pool().
+
+    The statistics of the comparison are kept in stats when given. See DiffStats.
+    """
+    def __init__(self, list_matching: ListMatching = ListMatching.GREEDY, list_candidates: int = 5, canonical_forms: dict = None, list_key = None, list_workers: int = 0):
+        self.list_matching = list_matching
+        self.list_candidates = list_candidates
+        self.list_key = _key_path(list_key)
+        self.list_workers = list_workers
+        self.stats = None
+        self.ordered = (list_matching == ListMatching.ORDERED)
+        self.sizes = {}
+        self.fingerprints = {}
+        self.canonical_forms = dict(canonical_forms) if canonical_forms else {}
+
+
+def _diff_values(expected, received, ctx: _DiffContext = None) -> (object, int):
+    """
+    Compare an expected value with a received one.
+    Return a pair containing the difference between the values and the size of the difference.
+    """
+    if ctx is None:
+        ctx = _DiffContext()
+    return _run_diff(_values_frame(_compile(expected, ctx.canonical_forms, ctx.ordered), received), ctx)
+
+
+def _diff_dicts(expected: dict, received: dict, ctx: _DiffContext = None) -> (dict, int):
+    """
+    Compare an expected dictionary with a received one.
+    The extra keys in the received one are ignored.
+    Return a pair containing the difference between the dicts and the size of the difference.
+    """
+    if ctx is None:
+        ctx = _DiffContext()
+    return _run_diff(_dicts_frame(_compile(expected, ctx.canonical_forms, ctx.ordered), received, ctx), ctx)
+
+
+def _diff_lists(expected: list, received: list, ctx: _DiffContext = None) -> list:
+    """
+    Compare an expected list with a received one.
+    The extra items in the received one are ignored.
+    Identical items are paired first through their fingerprints, so only the
+    left-over items need to be compared pair by pair.
+    Return a pair containing the difference between the lists and the size of the difference.
+    """
+    if ctx is None:
+        ctx = _DiffContext()
+    return _run_diff(_lists_frame(_compile(expected, ctx.canonical_forms, ctx.ordered), received, ctx), ctx)
+
+
+def _run_diff(frame, ctx: _DiffContext, timed: bool = True) -> (object, int):
+    """
+    Run a diff frame and all the frames it needs, using an explicit stack.
+    Return the pair containing the difference and the size of the difference
+    returned by the initial frame.
+    The initial frame is timed as the whole JSON, unless timed is False,
+    for a frame whose comparison is already timed.
+    """
+    fingerprints = ctx.fingerprints
+    stats = ctx.stats
+    if stats is not None and timed:
+        stats.start_frame(None)
+    stack = [frame]
+    result = None
+    while stack:
+        try:
+            expected, received = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            if stats is not None and (stack or timed):
+                stats.stop_frame()
+            continue
+
+        if stats is not None:
+            stats.comparisons += 1
+
+        # Compare the simple values directly. For two dicts or two lists,
+        # start a new frame, unless their fingerprints tell they are identical.
+        # Only the fingerprints already cached by the list frames are used,
+        # since calculating new ones would cost as much as comparing them.
+        # The result of the new frame will be sent to the waiting frame.
+        tm = type(expected)
+        tr = type(received)
+        if tm is _DictMatcher or tm is _ListMatcher:
+            if (tm is _DictMatcher and tr is dict) or (tm is _ListMatcher and (tr is list or tr is KeyedList)):
+                fp = expected.fingerprint
+                if fp is not None and fp == fingerprints.get(id(received)):
+                    result = ({}, 0) if tr is dict else ([], 0)
+                    continue
+                elif tr is dict:
+                    stack.append(_dicts_frame(expected, received, ctx))
+                    result = None
+                else:
+                    stack.append(_lists_frame(expected, received, ctx))
+                    result = None
+                if stats is not None:
+                    stats.start_frame(expected)
+                continue
+            sub_diff = received
+        elif expected.is_text:
+            if stats is not None:
+                stats.text_matches += 1
+            matches = expected.matches_value(received)
+            if matches:
+                result = (None, 0)
+                continue
+            elif matches is not None:
+                result = ((expected.value, received), 2)
+                continue
+            sub_diff = (expected.value, received)
+        elif expected.value != received:
+            sub_diff = (expected.value, received)
+        else:
+            result = (None, 0)
+            continue
+
+        result = (sub_diff, _diff_size(received, ctx) + expected.size)
+
+    return result
+
+
+def _values_frame(expected: _Matcher, received):
+    """
+    Diff frame comparing an expected value with a received one.
+    """
+    return (yield (expected, received))
+
+
+def _root_frame(expected: _Matcher, received, ctx: _DiffContext):
+    """
+    Diff frame comparing an expected JSON document with a received one.
+    Like before the expectations were compiled, a document is compared as
+    a dict if it is expected to be one, whatever the received type is.
+    """
+    if type(expected) is _DictMatcher:
+        return _dicts_frame(expected, received, ctx)
+    else:
+        return _values_frame(expected, received)
+
+
+def _dicts_frame(expected: _DictMatcher, received: dict, ctx: _DiffContext):
+    """
+    Diff frame comparing an expected dictionary with a received one.
+    See _diff_dicts().
+    """
+    diff = {}
+    size = 0
+
+    # Protect against None
+    if received is None:
+        return (None, 1)
+
+    for k, v in expected.items:
+        if k not in received:
+            diff[k] = v.value
+            size += v.size
+        else:
+            # Equal simple values always match, so avoid yielding them.
+            rv = received[k]
+            if not v.is_container and v.value == rv:
+                continue
+            sub_diff, sub_size = yield (v, rv)
+            if sub_diff:
+                diff[k] = sub_diff
+                size += sub_size
+
+    return (diff, size)
+
+
+def _compact_frame(expected: _Matcher, received, path: tuple, diff: 'Diff', reversed_diff: 'Diff', ctx: _DiffContext):
+    """
+    Diff frame adding the differences between an expected value and a received
+    one straight to a Diff, along with their paths, instead of returning them.
+    It stops as soon as the Diff is full. See Expected.diff_json().
+
+    The nested dicts are walked by the frame itself, on its own stack, so
+    that it knows the path of each difference. The other values are yielded
+    like by _dicts_frame() and their difference is added at their path. This
+    includes the lists, since pairing their items needs the differences of
+    all the candidate pairs.
+
+    With a reversed Diff, the frame is run by _run_strict_diff() and adds the
+    reversed differences to it, including the extra keys of the received dicts.
+    """
+    fingerprints = ctx.fingerprints
+    stats = ctx.stats
+    strict = reversed_diff is not None
+
+    # A None on the stack marks the end of a dict whose comparison is timed.
+    stack = [(path, expected, received)]
+    while stack:
+        pair = stack.pop()
+        if pair is None:
+            stats.stop_frame()
+            continue
+        path, v, rv = pair
+        if rv is _MISSING:
+            diff._add(path, v.value)
+        elif type(v) is _DictMatcher and type(rv) is dict:
+            fp = v.fingerprint
+            if fp is not None and fp == fingerprints.get(id(rv)):
+                continue
+            if stats is not None and path:
+                stats.comparisons += 1
+                stats.start_frame(v)
+                stack.append(None)
+            # The keys are pushed in reverse since the last pushed one is the
+            # first one popped. Equal simple values always match.
+            items = []
+            for k, sub in v.items:
+                sub_rv = rv.get(k, _MISSING)
+                if sub.is_container or sub_rv is _MISSING or sub.value != sub_rv:
+                    items.append((path + (k,), sub, sub_rv))
+            items.reverse()
+            stack.extend(items)
+            if strict:
+                expected_keys = v.value
+                for k, sub_rv in rv.items():
+                    if k not in expected_keys:
+                        reversed_diff._add(path + (k,), sub_rv)
+        else:
+            result = yield (v, rv)
+            if result[0]:
+                diff._add(path, result[0])
+            if strict and result[2]:
+                reversed_diff._add(path, result[2])
+
+        if diff.truncated:
+            if stats is not None:
+                for pair in stack:
+                    if pair is None:
+                        stats.stop_frame()
+            return None
+
+    return None
+
+
+def _diff_size(value, ctx: _DiffContext = None) -> int:
+    """
+    Calculate the size of an value.
+    It's the recursive size of all containers.
+    The existence of the value itself is always counted as one, so for example empty list have size 1.
+    When given a diff context, the sizes of containers are cached in it.
+    """
+    if type(value) not in _CONTAINER_TYPES:
+        return 1
+
+    sizes = ctx.sizes if ctx is not None else {}
+    size = sizes.get(id(value))
+    if size is not None:
+        return size
+
+    if ctx is not None and ctx.stats is not None:
+        ctx.stats.size_computations += 1
+
+    # Measure the containers in post-order: a container is pushed a
+    # second time, marked as done, after all its sub-containers.
+    stack = [(value, False)]
+    while stack:
+        container, children_done = stack.pop()
+        items = container.values() if type(container) is dict else container
+        if children_done:
+            size = 1
+            for v in items:
+                if type(v) in _CONTAINER_TYPES:
+                    size += sizes[id(v)]
+                else:
+                    size += 1
+            sizes[id(container)] = size
+        elif id(container) not in sizes:
+            stack.append((container, True))
+            for v in items:
+                if type(v) in _CONTAINER_TYPES and id(v) not in sizes:
+                    stack.append((v, False))
+
+    return sizes[id(value)]
+
+
+def _is_wildcard(text: str) -> bool:
+    """
+    Verify if a text is a wildcard, that is a text that can match other texts.
+    See _TextMatcher and its sub-classes for the wildcard conventions.
+    """
+    return text == '*' or text.startswith('~')
+
+
+def _fingerprint(value, ctx: _DiffContext):
+    """
+    Calculate the fingerprint of a value.
+
+    The fingerprint is a hashable canonical form of the value. Two values
+    with equal fingerprints in the same diff context are guaranteed to be a
+    perfect match. Dicts are fingerprinted without regard to the order of
+    their keys and lists without regard to the order of their items, since
+    that is how they are compared.
+
+    Values containing wildcard texts can match different values, so they have
+    no fingerprint and must be compared item by item. For those, return None.
+    The fingerprints of containers are cached in the diff context. Simple
+    values do not need a diff context.
+    """
+    if type(value) is str:
+        return None if _is_wildcard(value) else value
+    elif value is None or type(value) in (int, float, bool):
+        return value
+    elif type(value) not in _CONTAINER_TYPES:
+        return None
+
+    fingerprints = ctx.fingerprints
+    if id(value) in fingerprints:
+        return fingerprints[id(value)]
+
+    # Fingerprint the containers in post-order, like _diff_size().
+    stack = [(value, False)]
+    while stack:
+        container, children_done = stack.pop()
+        is_dict = (type(container) is dict)
+        if children_done:
+            fps = []
+            for v in (container.values() if is_dict else container):
+                if type(v) in _CONTAINER_TYPES:
+                    fps.append(fingerprints[id(v)])
+                else:
+                    fps.append(_fingerprint(v, ctx))
+            keys = container.keys() if is_dict else None
+            fingerprints[id(container)] = _canonical_fingerprint(keys, fps, ctx.canonical_forms, ctx.ordered)
+        elif id(container) not in fingerprints:
+            stack.append((container, True))
+            for v in (container.values() if is_dict else container):
+                if type(v) in _CONTAINER_TYPES and id(v) not in fingerprints:
+                    stack.append((v, False))
+
+    return fingerprints[id(value)]
+
+
+def _canonical_fingerprint(keys, fps: list, canonical_forms: dict, ordered: bool = False):
+    """
+    Calculate the fingerprint of a container from the fingerprints of its items.
+    The keys are given for a dict and are None for a list.
+    The fingerprint is the number given to the canonical form of the container.
+    Return None if any item has no fingerprint.
+    """
+    if None in fps:
+        return None
+    elif keys is not None:
+        form = ('{}', frozenset(zip(keys, fps)))
+    elif ordered:
+        form = ('()', tuple(fps))
+    else:
+        form = ('[]', frozenset(collections.Counter(fps).items()))
+    return canonical_forms.setdefault(form, ('#', len(canonical_forms)))
+
+
+def _lists_frame(expected: _ListMatcher, received: list, ctx: _DiffContext):
+    """
+    Diff frame comparing an expected list with a received one.
+    See _diff_lists().
+    """
+    diff = []
+    size = 0
+
+    # Protect from being passed None
+    if received is None:
+        return (None, 1)
+
+    if ctx.ordered:
+        return (yield from _ordered_lists_frame(expected, received, ctx))
+
+    # Lists of numbers are compared all at once with NumPy, when it is available.
+    if ctx.list_matching == ListMatching.GREEDY and numpy is not None and len(received) >= _VECTORIZED_MIN_ITEMS:
+        vectorized = _diff_numbers(expected.value, received)
+        if vectorized is not None:
+            return vectorized
+
+    # We will be tracking each item that is already matched.
+    list_matcher = expected
+    expected = expected.items
+    expected_matched = [False for e in expected]
+    received_matched = [False for r in received]
+
+    # First, we pair the items that are identical, using their fingerprints.
+    # The received items are indexed by fingerprint, so this is linear.
+    # Each fingerprint keeps the received indexes in order, so that an
+    # expected item is paired with the first identical received item.
+    received_by_fingerprint = {}
+    for ri in range(0, len(received)):
+        fp = _fingerprint(received[ri], ctx)
+        if fp is not None:
+            received_by_fingerprint.setdefault(fp, collections.deque()).append(ri)
+
+    for ei in range(0, len(expected)):
+        fp = expected[ei].fingerprint
+        if fp is None:
+            continue
+        candidates = received_by_fingerprint.get(fp)
+        if candidates:
+            ri = candidates.popleft()
+            received_matched[ri] = True
+            expected_matched[ei] = True
+
+    # Next, when matching by key, the items are joined by their key values.
+    # An expected item is only compared with the received item with the same
+    # key value, if any, so these items no longer need any other match.
+    key = _list_key(list_matcher, received, ctx)
+    if key is not None:
+        for ei, ri in _pair_by_key(expected, received, expected_matched, received_matched, key):
+            if ri is None:
+                diff.append((expected[ei].value, None))
+                size += 1
+                continue
+            sub_diff, sub_size = yield (expected[ei], received[ri])
+            if sub_diff:
+                diff.append(sub_diff)
+                size += sub_size
+
+    if ctx.stats is not None:
+        ctx.stats.record_candidates(expected_matched.count(False) * received_matched.count(False))
+
+    # Then, we pair the left-over items. Lists of flat dicts with the same
+    # keys are compared column by column with NumPy, when it is available.
+    vectorized = None
+    if ctx.list_matching == ListMatching.GREEDY and numpy is not None:
+        vectorized = _pair_flat_dicts(expected, received, expected_matched, received_matched)
+    if vectorized is not None:
+        pairs, best_diffs = vectorized
+    else:
+        pairs, best_diffs = yield from _pair_left_over(expected, received, expected_matched, received_matched, ctx)
+
+    # Compare each expected value with its best-matching received value.
+    for ei, ri in pairs:
+        if ei in best_diffs and best_diffs[ei][1] == ri:
+            sub_size, _, sub_diff = best_diffs[ei]
+        else:
+            sub_diff, sub_size = yield (expected[ei], received[ri])
+        if sub_diff:
+            diff.append(sub_diff)
+            size += sub_size
 
         expected_matched[ei] = True
         received_matched[ri] = True
 
-    # If there were fewer received values than expected,
-    # pair the unmatched expected with None
+    # If there were fewer received values than expected,
+    # pair the unmatched expected with None
+    for ei in range(0, len(expected)):
+        if not expected_matched[ei]:
+            diff.append((expected[ei].value, None))
+            size += 1
+
+    return (diff, size)
+
+
+############################################################################
+#
+# Vectorized diff helpers
+#
+# Large lists of numbers, and of flat dicts with the same keys, are compared
+# with NumPy arrays instead of item by item. They give the same differences
+# as the list diff frame with the greedy matching. When NumPy is not
+# installed, or the lists are not homogeneous, the helpers return None and
+# the lists are compared item by item.
+
+
+# Minimum number of items, or of pairs of items, worth comparing with NumPy.
+_VECTORIZED_MIN_ITEMS = 64
+
+# Maximum number of pairs of flat dicts compared at once with NumPy.
+_VECTORIZED_MAX_PAIRS = 1 << 24
+
+# Types of the simple values that can be compared with NumPy.
+_NUMBER_TYPES = (int, float, bool)
+_SIMPLE_TYPES = (int, float, bool, str, type(None))
+
+# Largest integer that can be converted to a float without being rounded.
+_MAX_EXACT_FLOAT_INT = 1 << 53
+
+
+def _number_array(values: list):
+    """
+    Convert a list of numbers to a NumPy array, with the same equality as in Python.
+    Return None if they are not all numbers, if an integer does not fit, or
+    if a number is NaN, since NaN is only paired with itself in Python.
+    """
+    types = set(map(type, values))
+    if not types.issubset(_NUMBER_TYPES):
+        return None
+    try:
+        if float not in types:
+            return numpy.array(values, dtype=numpy.int64)
+        if int in types and any(type(v) is int and abs(v) > _MAX_EXACT_FLOAT_INT for v in values):
+            return None
+        array = numpy.array(values, dtype=numpy.float64)
+    except OverflowError:
+        return None
+    if numpy.isnan(array).any():
+        return None
+    return array
+
+
+def _common_arrays(expected, received):
+    """
+    Convert two number arrays to a common type, without rounding the integers.
+    Return None if they cannot be.
+    """
+    if expected.dtype == received.dtype:
+        return (expected, received)
+    for array in (expected, received):
+        if array.dtype == numpy.int64 and len(array) and numpy.abs(array).max() > _MAX_EXACT_FLOAT_INT:
+            return None
+    return (expected.astype(numpy.float64), received.astype(numpy.float64))
+
+
+def _left_over_mask(values, others):
+    """
+    Find the values left over after pairing each value with an equal one of
+    the others, in order. The n-th occurrence of a value is left over if the
+    others contain fewer than n occurrences of it.
+    """
+    order = numpy.argsort(values, kind='stable')
+    sorted_values = values[order]
+    ranks = numpy.empty(len(values), dtype=numpy.int64)
+    ranks[order] = numpy.arange(len(values)) - numpy.searchsorted(sorted_values, sorted_values, 'left')
+    sorted_others = numpy.sort(others)
+    counts = numpy.searchsorted(sorted_others, values, 'right') - numpy.searchsorted(sorted_others, values, 'left')
+    return ranks >= counts
+
+
+def _diff_numbers(expected: list, received: list) -> (list, int):
+    """
+    Compare a list of expected numbers with a list of received numbers.
+    The equal numbers are paired, then the left-over numbers are paired in order.
+    Return a pair containing the difference between the lists and the size of
+    the difference, or None if the lists are not both lists of numbers.
+    """
+    expected_array = _number_array(expected)
+    if expected_array is None:
+        return None
+    received_array = _number_array(received)
+    if received_array is None:
+        return None
+    arrays = _common_arrays(expected_array, received_array)
+    if arrays is None:
+        return None
+    expected_array, received_array = arrays
+
+    expected_left = numpy.flatnonzero(_left_over_mask(expected_array, received_array)).tolist()
+    received_left = numpy.flatnonzero(_left_over_mask(received_array, expected_array)).tolist()
+
+    diff = [(expected[ei], received[ri]) for ei, ri in zip(expected_left, received_left)]
+    diff.extend((expected[ei], None) for ei in expected_left[len(received_left):])
+    size = 2 * min(len(expected_left), len(received_left)) + max(0, len(expected_left) - len(received_left))
+    return (diff, size)
+
+
+def _column_arrays(expected: list, received: list):
+    """
+    Convert an expected and a received column of simple values to NumPy
+    arrays, with the same equality as in Python. The numbers are converted
+    to number arrays, the other values are kept in arrays of objects.
+    """
+    expected_array = _number_array(expected)
+    received_array = _number_array(received)
+    if expected_array is not None and received_array is not None:
+        arrays = _common_arrays(expected_array, received_array)
+        if arrays is not None:
+            return arrays
+
+    arrays = (numpy.empty(len(expected), dtype=object), numpy.empty(len(received), dtype=object))
+    arrays[0][:] = expected
+    arrays[1][:] = received
+    return arrays
+
+
+def _is_flat_value(value) -> bool:
+    """
+    Verify if a value can be compared in a column: a simple value with a fingerprint.
+    """
+    return type(value) in _SIMPLE_TYPES and not (type(value) is str and _is_wildcard(value))
+
+
+def _pair_flat_dicts(expected: list, received: list, expected_matched: list, received_matched: list):
+    """
+    Pair the left-over items of lists of flat dicts, like _pair_left_over() does.
+    The expected dicts must all have the same keys, and all the dicts must
+    only have simple values for these keys. The extra keys of the received
+    dicts are ignored. The differences of all the pairs are counted at once,
+    column by column.
+    Return None if the items are not such dicts or if there are too few or too many pairs.
+    """
+    expected_left = [ei for ei in range(0, len(expected)) if not expected_matched[ei]]
+    received_left = [ri for ri in range(0, len(received)) if not received_matched[ri]]
+    pair_count = len(expected_left) * len(received_left)
+    if pair_count < _VECTORIZED_MIN_ITEMS or pair_count > _VECTORIZED_MAX_PAIRS:
+        return None
+
+    expected_dicts = [expected[ei].value for ei in expected_left]
+    received_dicts = [received[ri] for ri in received_left]
+    if type(expected_dicts[0]) is not dict:
+        return None
+    keys = expected_dicts[0].keys()
+    for d in expected_dicts:
+        if type(d) is not dict or d.keys() != keys or not all(map(_is_flat_value, d.values())):
+            return None
+    for d in received_dicts:
+        if type(d) is not dict or not keys <= d.keys() or not all(_is_flat_value(d[k]) for k in keys):
+            return None
+
+    # Count the differing values of each pair of dicts.
+    counts = numpy.zeros((len(expected_dicts), len(received_dicts)), dtype=numpy.int32)
+    for k in keys:
+        expected_column, received_column = _column_arrays([d[k] for d in expected_dicts], [d[k] for d in received_dicts])
+        counts += (expected_column[:, None] != received_column[None, :])
+
+    # First, pair the perfect matches, each expected item with the first
+    # received item not already matched, like the diff frame does.
+    available = numpy.ones(len(received_dicts), dtype=bool)
+    unmatched = []
+    perfect_rows = (counts == 0).any(axis=1)
+    for i in range(0, len(expected_dicts)):
+        if perfect_rows[i]:
+            perfect = numpy.flatnonzero((counts[i] == 0) & available)
+            if len(perfect):
+                j = perfect[0]
+                available[j] = False
+                expected_matched[expected_left[i]] = True
+                received_matched[received_left[j]] = True
+                continue
+        unmatched.append(i)
+
+    # Then, pair the others in order of increasing difference sizes. The
+    # stable sort orders the equal sizes by expected index then received index.
+    columns = numpy.flatnonzero(available)
+    pairs = []
+    best_diffs = {}
+    if unmatched and len(columns):
+        sub_counts = counts[numpy.array(unmatched)][:, columns]
+        expected_paired = set()
+        received_paired = set()
+        for flat in numpy.argsort(sub_counts, axis=None, kind='stable').tolist():
+            i, j = divmod(flat, len(columns))
+            if i in expected_paired or j in received_paired:
+                continue
+            expected_paired.add(i)
+            received_paired.add(j)
+            ei = expected_left[unmatched[i]]
+            ri = received_left[columns[j]]
+            e = expected[ei].value
+            r = received[ri]
+            sub_diff = {}
+            for k, v in e.items():
+                if v != r[k]:
+                    sub_diff[k] = (v, r[k])
+            pairs.append((ei, ri))
+            best_diffs[ei] = (2 * len(sub_diff), ri, sub_diff)
+            if len(pairs) == min(len(unmatched), len(columns)):
+                break
+
+    return (pairs, best_diffs)
+
+
+############################################################################
+#
+# Parallel diff helpers
+#
+# When enabled with more than one list worker, the left-over items of large
+# lists are compared pair by pair in a pool of processes. Each process gets
+# a chunk of the expected items along with the received items, and gives
+# back the sizes of the differences of all their pairs. Lists with few pairs
+# are compared in-process, since sending them to the pool costs more than
+# comparing them.
+
+
+# Minimum number of pairs of items worth comparing in the pool of processes.
+_PARALLEL_MIN_PAIRS = 10000
+
+# Number of chunks of expected items given to each process of the pool.
+_PARALLEL_CHUNKS_PER_WORKER = 4
+
+
+# Pools of processes by number of workers, created on first use and shut
+# down when the program exits.
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Get the pool of processes with the given number of workers, shared by all
+    the threads. A pool is never replaced, since another thread could be using
+    it. The processes are not forked, since the callers can run in threads,
+    like in run_batch() or run_load(), and forking a threaded process is unsafe.
+    """
+    with _process_pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            if not _process_pools:
+                atexit.register(_shutdown_process_pools)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            pool = _process_pools[workers] = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context)
+        return pool
+
+
+def _shutdown_process_pools() -> None:
+    """
+    Shut down all the pools of processes and wait for their processes to end.
+    """
+    with _process_pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def _score_pairs(expected: list, received: list, list_matching: ListMatching, list_candidates: int, list_key) -> list:
+    """
+    Compare each expected value with each received value, in a process of the pool.
+    Return a list of the sizes of the differences with the received values
+    for each expected value, with None for the perfect matches.
+    """
+    ctx = _DiffContext(list_matching, list_candidates, None, list_key)
+    rows = []
+    for v in expected:
+        matcher = _compile(v, ctx.canonical_forms, ctx.ordered)
+        row = []
+        for rv in received:
+            sub_diff, sub_size = _run_diff(_values_frame(matcher, rv), ctx)
+            row.append(sub_size if sub_diff else None)
+        rows.append(row)
+    return rows
+
+
+def _score_pairs_in_pool(expected: list, received: list, expected_matched: list, received_matched: list, ctx: _DiffContext) -> dict:
+    """
+    Compare the unmatched expected items with the unmatched received items
+    in the pool of processes, when there are enough pairs.
+    Return a dict of the sizes of the differences with each unmatched received
+    index, with None for the perfect matches, by unmatched expected index.
+    Return None if the lists are compared in-process.
+    """
+    if ctx.list_workers <= 1:
+        return None
+
+    expected_left = [ei for ei in range(0, len(expected)) if not expected_matched[ei]]
+    received_left = [ri for ri in range(0, len(received)) if not received_matched[ri]]
+    if len(expected_left) * len(received_left) < _PARALLEL_MIN_PAIRS:
+        return None
+
+    pool = _get_process_pool(ctx.list_workers)
+    received_values = [received[ri] for ri in received_left]
+    chunk_size = -(-len(expected_left) // (ctx.list_workers * _PARALLEL_CHUNKS_PER_WORKER))
+    chunks = [expected_left[i:i + chunk_size] for i in range(0, len(expected_left), chunk_size)]
+    futures = [
+        pool.submit(_score_pairs, [expected[ei].value for ei in chunk], received_values, ctx.list_matching, ctx.list_candidates, ctx.list_key)
+        for chunk in chunks
+    ]
+
+    scores = {}
+    for chunk, future in zip(chunks, futures):
+        for ei, row in zip(chunk, future.result()):
+            scores[ei] = dict(zip(received_left, row))
+    return scores
+
+
+############################################################################
+#
+# Fuzzy list matching helpers
+#
+# With the fuzzy list matching, the candidates of each expected item are
+# found with MinHash locality-sensitive hashing. Each item is described by
+# the set of its tokens: the simple values it contains, along with the keys
+# leading to them. The MinHash signature of an item is the minimum of each
+# of a fixed set of hash functions over its tokens, so that two items have
+# the same value for a hash function with a probability equal to the ratio
+# of tokens they share. The signatures are cut in bands, and items with the
+# same values in a band are put in the same bucket. The received items
+# sharing the most buckets with an expected item are its candidates.
+
+
+# Minimum number of pairs of items worth finding candidates by hashing.
+_FUZZY_MIN_PAIRS = 1000
+
+# Number of bands of the MinHash signatures, and number of hash values in each band.
+_MINHASH_BANDS = 16
+_MINHASH_ROWS = 2
+
+# Prime modulo of the hash functions.
+_MINHASH_PRIME = (1 << 61) - 1
+
+
+def _minhash_functions() -> list:
+    """
+    Create the MinHash hash functions, (a * h + b) mod p, as pairs of (a, b).
+    They use a fixed seed so that the candidates are always the same for the same lists.
+    """
+    rng = random.Random(0)
+    return [(rng.randrange(1, _MINHASH_PRIME), rng.randrange(0, _MINHASH_PRIME)) for i in range(0, _MINHASH_BANDS * _MINHASH_ROWS)]
+
+
+_MINHASH_FUNCTIONS = _minhash_functions()
+
+
+def _item_tokens(value) -> set:
+    """
+    Find the tokens of a list item: a tuple of (keys, fingerprint) for each
+    of the simple values it contains. The list indexes are not part of the
+    keys, since the items of lists are compared in any order. The wildcard
+    texts have no tokens, since they can match any text, and None has the
+    token (keys, None).
+    """
+    tokens = set()
+    stack = [((), value)]
+    while stack:
+        keys, v = stack.pop()
+        tv = type(v)
+        if tv is dict:
+            stack.extend((keys + (k,), sub_v) for k, sub_v in v.items())
+        elif tv is list or tv is KeyedList:
+            stack.extend((keys, sub_v) for sub_v in v)
+        elif v is None:
+            tokens.add((keys, None))
+        else:
+            fp = _fingerprint(v, None)
+            if fp is not None:
+                tokens.add((keys, fp))
+    return tokens
+
+
+def _minhash_bands(tokens: set) -> list:
+    """
+    Calculate the MinHash signature of a set of tokens, cut in bands.
+    Return an empty list if there are no tokens.
+    """
+    if not tokens:
+        return []
+    hashes = [_stable_hash(token) & _MINHASH_PRIME for token in tokens]
+    signature = [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_FUNCTIONS]
+    return [tuple(signature[i:i + _MINHASH_ROWS]) for i in range(0, len(signature), _MINHASH_ROWS)]
+
+
+def _stable_hash(token) -> int:
+    """
+    Hash a token the same way in every process, unlike hash(), which is
+    randomized for texts. Its simple values have a stable repr().
+    """
+    return int.from_bytes(hashlib.blake2b(repr(token).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _hashed_candidates(expected: list, received: list, expected_matched: list, received_matched: list, max_candidates: int) -> dict:
+    """
+    Find the candidates of each unmatched expected item among the unmatched
+    received items, by locality-sensitive hashing. The received items sharing
+    the most buckets with an expected item are kept, up to max_candidates.
+    Return a dict of the lists of candidate received indexes, in order, by
+    expected index, or None if there are too few pairs to need hashing.
+    """
+    expected_left = [ei for ei in range(0, len(expected)) if not expected_matched[ei]]
+    received_left = [ri for ri in range(0, len(received)) if not received_matched[ri]]
+    if len(expected_left) * len(received_left) < _FUZZY_MIN_PAIRS:
+        return None
+
+    buckets = {}
+    for ri in received_left:
+        for band in enumerate(_minhash_bands(_item_tokens(received[ri]))):
+            buckets.setdefault(band, []).append(ri)
+
+    candidates = {}
+    for ei in expected_left:
+        shared = collections.Counter()
+        for band in enumerate(_minhash_bands(_item_tokens(expected[ei].value))):
+            shared.update(buckets.get(band, ()))
+        best = heapq.nsmallest(max_candidates, shared.items(), key=lambda item: (-item[1], item[0]))
+        candidates[ei] = sorted(ri for ri, count in best)
+    return candidates
+
+
+############################################################################
+#
+# Strict JSON diff helpers
+#
+# A strict diff compares the expected value with the received one and also
+# the received value with the expected one, to find the extra received items.
+# The strict diff helpers walk both values together once: each pair of
+# (expected matcher, received value) is compared in both directions at once
+# and gives back a tuple of (difference, size, reversed difference, reversed size).
+# The reversed differences are the same as comparing the received value as if
+# it was the expected one. The lists are the exception: their items are
+# compared in each direction separately, see _diff_strict_lists().
+
+
+# Maximum number of compared pairs of items whose results are kept while
+# verifying two lists in both directions. The pairs beyond it are compared again.
+_STRICT_CACHED_PAIRS = 100000
+
+
+def _diff_strict(expected, received, ctx: _DiffContext = None) -> (object, int, object, int):
+    """
+    Compare an expected value with a received one, in both directions.
+    Return a tuple containing the difference and its size, then the
+    reversed difference and its size.
+    """
+    if ctx is None:
+        ctx = _DiffContext()
+    return _run_strict_diff(_values_frame(_compile(expected, ctx.canonical_forms, ctx.ordered), received), ctx)
+
+
+def _run_strict_diff(frame, ctx: _DiffContext) -> (object, int, object, int):
+    """
+    Run a strict diff frame and all the frames it needs, using an explicit stack.
+    Return the tuple of the differences and sizes returned by the initial frame.
+    See _run_diff().
+    """
+    fingerprints = ctx.fingerprints
+    stats = ctx.stats
+    if stats is not None:
+        stats.start_frame(None)
+    stack = [frame]
+    result = None
+    while stack:
+        try:
+            expected, received = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            if stats is not None:
+                stats.stop_frame()
+            continue
+
+        if stats is not None:
+            stats.comparisons += 1
+
+        tm = type(expected)
+        tr = type(received)
+        if tm is _DictMatcher or tm is _ListMatcher:
+            if (tm is _DictMatcher and tr is dict) or (tm is _ListMatcher and tr is list):
+                fp = expected.fingerprint
+                if fp is not None and fp == fingerprints.get(id(received)):
+                    result = ({}, 0, {}, 0) if tr is dict else ([], 0, [], 0)
+                    continue
+                elif tr is dict:
+                    stack.append(_strict_dicts_frame(expected, received, ctx))
+                    result = None
+                    if stats is not None:
+                        stats.start_frame(expected)
+                else:
+                    if stats is not None:
+                        stats.start_frame(expected)
+                    result = _diff_strict_lists(expected, received, ctx)
+                    if stats is not None:
+                        stats.stop_frame()
+                continue
+
+            # A received simple value never matches an expected container,
+            # while it is the other way around when reversed. The same goes
+            # for a dict and a list, in any order.
+            size = _diff_size(received, ctx) + expected.size
+            if tr is dict or tr is list:
+                result = (received, size, expected.value, size)
+            else:
+                result = (received, size, (received, expected.value), size)
+        elif tr is dict or tr is list:
+            size = _diff_size(received, ctx) + expected.size
+            result = ((expected.value, received), size, expected.value, size)
+        elif expected.value == received:
+            result = (None, 0, None, 0)
+        else:
+            if stats is not None and (expected.is_text or tr is str):
+                stats.text_matches += 1
+            if expected.is_text:
+                matches = expected.matches_value(received)
+            else:
+                matches = False
+            if tr is str:
+                reversed_matches = _compile_simple(received).matches_value(expected.value)
+            else:
+                reversed_matches = False
+            result = ((None, 0) if matches else ((expected.value, received), 2))
+            result += ((None, 0) if reversed_matches else ((received, expected.value), 2))
+
+    return result
+
+
+def _strict_dicts_frame(expected: _DictMatcher, received: dict, ctx: _DiffContext):
+    """
+    Strict diff frame comparing an expected dictionary with a received one.
+    The reversed difference contains the extra keys of the received one.
+    """
+    diff = {}
+    size = 0
+    reversed_diffs = {}
+
+    for k, v in expected.items:
+        if k not in received:
+            diff[k] = v.value
+            size += v.size
+        else:
+            rv = received[k]
+            if not v.is_container and v.value == rv:
+                continue
+            sub_diff, sub_size, rev_sub_diff, rev_sub_size = yield (v, rv)
+            if sub_diff:
+                diff[k] = sub_diff
+                size += sub_size
+            if rev_sub_diff:
+                reversed_diffs[k] = (rev_sub_diff, rev_sub_size)
+
+    # The reversed difference follows the order of the received keys.
+    rev_diff = {}
+    rev_size = 0
+    expected_keys = expected.value
+    for k, rv in received.items():
+        if k not in expected_keys:
+            rev_diff[k] = rv
+            rev_size += _diff_size(rv, ctx)
+        elif k in reversed_diffs:
+            rev_diff[k], rev_sub_size = reversed_diffs[k]
+            rev_size += rev_sub_size
+
+    return (diff, size, rev_diff, rev_size)
+
+
+def _compact_strict_dicts_frame(expected: _DictMatcher, received: dict, diff: 'Diff', ctx: _DiffContext):
+    """
+    Strict diff frame adding the differences between an expected dictionary
+    and a received one straight to a Diff. See _compact_frame().
+
+    Like in Expected.diff_json(), the difference under a key replaces the
+    reversed one, which is only kept when there is no difference under that
+    key. So the reversed differences under each key are added to their own
+    Diff, limited to the room left, until the key is compared.
+    """
+    for k, v in expected.items:
+        if k not in received:
+            diff._add((k,), v.value)
+        else:
+            rv = received[k]
+            if not v.is_container and v.value == rv:
+                continue
+            count = len(diff)
+            reversed_diff = Diff(None if diff.max_entries is None else diff.max_entries - count)
+            yield from _compact_frame(v, rv, (k,), diff, reversed_diff, ctx)
+            if len(diff) == count and not diff.truncated:
+                diff.update(reversed_diff)
+        if diff.truncated:
+            return None
+
+    expected_keys = expected.value
+    for k, rv in received.items():
+        if k not in expected_keys:
+            diff._add((k,), rv)
+            if diff.truncated:
+                return None
+
+    return None
+
+
+def _diff_strict_lists(expected: _ListMatcher, received: list, ctx: _DiffContext) -> (object, int, object, int):
+    """
+    Compare an expected list with a received one, in both directions.
+    The reversed difference contains the extra items of the received one.
+
+    Unlike the dicts, the lists are compared in two passes, each running the
+    list diff frame in one direction. Pairing the items compares many
+    candidate pairs, and comparing all of them in both directions would
+    double the work, down to the nested lists.
+    """
+    diff, size = _run_diff(_lists_frame(expected, received, ctx), ctx, timed=False)
+
+    # In the reversed pass, the received items are compiled as the expected
+    # ones, except those that will be paired with an identical expected item,
+    # which only need their value and fingerprint. Like in the list diff
+    # frame, these are the first received items with each fingerprint, as
+    # many as there are expected items with that fingerprint.
+    fingerprints = ctx.fingerprints
+    identical = collections.Counter()
+    for v in expected.items:
+        if v.is_container:
+            fingerprints.setdefault(id(v.value), v.fingerprint)
+        if v.fingerprint is not None and not ctx.ordered:
+            identical[v.fingerprint] += 1
+    reversed_items = []
+    for r in received:
+        fp = _fingerprint(r, ctx)
+        if fp is not None and identical[fp] > 0:
+            identical[fp] -= 1
+            reversed_items.append(_Matcher(r, 1, fp))
+        else:
+            reversed_items.append(_compile(r, ctx.canonical_forms, ctx.ordered))
+    reversed_expected = _ListMatcher(received, reversed_items, 0, None, expected.key)
+    reversed_received = [v.value for v in expected.items]
+    rev_diff, rev_size = _run_diff(_lists_frame(reversed_expected, reversed_received, ctx), ctx, timed=False)
+
+    return (diff, size, rev_diff, rev_size)
+
+
+############################################################################
+#
+# JSON match helpers
+#
+# The match helpers verify if a received value matches an expected one,
+# stopping at the first difference and without building any diff. They
+# give the same answer as checking that the diff helpers find no difference.
+# Like the diff helpers, they use generator frames on an explicit stack, but
+# the frames yield and receive back booleans.
+
+
+def _matches_values(expected, received, ctx: _DiffContext = None) -> bool:
+    """
+    Verify if a received value matches an expected one.
+    """
+    if ctx is None:
+        ctx = _DiffContext()
+    return _run_matches(_values_frame(_compile(expected, ctx.canonical_forms, ctx.ordered), received), ctx)
+
+
+def _run_matches(frame, ctx: _DiffContext) -> bool:
+    """
+    Run a match frame and all the frames it needs, using an explicit stack.
+    Return the result of the initial frame.
+    """
+    fingerprints = ctx.fingerprints
+    stats = ctx.stats
+    if stats is not None:
+        stats.start_frame(None)
+    stack = [frame]
+    result = None
+    while stack:
+        try:
+            expected, received = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            if stats is not None:
+                stats.stop_frame()
+            continue
+
+        if stats is not None:
+            stats.comparisons += 1
+
+        # See _run_diff(). Note that a dict or a list matches any false
+        # received value, since the diff is then that false value.
+        tm = type(expected)
+        tr = type(received)
+        if tm is _DictMatcher or tm is _ListMatcher:
+            if (tm is _DictMatcher and tr is dict) or (tm is _ListMatcher and (tr is list or tr is KeyedList)):
+                fp = expected.fingerprint
+                if fp is not None and fp == fingerprints.get(id(received)):
+                    result = True
+                    continue
+                elif tr is dict:
+                    stack.append(_dicts_matches_frame(expected, received))
+                    result = None
+                else:
+                    stack.append(_lists_matches_frame(expected, received, ctx))
+                    result = None
+                if stats is not None:
+                    stats.start_frame(expected)
+            else:
+                result = not received
+        elif expected.is_text:
+            if stats is not None:
+                stats.text_matches += 1
+            result = bool(expected.matches_value(received))
+        else:
+            result = (expected.value == received)
+
+    return result
+
+
+def _root_matches_frame(expected: _Matcher, received, ctx: _DiffContext):
+    """
+    Match frame verifying an expected JSON document. See _root_frame().
+    """
+    if type(expected) is _DictMatcher:
+        return _dicts_matches_frame(expected, received)
+    else:
+        return _values_frame(expected, received)
+
+
+def _dicts_matches_frame(expected: _DictMatcher, received: dict):
+    """
+    Match frame verifying an expected dictionary. See _dicts_frame().
+    """
+    for k, v in expected.items:
+        if k not in received:
+            return False
+        rv = received[k]
+        if not v.is_container and v.value == rv:
+            continue
+        if not (yield (v, rv)):
+            return False
+    return True
+
+
+def _lists_matches_frame(expected: _ListMatcher, received: list, ctx: _DiffContext):
+    """
+    Match frame verifying an expected list. See _lists_frame().
+    The items are paired exactly like the diff does before looking for
+    imperfect matches, and any item left unmatched is a difference.
+    """
+    # Ordered lists match when all their items match in order.
+    if ctx.ordered:
+        if len(expected.items) != len(received):
+            return False
+        for v, rv in zip(expected.items, received):
+            fp = v.fingerprint
+            if fp is not None and fp == _fingerprint(rv, ctx):
+                continue
+            if not (yield (v, rv)):
+                return False
+        return True
+
+    list_matcher = expected
+    expected = expected.items
+    expected_matched = [False for e in expected]
+    received_matched = [False for r in received]
+
+    # The received items are only fingerprinted as far as needed to find
+    # the first identical item of each expected item, which pairs them like
+    # indexing them all first. When the lists are in the same order, the next
+    # received item is usually equal to the expected one, and equal values
+    # have equal fingerprints, so it is paired without any fingerprint.
+    #
+    # The first time an expected item is not paired that way, it is compared
+    # with the unpaired received items before fingerprinting the rest. If it
+    # matches none of them, the lists do not match.
+    received_by_fingerprint = {}
+    scanned = 0
+    searched = False
     for ei in range(0, len(expected)):
-        if not expected_matched[ei]:
-            diff.append((expected[ei], None))
+        v = expected[ei]
+        fp = v.fingerprint
+        if fp is None:
+            continue
+        candidates = received_by_fingerprint.get(fp)
+        if candidates:
+            ri = candidates.popleft()
+        elif scanned < len(received) and v.value == received[scanned]:
+            ri = scanned
+            scanned += 1
+        else:
+            if not searched:
+                searched = True
+                for ri in range(0, len(received)):
+                    if not received_matched[ri] and (yield (v, received[ri])):
+                        break
+                else:
+                    return False
+            ri = None
+            while scanned < len(received):
+                rfp = _fingerprint(received[scanned], ctx)
+                scanned += 1
+                if rfp == fp:
+                    ri = scanned - 1
+                    break
+                elif rfp is not None:
+                    received_by_fingerprint.setdefault(rfp, collections.deque()).append(scanned - 1)
+        if ri is not None:
+            received_matched[ri] = True
+            expected_matched[ei] = True
+
+    key = _list_key(list_matcher, received, ctx)
+    if key is not None:
+        for ei, ri in _pair_by_key(expected, received, expected_matched, received_matched, key):
+            if ri is None or not (yield (expected[ei], received[ri])):
+                return False
+
+    # With the optimal matching, the diff is empty when every left-over
+    # expected item can be paired with one of its perfect matches.
+    if ctx.list_matching == ListMatching.OPTIMAL:
+        frame = _perfect_assignment_frame(expected_matched, received_matched)
+        perfect = None
+        while True:
+            try:
+                ei, ri = frame.send(perfect)
+            except StopIteration as stop:
+                return stop.value is not None
+            perfect = yield (expected[ei], received[ri])
+
+    for ei in range(0, len(expected)):
+        if expected_matched[ei]:
+            continue
+        v = expected[ei]
+        for ri in range(0, len(received)):
+            if not received_matched[ri] and (yield (v, received[ri])):
+                received_matched[ri] = True
+                break
+        else:
+            return False
+
+    return True
+
+
+def _run_strict_matches(frame, ctx: _DiffContext) -> (bool, bool):
+    """
+    Run a strict match frame and all the frames it needs, using an explicit stack.
+    Return the pair of booleans returned by the initial frame.
+
+    The strict match frames verify both directions at once, like the strict
+    diff frames, without building any diff. Each pair of (expected matcher,
+    received value) gives back a pair of booleans: if the received value
+    matches the expected one, and if it matches when reversed. The frames
+    yield a third item telling if both booleans are needed separately, as
+    they are to pair the items of lists. When they are not, the frames stop
+    at the first difference in either direction.
+    """
+    fingerprints = ctx.fingerprints
+    stats = ctx.stats
+    if stats is not None:
+        stats.start_frame(None)
+    stack = [frame]
+    result = None
+    while stack:
+        try:
+            expected, received, split = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            if stats is not None:
+                stats.stop_frame()
+            continue
+
+        if stats is not None:
+            stats.comparisons += 1
+
+        # See _run_strict_diff(): a direction matches when its difference is empty.
+        tm = type(expected)
+        tr = type(received)
+        if tm is _DictMatcher or tm is _ListMatcher:
+            if (tm is _DictMatcher and tr is dict) or (tm is _ListMatcher and tr is list):
+                fp = expected.fingerprint
+                if fp is not None and fp == fingerprints.get(id(received)):
+                    result = (True, True)
+                    continue
+                elif tr is dict:
+                    stack.append(_strict_dicts_matches_frame(expected, received, split))
+                    result = None
+                else:
+                    stack.append(_strict_lists_matches_frame(expected, received, split, ctx))
+                    result = None
+                if stats is not None:
+                    stats.start_frame(expected)
+                continue
+            result = (not received, (tr is dict or tr is list) and not expected.value)
+        elif tr is dict or tr is list:
+            result = (False, not expected.value)
+        elif expected.value == received:
+            result = (True, True)
+        else:
+            if stats is not None and (expected.is_text or tr is str):
+                stats.text_matches += 1
+            matches = expected.is_text and bool(expected.matches_value(received))
+            reversed_matches = tr is str and bool(_compile_simple(received).matches_value(expected.value))
+            result = (matches, reversed_matches)
+
+    return result
+
+
+def _strict_values_matches_frame(expected: _Matcher, received):
+    """
+    Strict match frame verifying a single pair of values in both directions.
+    """
+    return (yield (expected, received, False))
+
+
+def _strict_dicts_matches_frame(expected: _DictMatcher, received: dict, split: bool):
+    """
+    Strict match frame verifying an expected dictionary and a received one
+    in both directions. See _strict_dicts_frame(). The received dictionary
+    must not have any extra key.
+    """
+    matches = True
+    reversed_matches = True
+    expected_keys = expected.value
+    for k in received:
+        if k not in expected_keys:
+            reversed_matches = False
+            if not split:
+                return (False, False)
+            break
+
+    for k, v in expected.items:
+        if k not in received:
+            matches = False
+        else:
+            rv = received[k]
+            if not v.is_container and v.value == rv:
+                continue
+            sub_matches, sub_reversed_matches = yield (v, rv, split)
+            matches = matches and sub_matches
+            reversed_matches = reversed_matches and sub_reversed_matches
+        if not (matches or reversed_matches) or not (split or (matches and reversed_matches)):
+            return (False, False)
+
+    return (matches, reversed_matches)
+
+
+def _strict_lists_matches_frame(expected: _ListMatcher, received: list, split: bool, ctx: _DiffContext):
+    """
+    Strict match frame verifying an expected list and a received one in both
+    directions. See _diff_strict_lists(). The items are paired by running
+    the list match frame in each direction, and the results of the pairs
+    compared in one direction are kept for the other.
+    """
+    fingerprints = ctx.fingerprints
+    matchers = {}
+    for v in expected.items:
+        matchers[id(v.value)] = v
+        if v.is_container:
+            fingerprints.setdefault(id(v.value), v.fingerprint)
+
+    results = {}
+    frame = _lists_matches_frame(expected, received, ctx)
+    result = None
+    while True:
+        try:
+            v, rv = frame.send(result)
+        except StopIteration as stop:
+            matches = stop.value
+            break
+        key = (id(v), id(rv))
+        result = results.get(key)
+        if result is None:
+            result = yield (v, rv, True)
+            if len(results) < _STRICT_CACHED_PAIRS:
+                results[key] = result
+        result = result[0]
+
+    if not (matches or split):
+        return (False, False)
+
+    # A received item equal to the expected item at the same position has
+    # the same fingerprint, so it is not fingerprinted again.
+    reversed_items = []
+    for ri in range(0, len(received)):
+        r = received[ri]
+        v = expected.items[ri] if ri < len(expected.items) else None
+        if v is not None and v.fingerprint is not None and v.value == r:
+            reversed_items.append(_Matcher(r, 1, v.fingerprint))
+        else:
+            reversed_items.append(_Matcher(r, 1, _fingerprint(r, ctx)))
+    reversed_expected = _ListMatcher(received, reversed_items, 0, None, expected.key)
+    reversed_received = [v.value for v in expected.items]
+    frame = _lists_matches_frame(reversed_expected, reversed_received, ctx)
+    result = None
+    while True:
+        try:
+            rv, v = frame.send(result)
+        except StopIteration as stop:
+            reversed_matches = stop.value
+            break
+        v = matchers[id(v)]
+        rv = rv.value
+        key = (id(v), id(rv))
+        result = results.get(key)
+        if result is None:
+            result = yield (v, rv, True)
+        result = result[1]
+
+    return (matches, reversed_matches)
+
+
+def _pair_left_over(expected: list, received: list, expected_matched: list, received_matched: list, ctx: _DiffContext):
+    """
+    Part of the diff frame of lists pairing the left-over items, that were not
+    paired by fingerprint nor by key. With the greedy and fuzzy matchings, the
+    perfect matches are marked as matched. With the optimal matching, they are
+    the pairs when every expected item can be paired with one of them, see
+    _perfect_assignment_frame(), and are otherwise candidates of size 0.
+    Return a pair containing the list of pairs of (expected index, received index)
+    of the imperfect matches and the dict of the best differences found for
+    each expected index, as tuples of (size, received index, difference).
+    """
+    # First, we do perfect matches for the left-over items, keeping track of best matches.
+    # For each item, we keep a list of tuples (best match size, best match index)
+    # Perfect matches will be recorded in the _matched lists.
+    #
+    # With the optimal matching, only the best few candidates are kept, so
+    # that the memory used is bounded. They are kept in a heap with negated
+    # sizes and indexes so that the worst candidate is the first one.
+    #
+    # The difference with the best candidate is also kept, since it is
+    # usually the one that gets paired. This avoids comparing the pair again,
+    # which would otherwise double the work at each level of nested lists.
+    #
+    # For large lists, the pairs may instead be scored all at once in a pool
+    # of processes. Only their sizes are then known, so the differences of
+    # the best candidates are not kept.
+    #
+    # With the fuzzy matching of large lists, each expected item is only
+    # compared with its candidates found by hashing.
+    #
+    # With the optimal matching, an expected item may perfectly match several
+    # received items, and taking the first one may leave another expected item
+    # with a worse match. If every expected item can be paired with one of its
+    # perfect matches, these are the pairs. Otherwise, the perfect matches are
+    # candidates of size 0, and the assignment decides which pairs are kept.
+    keep_all = (ctx.list_matching != ListMatching.OPTIMAL)
+    max_candidates = max(1, ctx.list_candidates)
+    expected_matches = [[] for e in expected]
+    best_diffs = {}
+    hashed_candidates = None
+    if ctx.list_matching == ListMatching.FUZZY:
+        hashed_candidates = _hashed_candidates(expected, received, expected_matched, received_matched, max_candidates)
+    scores = None
+    if hashed_candidates is None:
+        scores = _score_pairs_in_pool(expected, received, expected_matched, received_matched, ctx)
+
+    # The differences found looking for the perfect pairs are kept, so that
+    # these pairs are not compared again.
+    compared = {}
+    if not keep_all:
+        frame = _perfect_assignment_frame(expected_matched, received_matched)
+        perfect = None
+        while True:
+            try:
+                ei, ri = frame.send(perfect)
+            except StopIteration as stop:
+                pairs = stop.value
+                break
+            if scores is not None:
+                perfect = scores[ei][ri] is None
+            else:
+                compared[(ei, ri)] = yield (expected[ei], received[ri])
+                perfect = not compared[(ei, ri)][0]
+        if pairs is not None:
+            return (pairs, { ei: (0, ri, None) for ei, ri in pairs })
+
+    all_received = range(0, len(received))
+    for ei in range(0, len(expected)):
+        # Verify if the expected item has already been matched by its fingerprint.
+        if expected_matched[ei]:
+            continue
+
+        v = expected[ei]
+        matches = expected_matches[ei]
+        for ri in (all_received if hashed_candidates is None else hashed_candidates.get(ei, ())):
+            # Verify if the received item has already been perfectly matched.
+            if received_matched[ri]:
+                continue
+
+            # Try to perfectly match the expected and received item.
+            # If we find a perfect match, the item no longer needs any match.
+            if scores is not None:
+                sub_diff = None
+                sub_size = scores[ei][ri]
+                perfect = sub_size is None
+            elif (ei, ri) in compared:
+                sub_diff, sub_size = compared[(ei, ri)]
+                perfect = not sub_diff
+            else:
+                sub_diff, sub_size = yield (v, received[ri])
+                perfect = not sub_diff
+            if perfect and keep_all:
+                received_matched[ri] = True
+                expected_matched[ei] = True
+                matches.clear()
+                break
+            if perfect:
+                sub_size = 0
+
+            # Record the imperfect match size.
+            if sub_diff is not None and (ei not in best_diffs or sub_size < best_diffs[ei][0]):
+                best_diffs[ei] = (sub_size, ri, sub_diff)
+            if keep_all:
+                matches.append((sub_size, ri))
+            elif len(matches) < max_candidates:
+                heapq.heappush(matches, (-sub_size, -ri))
+            elif -matches[0][0] > sub_size:
+                heapq.heapreplace(matches, (-sub_size, -ri))
+
+    # Now, we do imperfect matches.
+    if keep_all:
+        pairs = _greedy_assignment(expected_matches, expected_matched, received_matched)
+
+        # With the fuzzy matching, the expected items whose candidates were
+        # all taken are paired in order with the left-over received items.
+        if hashed_candidates is not None:
+            expected_paired = set(ei for ei, ri in pairs)
+            received_paired = set(ri for ei, ri in pairs)
+            expected_left = [ei for ei in range(0, len(expected)) if not expected_matched[ei] and ei not in expected_paired]
+            received_left = [ri for ri in range(0, len(received)) if not received_matched[ri] and ri not in received_paired]
+            pairs.extend(zip(expected_left, received_left))
+    else:
+        candidates = [[(-neg_size, -neg_ri) for neg_size, neg_ri in matches] for matches in expected_matches]
+        pairs = _min_cost_assignment(candidates, expected_matched, received_matched)
+
+        # The expected items whose candidates were all taken are paired
+        # with the best of the left-over received items, if any.
+        expected_paired = set(ei for ei, ri in pairs)
+        received_paired = set(ri for ei, ri in pairs)
+        for ei in range(0, len(expected)):
+            if expected_matched[ei] or ei in expected_paired:
+                continue
+            best = None
+            for ri in range(0, len(received)):
+                if received_matched[ri] or ri in received_paired:
+                    continue
+                if scores is not None:
+                    sub_size = scores[ei][ri] or 0
+                else:
+                    sub_diff, sub_size = yield (expected[ei], received[ri])
+                if best is None or sub_size < best[0]:
+                    best = (sub_size, ri)
+            if best is None:
+                break
+            pairs.append((ei, best[1]))
+            received_paired.add(best[1])
+
+    return (pairs, best_diffs)
+
+
+def _ordered_lists_frame(expected: _ListMatcher, received: list, ctx: _DiffContext):
+    """
+    Diff frame comparing an expected list with a received one, in order.
+
+    The items are compared with the Myers O(ND) difference algorithm, where N
+    is the number of items and D the number of differences, so lists that are
+    almost identical are compared in almost linear time. Two items are the
+    same when they match perfectly. The difference is a list of tuples of
+    (operation, index, value), in order:
+
+      - ('deleted', expected index, expected item)
+      - ('inserted', received index, received item)
+      - ('changed', expected index, difference with the received item)
+
+    Items deleted and inserted at the same place are reported as changed.
+    """
+    expected = expected.items
+    received_fingerprints = [_fingerprint(r, ctx) for r in received]
+    results = {}
+
+    def same(ei: int, ri: int):
+        # Identical items match. Items that are both simple and have
+        # different fingerprints do not. Otherwise, compare them.
+        v = expected[ei]
+        fp = v.fingerprint
+        if fp is not None:
+            received_fp = received_fingerprints[ri]
+            if fp == received_fp:
+                return True
+            if received_fp is not None and type(v.value) not in _CONTAINER_TYPES and type(received[ri]) not in _CONTAINER_TYPES:
+                return False
+        result = results.get((ei, ri))
+        if result is None:
+            result = yield (v, received[ri])
+            results[(ei, ri)] = result
+        return not result[0]
+
+    # Skip the common prefix and suffix, which is all there is to compare
+    # when the lists are the same.
+    start = 0
+    expected_end = len(expected)
+    received_end = len(received)
+    while start < expected_end and start < received_end and (yield from same(start, start)):
+        start += 1
+    while expected_end > start and received_end > start and (yield from same(expected_end - 1, received_end - 1)):
+        expected_end -= 1
+        received_end -= 1
+
+    # Find the furthest reaching paths for each number of differences d,
+    # along each diagonal k = x - y, where x and y are the number of expected
+    # and received items already compared. The furthest x of each diagonal
+    # is kept after each d to find back the edit script.
+    n = expected_end - start
+    m = received_end - start
+    furthest = {1: 0}
+    trace = []
+    x = y = 0
+    for d in range(0, n + m + 1):
+        trace.append(dict(furthest))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and furthest[k - 1] < furthest[k + 1]):
+                x = furthest[k + 1]
+            else:
+                x = furthest[k - 1] + 1
+            y = x - k
+            while x < n and y < m and (yield from same(start + x, start + y)):
+                x += 1
+                y += 1
+            furthest[k] = x
+            if x >= n and y >= m:
+                break
+        if x >= n and y >= m:
+            break
+
+    # Follow the path back, from the end, to find the deleted and inserted items.
+    edits = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        furthest = trace[d]
+        k = x - y
+        if k == -d or (k != d and furthest[k - 1] < furthest[k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = furthest[previous_k]
+        previous_y = previous_x - previous_k
+        x -= min(x - previous_x, y - previous_y)
+        y = x - k
+        if x == previous_x:
+            edits.append((False, start + previous_x, start + previous_y))
+        else:
+            edits.append((True, start + previous_x, start + previous_y))
+        x, y = previous_x, previous_y
+    edits.reverse()
+
+    # Report the edits, pairing the items deleted and inserted at the same
+    # place, that is in a run of edits without any same items in between.
+    # Each edit is a tuple of (deleted, expected index, received index).
+    diff = []
+    size = 0
+    i = 0
+    while i < len(edits):
+        deleted = []
+        inserted = []
+        while True:
+            is_deleted, ei, ri = edits[i]
+            if is_deleted:
+                deleted.append(ei)
+            else:
+                inserted.append(ri)
+            i += 1
+            if i >= len(edits) or edits[i][1:] != (ei + is_deleted, ri + (not is_deleted)):
+                break
+        for ei, ri in zip(deleted, inserted):
+            sub_diff, sub_size = results.get((ei, ri)) or (yield (expected[ei], received[ri]))
+            diff.append(('changed', ei, sub_diff))
+            size += sub_size
+        for ei in deleted[len(inserted):]:
+            diff.append(('deleted', ei, expected[ei].value))
+            size += 1
+        for ri in inserted[len(deleted):]:
+            diff.append(('inserted', ri, received[ri]))
             size += 1
 
     return (diff, size)
 
 
+def _key_path(key) -> tuple:
+    """
+    Convert a list key, either the name of a key or a tuple of names, to a tuple of names.
+    """
+    if key is None or type(key) is tuple:
+        return key
+    elif type(key) is list:
+        return tuple(key)
+    else:
+        return (key,)
+
+
+def _list_key(expected: _ListMatcher, received: list, ctx: _DiffContext) -> tuple:
+    """
+    Find the key by which the items of two lists are matched, or None.
+    A list marked with a key while being the received one, which happens
+    when comparing the other way around, is also matched by its key.
+    """
+    if expected.key is not None:
+        return expected.key
+    elif type(received) is KeyedList:
+        return _key_path(received.key)
+    else:
+        return ctx.list_key
+
+
+def _item_key(value, key: tuple):
+    """
+    Find the key value of a list item. Return None if the item has no key
+    value, or if it is a container or a wildcard. The key value is returned
+    as a fingerprint so that None is a valid key value.
+    """
+    for k in key:
+        if type(value) is not dict or k not in value:
+            return None
+        value = value[k]
+    if type(value) in _CONTAINER_TYPES:
+        return None
+    return _fingerprint(value, None)
+
+
+def _pair_by_key(expected: list, received: list, expected_matched: list, received_matched: list, key: tuple) -> list:
+    """
+    Join the unmatched expected items with the unmatched received items with the same key value.
+    The expected items are matchers and the received items are values.
+    Return a list of pairs of (expected index, received index), with None as
+    the received index for the expected items with no received item. All
+    the items of the pairs are marked as matched.
+    """
+    received_by_key = {}
+    for ri in range(0, len(received)):
+        if received_matched[ri]:
+            continue
+        k = _item_key(received[ri], key)
+        if k is not None:
+            received_by_key.setdefault(k, collections.deque()).append(ri)
+
+    pairs = []
+    for ei in range(0, len(expected)):
+        if expected_matched[ei]:
+            continue
+        k = _item_key(expected[ei].value, key)
+        if k is None:
+            continue
+        candidates = received_by_key.get(k)
+        ri = candidates.popleft() if candidates else None
+        pairs.append((ei, ri))
+        expected_matched[ei] = True
+        if ri is not None:
+            received_matched[ri] = True
+
+    return pairs
+
+
+def _greedy_assignment(expected_matches: list, expected_matched: list, received_matched: list) -> list:
+    """
+    Pair the unmatched expected items with unmatched received items,
+    in order of increasing difference sizes. Each item is only used once.
+    The expected_matches contains a list of (size, received index) for each expected item.
+    Return a list of pairs of (expected index, received index).
+    """
+    # Sort all matches in order of difference sizes.
+    best_matches = []
+    for ei in range(0, len(expected_matches)):
+        if expected_matched[ei]:
+            continue
+        for match in expected_matches[ei]:
+            best_matches.append((match[0], ei, match[1]))
+    best_matches.sort()
+
+    # In the best match order, pair the expected item and its best-matching received item.
+    # Only use each item once.
+    expected_paired = set()
+    received_paired = set()
+    pairs = []
+    for size, ei, ri in best_matches:
+        if ei in expected_paired:
+            continue
+
+        if received_matched[ri] or ri in received_paired:
+            continue
+
+        pairs.append((ei, ri))
+        expected_paired.add(ei)
+        received_paired.add(ri)
+
+    return pairs
+
+
+def _perfect_assignment_frame(expected_matched: list, received_matched: list):
+    """
+    Frame pairing each unmatched expected item with one of the unmatched
+    received items it perfectly matches, using each received item only once.
+    It yields pairs of (expected index, received index) and is sent back if
+    they perfectly match. Each pair is yielded at most once.
+
+    This is the maximum bipartite matching found with augmenting paths. The
+    pairs are compared lazily: each expected item is first compared with the
+    received items not paired yet, in order, up to its first perfect match,
+    and with the already paired received items only when it has none. The
+    frame stops at the first expected item that cannot be paired.
+
+    Return a list of pairs of (expected index, received index), or None if
+    some expected item cannot be paired.
+    """
+    perfect = {}
+    expected_pair = {}
+    received_pair = {}
+    free = [ri for ri in range(0, len(received_matched)) if not received_matched[ri]]
+    for ei in range(0, len(expected_matched)):
+        if expected_matched[ei]:
+            continue
+
+        paired = False
+        for ri in free:
+            if ri in received_pair:
+                continue
+            perfect[(ei, ri)] = yield (ei, ri)
+            if perfect[(ei, ri)]:
+                expected_pair[ei] = ri
+                received_pair[ri] = ei
+                paired = True
+                break
+        if paired:
+            continue
+
+        # Depth-first search of a path alternating between received items
+        # and the expected items they are paired with, up to a received item
+        # not paired yet. The received item chosen at each level is kept in path.
+        visited = set()
+        stack = [(ei, iter(free))]
+        path = []
+        while stack:
+            e, candidates = stack[-1]
+            for ri in candidates:
+                if ri in visited:
+                    continue
+                if (e, ri) not in perfect:
+                    perfect[(e, ri)] = yield (e, ri)
+                if perfect[(e, ri)]:
+                    break
+            else:
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+            visited.add(ri)
+            path.append(ri)
+            if ri not in received_pair:
+                break
+            stack.append((received_pair[ri], iter(free)))
+
+        if not stack:
+            return None
+        for (e, candidates), ri in zip(stack, path):
+            expected_pair[e] = ri
+            received_pair[ri] = e
+
+    return list(expected_pair.items())
+
+
+def _min_cost_assignment(candidates: list, expected_matched: list, received_matched: list) -> list:
+    """
+    Pair the unmatched expected items with unmatched received items so that
+    as many items as possible are paired and the total difference size is minimal.
+    The candidates contains a list of (size, received index) for each expected item.
+    Only these candidate pairs are considered.
+
+    This is the min-cost bipartite matching found with successive shortest
+    augmenting paths. The paths are found with Dijkstra's algorithm on the
+    costs reduced by the node potentials, which keeps them non-negative.
+
+    Return a list of pairs of (expected index, received index), in order of
+    increasing difference sizes.
+    """
+    # Keep only the candidates that are still available, as edges between the
+    # expected nodes and the received nodes.
+    edges = {}
+    for ei in range(0, len(candidates)):
+        if expected_matched[ei]:
+            continue
+        ei_edges = [(size, ri) for size, ri in candidates[ei] if not received_matched[ri]]
+        if ei_edges:
+            edges[ei] = ei_edges
+
+    # Nodes are identified as ('e', index) or ('r', index). The matching is
+    # kept in both directions, along with the cost of each matched pair.
+    expected_pair = {}
+    received_pair = {}
+    infinity = float('inf')
+    sink = ('t', 0)
+    nodes = [sink]
+    nodes.extend(('e', ei) for ei in edges)
+    nodes.extend(set(('r', ri) for ei_edges in edges.values() for size, ri in ei_edges))
+    potential = { node: 0 for node in nodes }
+
+    while True:
+        # Dijkstra from all unpaired expected nodes to the sink, which is
+        # reached through any unpaired received node.
+        dist = {}
+        prev = {}
+        heap = []
+        for ei in edges:
+            if ei not in expected_pair:
+                node = ('e', ei)
+                dist[node] = -potential[node]
+                heapq.heappush(heap, (dist[node], node))
+
+        done = set()
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node == sink:
+                break
+
+            kind, index = node
+            if kind == 'e':
+                next_nodes = [(('r', ri), size) for size, ri in edges[index] if expected_pair.get(index) != ri]
+            elif index in received_pair:
+                ei, size = received_pair[index]
+                next_nodes = [(('e', ei), -size)]
+            else:
+                next_nodes = [(sink, 0)]
+
+            for next_node, cost in next_nodes:
+                nd = d + cost + potential[node] - potential[next_node]
+                if nd < dist.get(next_node, infinity):
+                    dist[next_node] = nd
+                    prev[next_node] = node
+                    heapq.heappush(heap, (nd, next_node))
+
+        if sink not in done:
+            break
+
+        # Update the potentials. Nodes not reached before the sink
+        # are treated as if they were at the sink distance.
+        sink_dist = dist[sink]
+        for node in nodes:
+            potential[node] += min(dist.get(node, infinity), sink_dist)
+
+        # Augment the matching along the shortest path.
+        node = prev[sink]
+        while node in prev:
+            ei = prev[node][1]
+            ri = node[1]
+            size = next(size for size, r in edges[ei] if r == ri)
+            expected_pair[ei] = ri
+            received_pair[ri] = (ei, size)
+            node = prev[('e', ei)] if ('e', ei) in prev else None
+
+    pairs = [(size, ei, ri) for ri, (ei, size) in received_pair.items()]
+    pairs.sort()
+    return [(ei, ri) for size, ei, ri in pairs]
+
+
 ############################################################################
 #
 # Run as a program. TODO
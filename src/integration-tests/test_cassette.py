@@ -0,0 +1,117 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import gzip
+import json
+import os
+import tempfile
+
+import resto
+
+
+class TestCassette(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the responses recorded
+    in a cassette are replayed without calling the server.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        resto._cassettes.clear()
+
+    def tearDown(self):
+        self._clear_cassettes()
+        self.folder.cleanup()
+
+    def _clear_cassettes(self):
+        for cassette in resto._cassettes.values():
+            cassette.close()
+        resto._cassettes.clear()
+
+    def _record(self, get_session, path: str, contents: list, record: bool = False, base_url: str = 'http://x'):
+        get_session.reset_mock()
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.headers = {'Content-Type': 'application/json'}
+        response.status_code = 200
+        config = resto.Config(base_url, cassette=path, record=record)
+        exp = resto.Expected(url='/a', params={'q': 1}, out_json={'a': 1})
+        diffs = []
+        for content in contents:
+            response.content = content
+            diffs.append(exp.call(config))
+        config.close()
+        return diffs
+
+    def _replay(self, path: str, count: int, base_url: str = 'http://x'):
+        self._clear_cassettes()
+        with patch('resto.Config.get_session') as get_session:
+            config = resto.Config(base_url, cassette=path)
+            exp = resto.Expected(url='/a', params={'q': 1}, out_json={'a': 1})
+            diffs = [exp.call(config) for _ in range(count)]
+            self.assertFalse(get_session.return_value.get.called)
+        return diffs
+
+    @patch('resto.Config.get_session')
+    def test_replay(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json')
+        recorded = self._record(get_session, path, [b'{"a": 1}', b'{"a": 2}'])
+        self.assertEqual(2, get_session.return_value.get.call_count)
+        self.assertEqual([{}, {'a': (1, 2)}], recorded)
+        self.assertEqual(recorded, self._replay(path, 2))
+
+    @patch('resto.Config.get_session')
+    def test_replay_gzip(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json.gz')
+        recorded = self._record(get_session, path, [b'{"a": 3}'])
+        self.assertEqual(recorded, self._replay(path, 1))
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(1, len([json.loads(line) for line in f]))
+
+    @patch('resto.Config.get_session')
+    def test_replay_by_base_url(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json')
+        self._record(get_session, path, [b'{"a": 1}'])
+        self._record(get_session, path, [b'{"a": 2}'], base_url='http://y')
+        self.assertEqual([{'a': (1, 2)}], self._replay(path, 1, base_url='http://y'))
+        self.assertEqual([{}], self._replay(path, 1, base_url='http://x'))
+
+    @patch('resto.Config.get_session')
+    def test_record_opens_file_once(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json.gz')
+        with patch('resto.Cassette._open', side_effect=resto.Cassette._open, autospec=True) as open_file:
+            self._record(get_session, path, [b'{"a": %d}' % i for i in range(50)])
+            self.assertEqual(1, open_file.call_count)
+        self.assertEqual(50, len(self._replay(path, 50)))
+
+    @patch('resto.Config.get_session')
+    def test_replay_then_send(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json')
+        self._record(get_session, path, [b'{"a": 1}'])
+        self._clear_cassettes()
+        self.assertEqual([{}, {'a': (1, 2)}], self._record(get_session, path, [b'{"a": 5}', b'{"a": 2}']))
+        self.assertEqual(1, get_session.return_value.get.call_count)
+
+    @patch('resto.Config.get_session')
+    def test_record_again(self, get_session):
+        path = os.path.join(self.folder.name, 'cassette.json')
+        self._record(get_session, path, [b'{"a": 2}'])
+        self._clear_cassettes()
+        self.assertEqual([{}], self._record(get_session, path, [b'{"a": 1}'], record=True))
+        self.assertEqual(1, get_session.return_value.get.call_count)
+        self.assertEqual([{}], self._replay(path, 1))
+
+    def test_replay_status_headers_content(self):
+        cassette = resto.Cassette(os.path.join(self.folder.name, 'cassette.json'))
+        send = MagicMock()
+        send.return_value.__enter__.return_value.status_code = 404
+        send.return_value.__enter__.return_value.headers = {'X-Test': 'yes'}
+        send.return_value.__enter__.return_value.content = b'\xff'
+        cassette.play(resto.Method.GET, 'http://x/b', None, None, send)
+        cassette.close()
+
+        replayed = resto.Cassette(cassette.path).play(resto.Method.GET, 'http://x/b', None, None, send)
+        self.assertEqual(1, send.call_count)
+        self.assertEqual((404, 'yes', b'\xff'), (replayed.status_code, replayed.headers['x-test'], replayed.content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,14 @@
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 import copy
+import itertools
+import os
+import random
+import re
+import subprocess
+import sys
+
+import requests
 
 import resto
 
@@ -50,6 +58,28 @@ class TestDiffSize(unittest.TestCase):
     def test_diff_size_dict_within_list(self):
         self.assertEqual(4, resto._diff_size([{'hello': 'world', 'nice': 'day'}]))
 
+    def test_diff_size_cached_in_context(self):
+        ctx = resto._DiffContext()
+        inner = {'hello': ['world', 'nice', 'day']}
+        value = [inner, inner]
+        self.assertEqual(11, resto._diff_size(value, ctx))
+        self.assertEqual(11, ctx.sizes[id(value)])
+        self.assertEqual(5, ctx.sizes[id(inner)])
+        self.assertEqual(11, resto._diff_size(value, ctx))
+
+    def test_diff_size_uses_context_cache(self):
+        ctx = resto._DiffContext()
+        inner = {'hello': ['world', 'nice', 'day']}
+        ctx.sizes[id(inner)] = 100
+        self.assertEqual(101, resto._diff_size([inner], ctx))
+        self.assertEqual(6, resto._diff_size([inner]))
+
+    def test_diff_size_very_deep(self):
+        value = []
+        for i in range(10000):
+            value = [value]
+        self.assertEqual(10001, resto._diff_size(value))
+
 
 class TestDiffLists(unittest.TestCase):
     """
@@ -76,6 +106,346 @@ class TestDiffLists(unittest.TestCase):
         self.assertEqual(([(1,2)], 2), resto._diff_lists([1], [2]))
         
 
+class TestFingerprint(unittest.TestCase):
+    """
+    The goal of the test is to verify that the _fingerprint()
+    returns equal fingerprints only for values that perfectly match.
+    """
+
+    def assertSameFingerprints(self, a, b):
+        ctx = resto._DiffContext()
+        self.assertEqual(resto._fingerprint(a, ctx), resto._fingerprint(b, ctx))
+
+    def assertDifferentFingerprints(self, a, b):
+        ctx = resto._DiffContext()
+        self.assertNotEqual(resto._fingerprint(a, ctx), resto._fingerprint(b, ctx))
+
+    def test_fingerprint_same_int(self):
+        self.assertSameFingerprints(1, 1)
+
+    def test_fingerprint_different_str(self):
+        self.assertDifferentFingerprints('hello', 'bye')
+
+    def test_fingerprint_dict_key_order(self):
+        self.assertSameFingerprints({'a': 1, 'b': 2}, {'b': 2, 'a': 1})
+
+    def test_fingerprint_list_item_order(self):
+        self.assertSameFingerprints([1, 2, 3], [3, 1, 2])
+
+    def test_fingerprint_list_duplicates(self):
+        self.assertDifferentFingerprints([1, 1, 2], [1, 2, 2])
+
+    def test_fingerprint_dict_vs_list(self):
+        self.assertDifferentFingerprints({}, [])
+
+    def test_fingerprint_nested(self):
+        self.assertSameFingerprints({'a': [{'b': [1]}]}, {'a': [{'b': [1]}]})
+        self.assertDifferentFingerprints({'a': [{'b': [1]}]}, {'a': [{'b': [2]}]})
+
+    def test_fingerprint_any_str(self):
+        self.assertIsNone(resto._fingerprint('*', resto._DiffContext()))
+
+    def test_fingerprint_contains_str(self):
+        self.assertIsNone(resto._fingerprint({'a': ['~hello']}, resto._DiffContext()))
+
+
+class TestDiffListsFingerprints(unittest.TestCase):
+    """
+    The goal of the test is to verify that the _diff_lists()
+    pairs identical items through their fingerprints and still
+    compares the wildcards and left-over items.
+    """
+
+    def test_diff_lists_identical_dicts_different_order(self):
+        expected = [{'id': i, 'name': f'dog {i}'} for i in range(100)]
+        received = list(reversed(copy.deepcopy(expected)))
+        self.assertEqual(([], 0), resto._diff_lists(expected, received))
+
+    def test_diff_lists_identical_items_paired_first(self):
+        expected = [{'a': 1}, {'a': 1, 'b': 2}]
+        received = [{'a': 1, 'b': 2}, {'a': 1}]
+        self.assertEqual(([], 0), resto._diff_lists(expected, received))
+
+    def test_diff_lists_wildcards(self):
+        expected = [{'id': '*'}, {'name': '~ell'}]
+        received = [{'name': 'hello'}, {'id': 'abc'}]
+        self.assertEqual(([], 0), resto._diff_lists(expected, received))
+
+    def test_diff_lists_left_over_items(self):
+        expected = [{'id': 1}, {'id': 2}, {'id': 3}]
+        received = [{'id': 3}, {'id': 4}, {'id': 1}]
+        self.assertEqual(([{'id': (2, 4)}], 2), resto._diff_lists(expected, received))
+
+    def test_diff_lists_none_items(self):
+        # None has no fingerprint: it is compared item by item, like before the fingerprints.
+        self.assertIsNone(resto._fingerprint(None, resto._DiffContext()))
+        expected = [[[1]], None, [], 'a']
+        received = [None, 'a', True, [1]]
+        self.assertEqual(([(None, True)], 2), resto._diff_lists(expected, received))
+
+
+class TestDiffListsMatching(unittest.TestCase):
+    """
+    The goal of the test is to verify that the _diff_lists()
+    pairs the imperfect matches according to the list matching strategy.
+    """
+    expected = [{'n': 1, 'm': 1}, {'n': 1, 'm': 2, 'k': [1, 2, 3, 4]}]
+    received = [{'n': 1, 'm': 2, 'k': 'q'}, {'n': 2, 'm': 3}]
+
+    def test_diff_lists_greedy(self):
+        ctx = resto._DiffContext(resto.ListMatching.GREEDY)
+        diff = [{'m': (1, 2)}, {'n': (1, 2), 'm': (2, 3), 'k': [1, 2, 3, 4]}]
+        self.assertEqual((diff, 11), resto._diff_lists(self.expected, self.received, ctx))
+
+    def test_diff_lists_optimal(self):
+        ctx = resto._DiffContext(resto.ListMatching.OPTIMAL)
+        diff = [{'n': (1, 2), 'm': (1, 3)}, {'k': 'q'}]
+        self.assertEqual((diff, 10), resto._diff_lists(self.expected, self.received, ctx))
+
+    def test_diff_lists_optimal_fewer_received(self):
+        ctx = resto._DiffContext(resto.ListMatching.OPTIMAL)
+        self.assertEqual(([(1, 7), (2, None)], 3), resto._diff_lists([1, 2], [7], ctx))
+
+    def test_diff_lists_optimal_single_candidate(self):
+        ctx = resto._DiffContext(resto.ListMatching.OPTIMAL, list_candidates=1)
+        diff = [{'m': (1, 2)}, {'n': (1, 2), 'm': (2, 3), 'k': [1, 2, 3, 4]}]
+        self.assertEqual((diff, 11), resto._diff_lists(self.expected, self.received, ctx))
+
+    def test_diff_lists_optimal_several_perfect_matches(self):
+        expected = [{'x': 2, 'y': 3, 'z': 2}, {'x': 3, 'y': 3, 'z': 3}, {'x': 0, 'z': 1}, {'y': 3}]
+        received = [{'x': 2, 'y': 3, 'z': 1}, {'y': 2}, {'x': 1}]
+        ctx = resto._DiffContext(resto.ListMatching.OPTIMAL, list_candidates=10)
+        self.assertEqual(6, resto._diff_lists(expected, received, ctx)[1])
+
+    def test_diff_lists_optimal_more_perfect_matches_than_candidates(self):
+        ctx = resto._DiffContext(resto.ListMatching.OPTIMAL, list_candidates=2)
+        received = [{'id': str(i)} for i in range(0, 8)]
+        self.assertEqual(([], 0), resto._diff_lists([{'id': '*'}] * 8, received, ctx))
+        self.assertEqual(([({'id': '*'}, None)], 1), resto._diff_lists([{'id': '*'}] * 9, received, ctx))
+
+    def brute_force_size(self, expected, received):
+        # The identical items are paired first, then every pairing of as
+        # many of the left-over items as possible is tried.
+        received = list(received)
+        left_over = []
+        for e in expected:
+            if e in received:
+                received.remove(e)
+            else:
+                left_over.append(e)
+        sizes = [[resto._diff_lists([e], [r])[1] for r in received] for e in left_over]
+        n = min(len(left_over), len(received))
+        best = None
+        for eis in itertools.combinations(range(0, len(left_over)), n):
+            for ris in itertools.permutations(range(0, len(received)), n):
+                size = len(left_over) - n + sum(sizes[ei][ri] for ei, ri in zip(eis, ris))
+                if best is None or size < best:
+                    best = size
+        return best
+
+    def test_diff_lists_optimal_like_brute_force(self):
+        rng = random.Random(2)
+        item = lambda: {k: rng.randint(0, 3) for k in 'xyz' if rng.random() < 0.7}
+        for i in range(0, 300):
+            expected = [item() for i in range(0, rng.randint(1, 4))]
+            received = [item() for i in range(0, rng.randint(1, 5))]
+            ctx = resto._DiffContext(resto.ListMatching.OPTIMAL, list_candidates=10)
+            self.assertEqual(self.brute_force_size(expected, received), resto._diff_lists(expected, received, ctx)[1], (expected, received))
+
+    def test_min_cost_assignment(self):
+        candidates = [[(1, 0), (2, 1)], [(1, 0), (9, 2)], [(1, 0)]]
+        pairs = resto._min_cost_assignment(candidates, [False] * 3, [False] * 3)
+        self.assertEqual([(0, 1), (1, 2), (2, 0)], sorted(pairs))
+
+
+class TestDiffListsFuzzy(unittest.TestCase):
+    """
+    The goal of the test is to verify that the fuzzy list matching
+    only compares each expected item with a few hashed candidates
+    and still pairs the closest items.
+    """
+
+    def make_lists(self, count):
+        expected = [{'id': i, 'name': f'dog {i}', 'owner': f'owner {i % 10}', 'tags': ['a', str(i % 7)]} for i in range(0, count)]
+        received = [dict(item, name=item['name'] + ' x') for item in reversed(expected)]
+        return expected, received
+
+    def test_diff_fuzzy_pairs_closest(self):
+        expected, received = self.make_lists(200)
+        ctx = resto._DiffContext(resto.ListMatching.FUZZY)
+        ctx.stats = resto.DiffStats()
+        diff, size = resto._diff_lists(expected, received, ctx)
+        self.assertEqual(200, len(diff))
+        self.assertTrue(sum(1 for item in diff if set(item) == {'name'}) >= 190)
+        self.assertTrue(ctx.stats.comparisons < 200 * 200)
+
+    def test_diff_fuzzy_small_lists_like_greedy(self):
+        expected, received = self.make_lists(10)
+        greedy = resto._diff_lists(expected, received, resto._DiffContext(resto.ListMatching.GREEDY))
+        self.assertEqual(greedy, resto._diff_lists(expected, received, resto._DiffContext(resto.ListMatching.FUZZY)))
+
+    def test_diff_fuzzy_no_candidates(self):
+        expected = [{'id': '*'} for i in range(0, 40)]
+        received = [{'n': i} for i in range(0, 40)]
+        diff, size = resto._diff_lists(expected, received, resto._DiffContext(resto.ListMatching.FUZZY))
+        self.assertEqual([{'id': '*'}] * 40, diff)
+
+    def test_item_tokens(self):
+        tokens = resto._item_tokens({'a': [1, '*'], 'b': {'c': None}})
+        self.assertEqual({(('a',), 1), (('b', 'c'), None)}, tokens)
+
+    def test_diff_fuzzy_same_in_every_process(self):
+        # The texts are hashed differently by each process, but not the tokens.
+        code = (
+            'import resto\n'
+            'expected = [{"id": i, "name": f"dog {i}", "owner": f"owner {i % 10}"} for i in range(300)]\n'
+            'received = [{"id": i + 1, "name": f"dog {i}", "owner": f"owner {i % 9}"} for i in range(300)]\n'
+            'print(resto._diff_lists(expected, received, resto._DiffContext(resto.ListMatching.FUZZY, 2)))\n')
+        folder = os.path.dirname(os.path.abspath(resto.__file__))
+        outputs = set()
+        for seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            result = subprocess.run([sys.executable, '-c', code], cwd=folder, env=env, capture_output=True, text=True, check=True)
+            outputs.add(result.stdout)
+        self.assertEqual(1, len(outputs))
+
+
+class TestDiffListsKeyed(unittest.TestCase):
+    """
+    The goal of the test is to verify that the items of lists
+    matched by key are only compared with the items with the same key.
+    """
+
+    def test_diff_lists_keyed(self):
+        expected = resto.KeyedList('id', [{'id': 1, 'n': 'a'}, {'id': 2, 'n': 'b'}])
+        received = [{'id': 2, 'n': 'a'}, {'id': 1, 'n': 'b'}]
+        self.assertEqual(([{'n': ('a', 'b')}, {'n': ('b', 'a')}], 4), resto._diff_lists(expected, received))
+
+    def test_diff_lists_keyed_missing(self):
+        expected = resto.KeyedList('id', [{'id': 1, 'n': 'a'}, {'id': 3, 'n': 'c'}])
+        received = [{'id': 2, 'n': 'c'}, {'id': 1, 'n': 'a'}]
+        self.assertEqual(([({'id': 3, 'n': 'c'}, None)], 1), resto._diff_lists(expected, received))
+
+    def test_diff_lists_keyed_path(self):
+        expected = resto.KeyedList(('owner', 'id'), [{'owner': {'id': 1}, 'n': 'a'}, {'owner': {'id': 2}, 'n': 'b'}])
+        received = [{'owner': {'id': 2}, 'n': 'a'}, {'owner': {'id': 1}, 'n': 'a'}]
+        self.assertEqual(([{'n': ('b', 'a')}], 2), resto._diff_lists(expected, received))
+
+    def test_diff_lists_keyed_wildcard_key(self):
+        expected = resto.KeyedList('id', [{'id': '*', 'n': 'a'}, {'id': 2, 'n': 'b'}])
+        received = [{'id': 2, 'n': 'b'}, {'id': 'x', 'n': 'a'}]
+        self.assertEqual(([], 0), resto._diff_lists(expected, received))
+
+    def test_diff_json_list_key(self):
+        exp = resto.Expected(out_json={'dogs': [{'id': 1, 'n': 'a'}, {'id': 2, 'n': 'b'}]}, list_key='id')
+        received = {'dogs': [{'id': 2, 'n': 'a'}, {'id': 1, 'n': 'a'}, {'id': 3, 'n': 'c'}]}
+        self.assertEqual({'dogs': [{'n': ('b', 'a')}]}, exp.diff_json(received))
+        received['dogs'][0]['n'] = 'b'
+        self.assertEqual({'dogs': [({'id': 3, 'n': 'c'}, None)]}, exp.diff_json(received))
+        self.assertFalse(exp.matches_json(received))
+
+    def test_matches_json_keyed(self):
+        exp = resto.Expected(out_json={'dogs': resto.KeyedList('id', [{'id': 1, 'n': 'a'}, {'id': 2, 'n': 'b'}])})
+        self.assertTrue(exp.matches_json({'dogs': [{'id': 2, 'n': 'b'}, {'id': 1, 'n': 'a'}]}))
+        self.assertFalse(exp.matches_json({'dogs': [{'id': 2, 'n': 'a'}, {'id': 1, 'n': 'b'}]}))
+
+
+class TestDiffListsOrdered(unittest.TestCase):
+    """
+    The goal of the test is to verify that ordered lists
+    report the deleted, inserted and changed items in order.
+    """
+
+    def diff_ordered(self, expected, received):
+        return resto._diff_lists(expected, received, resto._DiffContext(resto.ListMatching.ORDERED))
+
+    def test_diff_ordered_same(self):
+        self.assertEqual(([], 0), self.diff_ordered([1, '*', {'a': 2}], [1, 'x', {'a': 2}]))
+
+    def test_diff_ordered_deleted(self):
+        self.assertEqual(([('deleted', 1, 2)], 1), self.diff_ordered([1, 2, 3], [1, 3]))
+
+    def test_diff_ordered_inserted(self):
+        self.assertEqual(([('inserted', 1, 2)], 1), self.diff_ordered([1, 3], [1, 2, 3]))
+
+    def test_diff_ordered_changed(self):
+        self.assertEqual(([('changed', 1, {'a': (2, 5)})], 2), self.diff_ordered([1, {'a': 2}, 3], [1, {'a': 5}, 3]))
+
+    def test_diff_ordered_moved(self):
+        self.assertEqual(
+            ([('deleted', 0, 1), ('inserted', 2, 1)], 2),
+            self.diff_ordered([1, 2, 3], [2, 3, 1]))
+
+    def test_diff_ordered_nested_lists(self):
+        self.assertEqual(
+            ([('changed', 0, [('deleted', 0, 1), ('inserted', 1, 1)])], 2),
+            self.diff_ordered([[1, 2]], [[2, 1]]))
+
+    def test_diff_json_ordered(self):
+        exp = resto.Expected(out_json={'a': [1, 2, 3]}, list_matching=resto.ListMatching.ORDERED)
+        self.assertEqual({}, exp.diff_json({'a': [1, 2, 3]}))
+        self.assertEqual({'a': [('changed', 0, (1, 4)), ('inserted', 3, 5)]}, exp.diff_json({'a': [4, 2, 3, 5]}))
+        self.assertFalse(exp.matches_json({'a': [3, 2, 1]}))
+        self.assertTrue(exp.matches_json({'a': [1, 2, 3]}))
+
+    def test_diff_ordered_long_lists(self):
+        expected = list(range(0, 10000))
+        received = list(expected)
+        del received[5000]
+        self.assertEqual(([('deleted', 5000, 5000)], 1), self.diff_ordered(expected, received))
+
+
+@unittest.skipIf(resto.numpy is None, 'NumPy is not installed')
+class TestDiffListsVectorized(unittest.TestCase):
+    """
+    The goal of the test is to verify that large lists of numbers
+    and of flat dicts compared with NumPy give the same differences
+    as when they are compared item by item.
+    """
+
+    def assert_same_as_unvectorized(self, expected, received):
+        diff = resto._diff_lists(expected, received)
+        with patch('resto.numpy', None):
+            self.assertEqual(resto._diff_lists(expected, received), diff)
+        return diff
+
+    def test_diff_numbers_same(self):
+        self.assertEqual(([], 0), self.assert_same_as_unvectorized(list(range(0, 1000)), list(range(999, -1, -1))))
+
+    def test_diff_numbers_different(self):
+        expected = [i % 7 for i in range(0, 200)]
+        received = [i % 5 + 0.5 * (i % 3 == 0) for i in range(0, 190)]
+        diff, size = self.assert_same_as_unvectorized(expected, received)
+        self.assertTrue(size > 0)
+
+    def test_diff_numbers_mixed_types(self):
+        expected = [True, 2, 3.0] * 50
+        received = [1, 2.0, 3, 4] * 40
+        self.assert_same_as_unvectorized(expected, received)
+
+    def test_diff_numbers_large_ints(self):
+        expected = [2 ** 60 + i for i in range(0, 100)]
+        received = [float(2 ** 60)] * 100
+        self.assert_same_as_unvectorized(expected, received)
+
+    def test_diff_flat_dicts(self):
+        expected = [{'id': i, 'name': 'dog %d' % (i % 10), 'good': i % 2 == 0} for i in range(0, 100)]
+        received = [{'id': i + i % 3, 'name': 'dog %d' % (i % 9), 'good': True, 'extra': None} for i in range(0, 90)]
+        diff, size = self.assert_same_as_unvectorized(expected, received)
+        self.assertTrue(size > 0)
+
+    def test_diff_flat_dicts_not_flat(self):
+        expected = [{'id': i, 'tags': [i]} for i in range(0, 20)]
+        received = [{'id': i, 'tags': [i + 1]} for i in range(0, 20)]
+        self.assert_same_as_unvectorized(expected, received)
+
+    def test_diff_json_numbers(self):
+        exp = resto.Expected(out_json={'values': list(range(0, 1000))})
+        received = {'values': list(range(0, 1000))}
+        received['values'][10] = -1
+        self.assertEqual({'values': [(10, -1)]}, exp.diff_json(received))
+
+
 class TestDiffDicts(unittest.TestCase):
     """
     The goal of the test is to verify that the _diff_dicts()
@@ -122,6 +492,448 @@ class TestDiffDicts(unittest.TestCase):
         self.assertEqual((diff, 2), resto._diff_dicts(expected, received))
 
 
+class TestDiffDeepDocuments(unittest.TestCase):
+    """
+    The goal of the test is to verify that the diff helpers
+    can compare documents nested deeper than the recursion limit.
+    """
+
+    def deep_document(self, depth, leaf):
+        value = {'leaf': leaf, 'items': [leaf]}
+        for i in range(depth):
+            value = {'name': i, 'child': [value]}
+        return value
+
+    def test_diff_dicts_very_deep_identical(self):
+        expected = self.deep_document(5000, 1)
+        received = self.deep_document(5000, 1)
+        self.assertEqual(({}, 0), resto._diff_dicts(expected, received))
+
+    def test_diff_dicts_very_deep_different(self):
+        expected = self.deep_document(5000, 1)
+        received = self.deep_document(5000, 2)
+        diff, size = resto._diff_dicts(expected, received)
+        for i in range(5000):
+            diff = diff['child'][0]
+        self.assertEqual({'leaf': (1, 2), 'items': [(1, 2)]}, diff)
+        self.assertEqual(4, size)
+
+
+class TestCompiledExpectations(unittest.TestCase):
+    """
+    The goal of the test is to verify that the expected JSON
+    is compiled once into matchers that compare like the diff helpers.
+    """
+
+    def test_compile_json_reused(self):
+        exp = resto.Expected(out_json={'a': [1, 2]})
+        compiled = exp.compile_json()
+        self.assertEqual({}, exp.diff_json({'a': [2, 1]}))
+        self.assertIs(compiled, exp.compile_json())
+
+    def test_compile_json_replaced(self):
+        exp = resto.Expected(out_json={'a': 1})
+        compiled = exp.compile_json()
+        exp.out_json = {'a': 2}
+        self.assertIsNot(compiled, exp.compile_json())
+        self.assertEqual({'a': (2, 1)}, exp.diff_json({'a': 1}))
+
+    def test_compile_text_matchers(self):
+        self.assertTrue(resto._compile('~ell', {}).matches('hello'))
+        self.assertFalse(resto._compile('~ell', {}).matches('bye'))
+        self.assertTrue(resto._compile('*', {}).matches(''))
+        self.assertTrue(resto._compile('hello', {}).matches('~ell'))
+        self.assertFalse(resto._compile('hello', {}).matches('hell'))
+
+    def test_compile_sizes(self):
+        value = {'hello': ['world', {'nice': 'day'}]}
+        self.assertEqual(resto._diff_size(value), resto._compile(value, {}).size)
+
+    def test_diff_json_pattern(self):
+        exp = resto.Expected(out_json={'id': re.compile(r'^\d+$')})
+        self.assertEqual({}, exp.diff_json({'id': '123'}))
+        self.assertEqual({'id': (exp.out_json['id'], '12a')}, exp.diff_json({'id': '12a'}))
+
+    def test_diff_json_pattern_not_text(self):
+        exp = resto.Expected(out_json={'id': re.compile(r'^\d+$')}, out_json_strict=False)
+        self.assertEqual({'id': (exp.out_json['id'], 123)}, exp.diff_json({'id': 123}))
+
+    def test_diff_json_replayed(self):
+        exp = resto.Expected(out_json={'dogs': [{'id': 1, 'name': '~ack'}, {'id': 2, 'name': '*'}]})
+        for i in range(3):
+            self.assertEqual({}, exp.diff_json({'dogs': [{'id': 2, 'name': 'Prancer'}, {'id': 1, 'name': 'Blacky'}]}))
+            self.assertEqual({'dogs': [{'name': ('~ack', 'Fluffy')}]}, exp.diff_json({'dogs': [{'id': 2, 'name': 'Prancer'}, {'id': 1, 'name': 'Fluffy'}]}))
+
+
+class TestDiffStrict(unittest.TestCase):
+    """
+    The goal of the test is to verify that the strict diff compares
+    in both directions at once, like two separate diffs.
+    """
+
+    def assertDiffStrictLikeTwoDiffs(self, expected, received):
+        ctx = resto._DiffContext()
+        diff, size = resto._diff_values(expected, received, ctx)
+        rev_diff, rev_size = resto._diff_values(received, expected, ctx)
+        self.assertEqual((diff, size, rev_diff, rev_size), resto._diff_strict(expected, received))
+
+    def test_diff_strict_extra_keys(self):
+        self.assertEqual(({}, 0, {'b': 2}, 1), resto._diff_strict({'a': 1}, {'a': 1, 'b': 2}))
+
+    def test_diff_strict_extra_items(self):
+        self.assertEqual(([], 0, [(3, None)], 1), resto._diff_strict([1, 2], [2, 3, 1]))
+
+    def test_diff_strict_like_two_diffs(self):
+        for expected, received in [
+                ({'a': '~ell', 'b': '*'}, {'a': 'hello', 'b': 'x'}),
+                ({'a': {'b': 1}}, {'a': None}),
+                ({'a': [1, {'b': 2}]}, {'a': {'b': 2}}),
+                ({'a': [{'b': 1, 'c': 2}, {'b': 3}]}, {'a': [{'b': 3, 'd': 4}, {'b': 1}, {'c': 2}]}),
+                ([[1, 2], [3, '~4']], [[3, '45'], [1, 2, 5], 6]),
+                ('x', {'a': 1})]:
+            self.assertDiffStrictLikeTwoDiffs(expected, received)
+
+    def test_diff_json_strict(self):
+        exp = resto.Expected(out_json={'a': [1, {'b': 2}], 'c': 3, 'd': {'e': 4}})
+        received = {'a': [{'b': 2, 'f': 5}, 1, 6], 'd': {'e': 4, 'g': 7}, 'h': 8}
+        self.assertEqual(
+            {'a': [{'f': 5}, (6, None)], 'c': 3, 'd': {'g': 7}, 'h': 8},
+            exp.diff_json(received))
+
+    def test_diff_json_strict_uncached_pairs(self):
+        exp = resto.Expected(out_json={'a': [{'b': 1}, {'b': 2}, {'b': 3}]})
+        received = {'a': [{'b': 3, 'c': 1}, {'b': 4}, {'b': 1}]}
+        diff = exp.diff_json(received)
+        with patch('resto._STRICT_CACHED_PAIRS', 0):
+            self.assertEqual(diff, exp.diff_json(received))
+
+
+class TestMatches(unittest.TestCase):
+    """
+    The goal of the test is to verify that the fail-fast match helpers
+    agree with the diff helpers finding no difference.
+    """
+
+    def assertMatchesLikeDiff(self, exp, received_json):
+        self.assertEqual(not exp.diff_json(received_json), exp.matches_json(received_json))
+
+    def test_matches_json_identical(self):
+        exp = resto.Expected(out_json={'a': [1, {'b': 'c'}], 'd': None})
+        self.assertTrue(exp.matches_json({'a': [{'b': 'c'}, 1], 'd': None}))
+
+    def test_matches_json_wildcards(self):
+        exp = resto.Expected(out_json={'a': '~ell', 'b': '*', 'c': re.compile('^h')})
+        self.assertTrue(exp.matches_json({'a': 'hello', 'b': 'x', 'c': 'hi'}))
+        self.assertFalse(exp.matches_json({'a': 'bye', 'b': 'x', 'c': 'hi'}))
+
+    def test_matches_json_missing_key(self):
+        exp = resto.Expected(out_json={'a': 0}, out_json_strict=False)
+        self.assertFalse(exp.matches_json({}))
+
+    def test_matches_json_extra_key(self):
+        self.assertFalse(resto.Expected(out_json={'a': 1}).matches_json({'a': 1, 'b': 2}))
+        self.assertTrue(resto.Expected(out_json={'a': 1}, out_json_strict=False).matches_json({'a': 1, 'b': 2}))
+
+    def test_matches_json_lists(self):
+        exp = resto.Expected(out_json={'a': [{'n': 1}, {'n': '*'}]})
+        self.assertTrue(exp.matches_json({'a': [{'n': 'x'}, {'n': 1}]}))
+        self.assertFalse(exp.matches_json({'a': [{'n': 'x'}, {'n': 2}]}))
+
+    def test_matches_json_lists_in_order(self):
+        items = [{'id': i, 'tags': [i, i + 1]} for i in range(0, 50)]
+        for strict in (True, False):
+            exp = resto.Expected(out_json={'a': items}, out_json_strict=strict)
+            exp.compile_json()
+            with patch('resto._fingerprint', wraps=resto._fingerprint) as fingerprint:
+                self.assertTrue(exp.matches_json({'a': copy.deepcopy(items)}))
+            fingerprint.assert_not_called()
+            for changed in (0, 25, 49):
+                received = copy.deepcopy(items)
+                received[changed]['tags'].append(0)
+                self.assertMatchesLikeDiff(exp, {'a': received})
+                self.assertMatchesLikeDiff(exp, {'a': received[1:] + received[:1]})
+
+    def test_matches_json_like_diff(self):
+        exp = resto.Expected(out_json={'a': [1, 2, [3, '~x']], 'b': {'c': {}}, 'd': '*'})
+        for received_json in [
+                None, {}, {'a': [1, 2, [3, 'x']], 'b': {'c': {}}, 'd': 'y'},
+                {'a': [2, 1, ['yxy', 3]], 'b': {'c': None}, 'd': 'y'},
+                {'a': [1, 2, [3, 'y']], 'b': {'c': {}}, 'd': 'y'},
+                {'a': [1, 2], 'b': {'c': {}}, 'd': 'y'},
+                {'a': [1, 2, [3, 'x'], 4], 'b': {'c': {}}, 'd': 'y'},
+                {'a': [1, 2, [3, 'x']], 'b': [], 'd': 'y'},
+                {'a': [1, 2, [3, 'x']], 'b': {'c': {}}, 'd': 2}]:
+            for strict in (True, False):
+                exp.out_json_strict = strict
+                self.assertMatchesLikeDiff(exp, received_json)
+
+    def test_matches_json_optimal_like_diff(self):
+        # Pairing the first list with False leaves the dict without a perfect match.
+        exp = resto.Expected(out_json={'a': [[1], {'b': '*'}, {'c': {}}]}, list_matching=resto.ListMatching.OPTIMAL)
+        for received_json in [
+                {'a': [False, [2], {'c': {}}, {}]},
+                {'a': [False, {'b': 'x'}, {'c': {}}, {}]},
+                {'a': [{'b': 'x'}, [1], {'c': {}}]}]:
+            for strict in (True, False):
+                exp.out_json_strict = strict
+                self.assertMatchesLikeDiff(exp, received_json)
+
+    def test_matches_json_strict_like_diff(self):
+        exp = resto.Expected(out_json={'a': [{'n': 1}, {'n': '*'}, 'x*'], 'b': {'c': [0]}, 'd': ''})
+        for received_json in [
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy'], 'b': {'c': [0]}, 'd': ''},
+                {'a': [{'n': '*'}, {'n': 1}, 'x*'], 'b': {'c': [0]}, 'd': ''},
+                {'a': [{'n': 1}, {'n': 1}, 'xy'], 'b': {'c': [0]}, 'd': ''},
+                {'a': [{'n': 'x', 'm': 1}, {'n': 1}, 'xy'], 'b': {'c': [0]}, 'd': ''},
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy', 'z'], 'b': {'c': [0]}, 'd': ''},
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy'], 'b': {'c': [0, 0]}, 'd': ''},
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy'], 'b': {'c': []}, 'd': ''},
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy'], 'b': {'c': [0]}, 'd': []},
+                {'a': [{'n': 'x'}, {'n': 1}, 'xy'], 'b': {'c': [0]}, 'd': '', 'e': None}]:
+            self.assertMatchesLikeDiff(exp, received_json)
+
+    def test_matches_json_strict_not_compiled(self):
+        exp = resto.Expected(out_json={'a': [{'n': 1}, {'n': '*'}]})
+        exp.compile_json()
+        with patch('resto._compile', wraps=resto._compile) as compile:
+            self.assertTrue(exp.matches_json({'a': [{'n': 'x'}, {'n': 1}]}))
+            self.assertFalse(exp.matches_json({'a': [{'n': 'x'}, {'n': 1, 'm': 2}]}))
+        compile.assert_not_called()
+
+    def test_matches_json_none(self):
+        self.assertTrue(resto.Expected(out_json=None).matches_json({}))
+        self.assertFalse(resto.Expected(out_json=None).matches_json({'a': 1}))
+        self.assertTrue(resto.Expected(out_json=None, out_json_strict=False).matches_json({'a': 1}))
+        self.assertFalse(resto.Expected(out_json={'a': 1}).matches_json(None))
+
+    def test_matches_headers(self):
+        exp = resto.Expected(out_headers={'Location': 'here'})
+        self.assertEqual(not exp.diff_headers({'location': 'there'}), exp.matches_headers({'location': 'there'}))
+        self.assertFalse(exp.matches_headers({'Content-Type': 'x'}))
+        self.assertFalse(exp.matches_headers({}))
+        self.assertTrue(resto.Expected().matches_headers({'Content-Type': 'x'}))
+
+    @patch('resto.Config.get_session')
+    def test_call_fail_fast(self, get_session):
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.content = b'{"a": [1, 2]}'
+        response.headers = {}
+        response.status_code = 200
+
+        exp = resto.Expected(url='/a', out_json={'a': [1, 3]})
+        self.assertEqual({'json': exp.out_json}, exp.call(resto.Config('http://x'), fail_fast=True))
+        self.assertFalse(exp.matches(resto.Config('http://x')))
+
+        exp.out_json = {'a': [2, 1]}
+        self.assertTrue(exp.matches(resto.Config('http://x')))
+
+        exp.status_code = 404
+        self.assertEqual({'status_code': (404, 200)}, exp.call(resto.Config('http://x'), fail_fast=True))
+
+
+class TestDiffHeaders(unittest.TestCase):
+    """
+    The goal of the test is to verify that the headers are
+    matched by case-insensitive names and compared by value.
+    """
+
+    def test_diff_headers_values(self):
+        exp = resto.Expected(out_headers={'Location': 'here', 'Content-Type': '~json'})
+        self.assertEqual({}, exp.diff_headers({'location': 'here', 'CONTENT-TYPE': 'application/json'}))
+        self.assertEqual({'location': ('here', 'there')}, exp.diff_headers({'Location': 'there', 'Content-Type': 'json'}))
+
+    def test_diff_headers_missing(self):
+        exp = resto.Expected(out_headers={'Location': 'here'})
+        self.assertEqual({'location': 'here'}, exp.diff_headers({'Content-Type': 'x'}))
+
+    def test_diff_headers_case_insensitive_dict(self):
+        exp = resto.Expected(out_headers={'LOCATION': 'here'})
+        received = requests.structures.CaseInsensitiveDict({'Location': 'here'})
+        self.assertEqual({}, exp.diff_headers(received))
+        self.assertTrue(exp.matches_headers(received))
+
+    def test_diff_headers_compiled_once(self):
+        exp = resto.Expected(out_headers={'Location': 'here'})
+        self.assertIs(exp.compile_headers(), exp.compile_headers())
+        exp.out_headers = {'Location': 'there'}
+        self.assertEqual({}, exp.diff_headers({'location': 'there'}))
+
+
+class TestCompactDiff(unittest.TestCase):
+    """
+    The goal of the test is to verify that the compact Diff
+    lists the differences by path and converts back to the nested form.
+    """
+    nested = {'a': {'b/c': (1, 2)}, 'd': [{'e': ('x', 'y')}, ({'f': 1}, None)], 'g': {}, 0: 3}
+
+    def test_diff_entries(self):
+        diff = resto.Diff()
+        diff.update(self.nested)
+        self.assertEqual([
+            ('/a/b~1c', 1, 2),
+            ('/d/0/e', 'x', 'y'),
+            ('/d/1', {'f': 1}, None),
+            ('/g', {}, None),
+            ('/0', 3, None),
+        ], diff.entries)
+        self.assertEqual('/d/0/e', diff.entries[1].path)
+
+    def test_diff_to_nested(self):
+        diff = resto.Diff()
+        diff.update(self.nested)
+        self.assertEqual(self.nested, diff.to_nested())
+        self.assertIs(diff.to_nested(), diff.to_nested())
+
+    def test_diff_empty(self):
+        diff = resto.Diff()
+        diff.update({})
+        self.assertFalse(diff)
+        self.assertEqual({}, diff.to_nested())
+
+    def test_diff_max_entries(self):
+        diff = resto.Diff(max_entries=2)
+        diff.update({'a': [(i, i + 1) for i in range(0, 1000)]})
+        self.assertEqual(2, len(diff))
+        self.assertTrue(diff.truncated)
+        self.assertEqual({'a': [(0, 1), (1, 2)]}, diff.to_nested())
+
+    def test_diff_update_replaces_keys(self):
+        diff = resto.Diff()
+        diff.update({'a': 1, 'b': {'c': (1, 2), 'd': (3, 4)}})
+        diff.update({'a': 2})
+        diff.update({'b': {'e': 5}})
+        self.assertEqual([('/a', 2, None), ('/b/e', 5, None)], diff.entries)
+        self.assertEqual({'a': 2, 'b': {'e': 5}}, diff.to_nested())
+
+    def test_diff_like_diff_json(self):
+        exp = resto.Expected(out_json={'dogs': [{'id': 1, 'n': ['a', 'b']}, {'id': 2}], 'cat': {'n': 'c', 'a': {'b': 1}}})
+        received = {'dogs': [{'id': 1, 'n': ['a', 'c']}], 'extra': True, 'cat': {'n': 'd', 'a': {'c': 1}}}
+        for strict in (True, False):
+            exp.out_json_strict = strict
+            nested = exp.diff_json(received)
+            diff = resto.Diff()
+            diff.update(nested)
+            self.assertEqual(nested, diff.to_nested())
+            self.assertEqual(nested, exp.diff_json(received, resto.Diff()).to_nested())
+
+    def test_diff_json_stops_when_full(self):
+        exp = resto.Expected(out_json={str(i): {'a': i, 'b': {'c': i}} for i in range(0, 1000)}, instrument=True)
+        received = {str(i): {'a': -i, 'b': {'c': -i}} for i in range(0, 1000)}
+        for strict in (True, False):
+            exp.out_json_strict = strict
+            with patch('resto._dicts_frame') as dicts_frame, patch('resto._strict_dicts_frame') as strict_dicts_frame:
+                diff = exp.diff_json(received, resto.Diff(max_entries=3))
+            dicts_frame.assert_not_called()
+            strict_dicts_frame.assert_not_called()
+            self.assertEqual([('/1/a', 1, -1), ('/1/b/c', 1, -1), ('/2/a', 2, -2)], diff.entries)
+            self.assertTrue(diff.truncated)
+            self.assertLess(exp.diff_stats.comparisons, 20)
+
+    @patch('resto.Config.get_session')
+    def test_call_compact(self, get_session):
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.content = b'{"a": [1, 2]}'
+        response.headers = {}
+        response.status_code = 404
+
+        exp = resto.Expected(url='/a', out_json={'a': [1, 3]})
+        diff = exp.call(resto.Config('http://x'), compact=True)
+        self.assertEqual([('/a/0', 3, 2), ('/status_code', 200, 404)], diff.entries)
+        self.assertEqual(exp.call(resto.Config('http://x')), diff.to_nested())
+
+        exp.diff_cache = resto.DiffCache(4)
+        for _ in range(0, 2):
+            diff = exp.call(resto.Config('http://x'), compact=True, max_entries=1)
+            self.assertEqual([('/a/0', 3, 2)], diff.entries)
+            self.assertTrue(diff.truncated)
+            self.assertEqual({'a': [(3, 2)], 'status_code': (200, 404)}, exp.call(resto.Config('http://x')))
+
+
+class TestDiffStats(unittest.TestCase):
+    """
+    The goal of the test is to verify that an instrumented Expected
+    keeps the statistics of its comparisons.
+    """
+    expected = {'dogs': [{'id': i, 'name': f'dog {i}', 'tags': ['a']} for i in range(0, 4)], 'owner': '~bob'}
+    received = {'dogs': [{'id': i, 'name': f'dog {i + 1}', 'tags': ['a']} for i in range(0, 4)], 'owner': 'bobby'}
+
+    def test_diff_stats_disabled(self):
+        exp = resto.Expected(out_json=self.expected)
+        exp.diff_json(self.received)
+        self.assertIsNone(exp.diff_stats)
+
+    def test_diff_stats_counters(self):
+        exp = resto.Expected(out_json=self.expected, instrument=True)
+        exp.diff_json(self.received)
+        stats = exp.diff_stats
+        self.assertTrue(stats.comparisons > 16)
+        self.assertTrue(stats.text_matches > 0)
+        self.assertEqual(16, stats.largest_candidate_matrix)
+
+    def test_diff_stats_path_times(self):
+        exp = resto.Expected(out_json=self.expected, instrument=True)
+        exp.diff_json(self.received)
+        times = exp.diff_stats.path_times
+        self.assertEqual({'', '/dogs', '/dogs/0', '/dogs/1', '/dogs/2', '/dogs/3'}, set(times))
+        self.assertTrue(times[''] >= times['/dogs'] >= times['/dogs/0'])
+
+    def test_matches_stats(self):
+        exp = resto.Expected(out_json=self.expected, instrument=True)
+        self.assertFalse(exp.matches_json(self.received))
+        self.assertTrue(exp.diff_stats.comparisons > 0)
+
+
+class TestDiffCache(unittest.TestCase):
+    """
+    The goal of the test is to verify that identical received bodies
+    reuse the cached comparison.
+    """
+
+    def test_diff_cache_lru(self):
+        cache = resto.DiffCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+        self.assertEqual(2, len(cache))
+
+    @patch('resto.Config.get_session')
+    def test_call_cached(self, get_session):
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.content = b'{"a": [1, 2]}'
+        response.headers = {}
+        response.status_code = 200
+
+        exp = resto.Expected(url='/a', out_json={'a': [1, 3]}, diff_cache_size=4)
+        with patch('resto._loads_json', wraps=resto._loads_json) as loads_json:
+            first = exp.call(resto.Config('http://x'))
+            self.assertEqual(first, exp.call(resto.Config('http://x')))
+            self.assertEqual(1, loads_json.call_count)
+        self.assertEqual((1, 1), (exp.diff_cache.hits, exp.diff_cache.misses))
+
+        self.assertFalse(exp.matches(resto.Config('http://x')))
+        self.assertFalse(exp.matches(resto.Config('http://x')))
+        self.assertEqual((2, 2), (exp.diff_cache.hits, exp.diff_cache.misses))
+
+        response.content = b'{"a": [3, 1]}'
+        self.assertEqual({}, exp.call(resto.Config('http://x')))
+        self.assertEqual({'a': [3, 1]}, exp.received_json)
+
+    @patch('resto.Config.get_session')
+    def test_call_not_cached(self, get_session):
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.content = b'{"a": 1}'
+        response.headers = {}
+        response.status_code = 200
+
+        exp = resto.Expected(url='/a', out_json={'a': 1})
+        self.assertEqual({}, exp.call(resto.Config('http://x')))
+        self.assertIsNone(exp.diff_cache)
+
+
 class TestDiffValues(unittest.TestCase):
     """
     The goal of the test is to verify that the _diff_values()
@@ -0,0 +1,153 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import concurrent.futures
+import time
+
+import requests
+
+import resto
+from test_transports import _echo_app
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the latency histogram
+    gives percentiles within its relative error.
+    """
+
+    def test_percentiles(self):
+        h = resto.LatencyHistogram()
+        for i in range(1, 10001):
+            h.record(i / 1000000)
+        self.assertEqual((10000, 1, 10000), (h.count, h.min, h.max))
+        for percent in (50, 90, 99):
+            self.assertAlmostEqual(percent * 100 / 1000000, h.percentile(percent), delta=percent * 100 / 1000000 * 0.016)
+        self.assertEqual(0.01, h.percentile(100))
+        self.assertAlmostEqual(0.0050005, h.mean())
+
+    def test_small_values_exact(self):
+        h = resto.LatencyHistogram()
+        for value in (3, 1, 2, 100):
+            h.record(value / 1000000)
+        self.assertEqual([0.000001, 0.000002, 0.000003, 0.0001], [h.percentile(p) for p in (25, 50, 75, 100)])
+
+    def test_merge(self):
+        a, b = resto.LatencyHistogram(), resto.LatencyHistogram()
+        a.record(0.001)
+        b.record(0.5)
+        b.record(0.002)
+        a.merge(b)
+        self.assertEqual((3, 1000, 500000), (a.count, a.min, a.max))
+        self.assertAlmostEqual(0.002, a.percentile(50), delta=0.002 * 0.016)
+        self.assertRaises(ValueError, a.merge, resto.LatencyHistogram(5))
+
+    def test_empty(self):
+        h = resto.LatencyHistogram()
+        self.assertEqual((0.0, 0.0), (h.percentile(99), h.mean()))
+
+
+class TestRunLoad(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the load test calls the
+    weighted mix of expected responses and reports their statistics.
+    """
+
+    def test_run_load(self):
+        config = resto.Config('http://app', app=_echo_app)
+        matching = resto.Expected(url='/a', out_json={'path': '/a'}, out_json_strict=False, status_code=201, diff_cache_size=8)
+        differing = resto.Expected(url='/b', out_json={'path': '/a'}, out_json_strict=False, status_code=201)
+        never = resto.Expected(url='/c', status_code=201)
+
+        report = resto.run_load([(matching, 3), (differing, 1), (never, 0)], config, users=3, duration=0.2, seed=1)
+        a, b, c = report.stats
+        self.assertEqual(['GET /a', 'GET /b', 'GET /c'], [s.label for s in report.stats])
+        self.assertGreater(a.calls, b.calls)
+        self.assertGreater(b.calls, 0)
+        self.assertEqual(0, c.calls)
+        self.assertEqual((0, 0.0, 1.0), (a.diffs, b.error_rate(), b.diff_rate()))
+        self.assertEqual(a.calls + b.calls, report.total.calls)
+        self.assertEqual(report.total.calls, report.total.latencies.count)
+        self.assertAlmostEqual(report.total.calls / report.duration, report.throughput())
+        self.assertGreaterEqual(report.duration, 0.2)
+        self.assertGreater(matching.diff_cache.hits, 0)
+        self.assertEqual(5, len(report.format().splitlines()))
+
+    def test_run_load_errors(self):
+        def failing_app(environ, start_response):
+            raise ConnectionError('down')
+        config = resto.Config('http://failing', app=failing_app)
+        report = resto.run_load([(resto.Expected(url='/a'), 1)], config, users=2, duration=0.05)
+        self.assertGreater(report.total.calls, 0)
+        self.assertEqual(1.0, report.stats[0].error_rate())
+
+
+class TestRunBatch(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the expected responses
+    called in a pool of threads give the same diffs, in order, with
+    one session per thread.
+    """
+
+    def _get(self, url, **kwargs):
+        time.sleep(0.01)
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.content = ('{"a": "%s"}' % url).encode()
+        response.headers = {}
+        response.status_code = 200
+        return response
+
+    def test_get_session_per_thread(self):
+        config = resto.Config('http://x')
+        session = config.get_session()
+        self.assertIs(session, config.get_session())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(config.get_session).result()
+        self.assertIsNot(session, other)
+
+        with patch.object(session, 'close') as close:
+            config.close()
+            close.assert_called_once_with()
+        self.assertIsNot(session, config.get_session())
+
+    def test_run_batch(self):
+        sessions = []
+        def new_session():
+            session = MagicMock()
+            session.get.side_effect = self._get
+            sessions.append(session)
+            return session
+
+        expecteds = [resto.Expected(url=f'/{i}', out_json={'a': 'http://x/1'}) for i in range(8)]
+        with patch('requests.Session', side_effect=new_session):
+            diffs = resto.run_batch(expecteds, resto.Config('http://x'), workers=3)
+        self.assertEqual([{'a': ('http://x/1', 'http://x/0')}, {}], diffs[:2])
+        self.assertEqual({'a': ('http://x/1', 'http://x/7')}, diffs[7])
+        self.assertLessEqual(len(sessions), 3)
+        self.assertEqual(8, sum(session.get.call_count for session in sessions))
+
+    def test_run_batch_pool_size(self):
+        config = resto.Config('http://sized', pool_maxsize=2)
+        self.assertIs(config, config.sized_for(2))
+        sized = config.sized_for(12)
+        self.assertEqual((2, 12), (config.pool_maxsize, sized.pool_maxsize))
+
+        expecteds = [resto.Expected(url=f'/{i}') for i in range(4)]
+        with patch('resto.Config.get_session', autospec=True) as get_session:
+            get_session.return_value.get.side_effect = self._get
+            resto.run_batch(expecteds, config, workers=12)
+        self.assertEqual({12}, {call.args[0].pool_maxsize for call in get_session.call_args_list})
+        adapter = sized.get_session().get_adapter('http://sized/a')
+        self.assertEqual(12, adapter._pool_maxsize)
+        sized.close()
+
+    @patch('resto.Config.get_session')
+    def test_run_batch_fail_fast(self, get_session):
+        get_session.return_value.get.side_effect = self._get
+        expecteds = [resto.Expected(url=f'/{i}', out_json={'a': 'http://x/1'}) for i in range(3)]
+        diffs = resto.run_batch(expecteds, resto.Config('http://x'), workers=2, fail_fast=True)
+        self.assertEqual([{'json': {'a': 'http://x/1'}}, {}, {'json': {'a': 'http://x/1'}}], diffs)
+
+
+if __name__ == '__main__':
+    unittest.main()
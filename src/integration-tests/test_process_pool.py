@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+import concurrent.futures
+
+import resto
+
+
+class TestDiffListsParallel(unittest.TestCase):
+    """
+    The goal of the test is to verify that the items of large lists
+    compared in a pool of processes give the same differences as when
+    they are compared in-process.
+    """
+
+    def diff_parallel(self, expected, received, list_matching = resto.ListMatching.GREEDY):
+        ctx = resto._DiffContext(list_matching, list_workers=2)
+        with patch('resto._PARALLEL_MIN_PAIRS', 4):
+            return resto._diff_lists(expected, received, ctx)
+
+    def test_diff_parallel_like_in_process(self):
+        expected = [{'id': i, 'tags': [i, i + 1], 'owner': {'n': 'a'}} for i in range(0, 12)]
+        received = [{'id': i + i % 2, 'tags': [i + 1], 'owner': {'n': 'b'}} for i in range(0, 10)]
+        for list_matching in (resto.ListMatching.GREEDY, resto.ListMatching.OPTIMAL):
+            ctx = resto._DiffContext(list_matching)
+            self.assertEqual(resto._diff_lists(expected, received, ctx), self.diff_parallel(expected, received, list_matching))
+
+    def test_diff_parallel_perfect_matches(self):
+        expected = [{'id': '*', 'n': i} for i in range(0, 5)]
+        received = [{'id': str(i), 'n': 4 - i} for i in range(0, 5)]
+        self.assertEqual(([], 0), self.diff_parallel(expected, received))
+
+    def test_diff_parallel_small_lists_in_process(self):
+        ctx = resto._DiffContext(list_workers=2)
+        with patch('resto._get_process_pool') as get_process_pool:
+            self.assertEqual(([({'a': 1}, None)], 1), resto._diff_lists([{'a': 1}], [], ctx))
+            get_process_pool.assert_not_called()
+
+    def test_process_pool_shared(self):
+        pool = resto._get_process_pool(2)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            pools = list(executor.map(resto._get_process_pool, [2] * 8))
+        self.assertEqual([pool] * 8, pools)
+        self.assertIsNot(pool, resto._get_process_pool(3))
+        self.assertNotEqual('fork', pool._mp_context.get_start_method())
+
+    def test_diff_json_parallel(self):
+        exp = resto.Expected(out_json={'dogs': [{'id': i, 'n': [i]} for i in range(0, 5)]}, list_workers=2)
+        received = {'dogs': [{'id': i, 'n': [i + 1]} for i in range(0, 5)]}
+        with patch('resto._PARALLEL_MIN_PAIRS', 4):
+            diff = exp.diff_json(received)
+        exp.list_workers = 0
+        self.assertEqual(exp.diff_json(received), diff)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+import asyncio
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import requests
+
+import resto
+
+
+class _FakeMultiDict():
+    def __init__(self, items: list):
+        self.items = items
+
+    def keys(self) -> list:
+        return [k for k, v in self.items]
+
+    def getall(self, key: str) -> list:
+        return [v for k, v in self.items if k.lower() == key.lower()]
+
+
+class _FakeAiohttpResponse():
+    def __init__(self, content: bytes):
+        self.status = 200
+        self.headers = _FakeMultiDict([('Content-Type', 'application/json'), ('Set-Cookie', 'a=1'), ('set-cookie', 'b=2')])
+        self.content = content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def read(self) -> bytes:
+        return self.content
+
+
+class _FakeAiohttpSession():
+    def __init__(self, connector=None):
+        self.connector = connector
+        self.requests = []
+
+    async def __aenter__(self):
+        _FakeAiohttp.sessions.append(self)
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def request(self, method: str, url: str, params=None, headers=None, json=None):
+        self.requests.append((method, url))
+        return _FakeAiohttpResponse(('{"a": "%s"}' % url).encode())
+
+
+class _FakeAiohttp():
+    ClientSession = _FakeAiohttpSession
+    TCPConnector = Mock()
+    sessions = []
+
+
+class TestAsyncCall(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the expected responses
+    called concurrently from asyncio give the same diffs, in order.
+    """
+
+    def _expecteds(self, count: int) -> list:
+        return [resto.Expected(url=f'/{i}', out_json={'a': 'http://x/1'}) for i in range(count)]
+
+    @patch('resto.aiohttp', None)
+    @patch('resto.Config.get_session')
+    def test_call_all_without_aiohttp(self, get_session):
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.__enter__.return_value = response
+            response.content = ('{"a": "%s"}' % url).encode()
+            response.headers = {}
+            response.status_code = 200
+            return response
+        get_session.return_value.get.side_effect = get
+
+        diffs = resto.call_all(self._expecteds(5), resto.Config('http://x'), concurrency=2)
+        self.assertEqual([{'a': ('http://x/1', 'http://x/0')}, {}], diffs[:2])
+        self.assertEqual({'a': ('http://x/1', 'http://x/4')}, diffs[4])
+        self.assertEqual(5, get_session.return_value.get.call_count)
+
+    @patch('resto.aiohttp', None)
+    @patch('resto.Config.get_session')
+    def test_call_all_concurrency(self, get_session):
+        lock = threading.Lock()
+        running = [0, 0]
+        def get(url, **kwargs):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            response = MagicMock()
+            response.__enter__.return_value = response
+            response.content = b'{}'
+            response.status_code = 200
+            return response
+        get_session.return_value.get.side_effect = get
+
+        resto.call_all(self._expecteds(12), resto.Config('http://x'), concurrency=3)
+        self.assertLessEqual(running[1], 3)
+        self.assertGreater(running[1], 1)
+
+    @patch('resto.aiohttp', _FakeAiohttp)
+    def test_call_all_with_aiohttp(self):
+        _FakeAiohttp.sessions.clear()
+        diffs = resto.call_all(self._expecteds(3), resto.Config('http://x'), fail_fast=True)
+        self.assertEqual([{'json': {'a': 'http://x/1'}}, {}, {'json': {'a': 'http://x/1'}}], diffs)
+        self.assertEqual(1, len(_FakeAiohttp.sessions))
+        self.assertEqual(3, len(_FakeAiohttp.sessions[0].requests))
+        _FakeAiohttp.TCPConnector.assert_called_with(limit=10)
+
+    @patch('resto.aiohttp', _FakeAiohttp)
+    def test_async_call_with_aiohttp(self):
+        _FakeAiohttp.sessions.clear()
+        exp = resto.Expected(url='/1', method=resto.Method.PUT, out_json={'a': 'http://x/1'})
+        self.assertEqual({}, asyncio.run(exp.async_call(resto.Config('http://x'))))
+        self.assertEqual([('PUT', 'http://x/1')], _FakeAiohttp.sessions[0].requests)
+        self.assertEqual('application/json', exp.received_headers['content-type'])
+
+    @patch('resto.aiohttp', _FakeAiohttp)
+    def test_async_call_repeated_headers(self):
+        # requests joins the values of a repeated header with ', '.
+        exp = resto.Expected(url='/1', out_json={'a': 'http://x/1'}, out_headers={'Set-Cookie': 'a=1, b=2'})
+        self.assertEqual({}, asyncio.run(exp.async_call(resto.Config('http://x'))))
+        self.assertEqual('a=1, b=2', exp.received_headers['set-cookie'])
+
+
+class TestConfigSessions(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the configs share the
+    sessions of the same base URL and connection settings, tuned with
+    those settings.
+    """
+
+    def test_shared_session(self):
+        session = resto.Config('http://x').get_session()
+        self.assertIs(session, resto.Config('http://x').get_session())
+        self.assertIsNot(session, resto.Config('http://y').get_session())
+        self.assertIsNot(session, resto.Config('http://x', pool_maxsize=3).get_session())
+
+    def test_tuned_session(self):
+        config = resto.Config('http://tuned', pool_connections=2, pool_maxsize=7, retries=3, backoff_factor=0.5)
+        adapter = config.get_session().get_adapter('http://tuned/a')
+        self.assertEqual(7, adapter._pool_maxsize)
+        self.assertEqual(2, adapter._pool_connections)
+        self.assertEqual((3, 0.5), (adapter.max_retries.total, adapter.max_retries.backoff_factor))
+        self.assertEqual('keep-alive', config.get_session().headers['Connection'])
+        config.close()
+
+    def test_default_retries(self):
+        config = resto.Config('http://untuned')
+        default = requests.adapters.HTTPAdapter().max_retries
+        retries = config.get_session().get_adapter('http://untuned/a').max_retries
+        self.assertEqual((default.total, default.read), (retries.total, retries.read))
+        self.assertFalse(retries.read)
+        config.close()
+
+    def test_no_keep_alive(self):
+        config = resto.Config('http://closed', keep_alive=False)
+        self.assertEqual('close', config.get_session().headers['Connection'])
+        config.close()
+
+    def test_close(self):
+        config = resto.Config('http://closing')
+        session = config.get_session()
+        other = resto.Config('http://other').get_session()
+        with patch.object(session, 'close') as close, patch.object(other, 'close') as other_close:
+            resto.Config('http://closing').close()
+            close.assert_called_once_with()
+            other_close.assert_not_called()
+        self.assertIsNot(session, config.get_session())
+        self.assertIs(other, resto.Config('http://other').get_session())
+
+
+def _echo_app(environ: dict, start_response):
+    """
+    WSGI app returning the request it received as JSON, with a 201 status code.
+    """
+    body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+    echo = {
+        'method': environ['REQUEST_METHOD'],
+        'path': environ['PATH_INFO'],
+        'query': environ['QUERY_STRING'],
+        'auth': environ.get('HTTP_AUTHORIZATION'),
+        'type': environ.get('CONTENT_TYPE'),
+        'body': json.loads(body) if body else None,
+    }
+    start_response('201 CREATED', [('Content-Type', 'application/json'), ('X-Echo', 'a'), ('X-Echo', 'b')])
+    return [json.dumps(echo).encode('utf-8')]
+
+
+class TestWSGIAdapter(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the requests sent to a
+    WSGI app in-process give the same responses and diffs as through HTTP.
+    """
+
+    def test_call_app(self):
+        config = resto.Config('http://app', app=_echo_app)
+        exp = resto.Expected(
+            url='/dogs/1',
+            method=resto.Method.POST,
+            params={'q': 'a b'},
+            in_headers={'Authorization': 'Bearer x'},
+            in_json={'name': 'Rex'},
+            out_json={
+                'method': 'POST', 'path': '/dogs/1', 'query': 'q=a+b', 'auth': 'Bearer x',
+                'type': 'application/json', 'body': {'name': 'Rex'},
+            },
+            out_headers={'x-echo': 'a, b'},
+            status_code=201)
+        self.assertEqual({}, exp.call(config))
+        self.assertIsInstance(config.get_session().get_adapter('http://app'), resto.WSGIAdapter)
+
+    def test_call_app_diff(self):
+        config = resto.Config('http://app', app=_echo_app)
+        exp = resto.Expected(url='/cats', out_json={'path': '/dogs'}, out_json_strict=False)
+        self.assertEqual({'path': ('/dogs', '/cats'), 'status_code': (200, 201)}, exp.call(config))
+
+    def test_response(self):
+        session = requests.Session()
+        session.mount('http://', resto.WSGIAdapter(_echo_app))
+        response = session.delete('http://app/x%20y')
+        self.assertEqual((201, 'CREATED'), (response.status_code, response.reason))
+        self.assertEqual({'method': 'DELETE', 'path': '/x y'}, {k: response.json()[k] for k in ('method', 'path')})
+        self.assertEqual('application/json', response.headers['content-type'])
+
+    def test_app_by_name(self):
+        with patch.dict(os.environ, {'WSGI_APP': 'test_transports:_echo_app'}):
+            self.assertIs(_echo_app, resto.Config('http://app').app)
+        self.assertIsNone(resto.Config('http://app').app)
+
+    def test_app_name_without_attribute(self):
+        for name in ('test_transports', 'test_transports:', ':_echo_app'):
+            with self.assertRaisesRegex(ValueError, 'module:attribute'):
+                resto.Config('http://app', app=name)
+            with self.assertRaisesRegex(ValueError, 'module:attribute'):
+                resto.Config('http://app', lambda_routes=name)
+
+
+def _echo_handler(event: dict, context: dict) -> dict:
+    """
+    AWS Lambda handler returning the event it received as JSON, with a location.
+    """
+    return {'statusCode': 201, 'body': json.dumps(event), 'headers': {'location': '/dogs/7'}}
+
+
+class TestLambdaAdapter(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the requests sent to AWS
+    Lambda handlers in-process give the same events and responses as
+    through the AWS emulator of the flask app.
+    """
+
+    def _config(self) -> resto.Config:
+        return resto.Config('http://app', lambda_routes={'/dogs': _echo_handler, '/dogs/<int:id>': _echo_handler})
+
+    def test_call_handler(self):
+        exp = resto.Expected(
+            url='/dogs/12',
+            method=resto.Method.PUT,
+            params={'q': 'a b'},
+            in_headers={'authorization': 'Bearer x'},
+            in_json={'name': 'Rex'},
+            out_json={
+                'httpMethod': 'PUT',
+                'queryStringParameters': {'q': 'a b'},
+                'headers': {'Authorization': 'Bearer x', 'Content-Type': 'application/json'},
+                'body': '{"name": "Rex"}',
+                'pathParameters': {'id': 12},
+            },
+            out_json_strict=False,
+            out_headers={'Location': 'http://app/dogs/7', 'Content-Type': 'application/json'},
+            status_code=201)
+        self.assertEqual({}, exp.call(self._config()))
+        self.assertIsInstance(self._config().get_session().get_adapter('http://app'), resto.LambdaAdapter)
+
+    def test_call_handler_no_body(self):
+        exp = resto.Expected(url='/dogs', out_json={'httpMethod': 'GET'}, out_json_strict=False, status_code=201)
+        self.assertEqual({}, exp.call(self._config()))
+        self.assertNotIn('body', exp.received_json)
+        self.assertNotIn('pathParameters', exp.received_json)
+        self.assertNotIn('queryStringParameters', exp.received_json)
+
+    def test_call_no_route(self):
+        exp = resto.Expected(url='/dogs/rex', out_json_strict=False)
+        self.assertEqual({'status_code': (200, 404)}, exp.call(self._config()))
+
+    def test_compile_route(self):
+        regex, converters = resto._compile_route('/a.b/<int:id>/<name>/<path:rest>')
+        match = regex.fullmatch('/a.b/3/x/y/z')
+        self.assertEqual({'id': '3', 'name': 'x', 'rest': 'y/z'}, match.groupdict())
+        self.assertEqual({'id': int, 'name': str, 'rest': str}, converters)
+        self.assertIsNone(regex.fullmatch('/axb/3/x/y'))
+
+
+class TestReceivedJson(unittest.TestCase):
+    """
+    The goal of the tests are to verify that the received bodies are decoded
+    like the json module does, with or without the JSON codec of the flask app.
+    """
+
+    def _codec(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(resto.__file__)), '..', 'flask-app', 'json_codec.py')
+        spec = importlib.util.spec_from_file_location('json_codec', path)
+        codec = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(codec)
+        return codec
+
+    @patch('resto.Config.get_session')
+    def test_call_decodes_like_json(self, get_session):
+        response = get_session.return_value.get.return_value.__enter__.return_value
+        response.content = b'{"id": 123456789012345678901234567890, "w": Infinity}'
+        response.headers = {}
+        response.status_code = 200
+
+        for codec in (self._codec(), None):
+            with patch('resto.json_codec', codec):
+                exp = resto.Expected(url='/a', out_json={'id': 123456789012345678901234567890, 'w': float('inf')})
+                self.assertEqual({}, exp.call(resto.Config('http://x')))
+                self.assertEqual(json.loads(response.content), exp.received_json)
+
+
+if __name__ == '__main__':
+    unittest.main()
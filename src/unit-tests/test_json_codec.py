@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import Mock, patch
+import json
+import math
+
+import  json_codec
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def setUp(self):
+        backend = json_codec.get_backend()
+        self.addCleanup(json_codec.set_backend, backend)
+
+    def test_round_trip(self):
+        """
+        The goal of the test is to verify that all available backends
+        decode the JSON they encode back to the same value.
+        """
+        value = { 'dogs': [{ 'id': 1, 'first_name': 'Blacky', 'tags': [None, True, 1.5] }], 'total_item_count': 1 }
+        for backend in json_codec.available_backends():
+            json_codec.set_backend(backend)
+            self.assertEqual(value, json_codec.loads(json_codec.dumps(value)))
+            self.assertEqual(value, json_codec.loads(json_codec.dumps(value).encode('utf-8')))
+
+    def test_invalid_json(self):
+        """
+        The goal of the test is to verify that all available backends
+        raise a ValueError when decoding invalid JSON.
+        """
+        for backend in json_codec.available_backends():
+            json_codec.set_backend(backend)
+            with self.assertRaises(ValueError):
+                json_codec.loads('{ [ "not quite" }')
+
+    def test_json_backend(self):
+        """
+        The goal of the test is to verify that the standard json module
+        is always available and formats like it always did.
+        """
+        json_codec.set_backend(json_codec.JSON)
+        self.assertEqual(json_codec.JSON, json_codec.get_backend())
+        self.assertEqual('{"key": "value"}', json_codec.dumps({ 'key': 'value' }))
+
+    def test_unknown_backend(self):
+        """
+        The goal of the test is to verify that choosing an unknown backend fails.
+        """
+        with self.assertRaises(ValueError):
+            json_codec.set_backend('unknown')
+
+    @patch('json_codec.orjson', None)
+    def test_without_orjson(self):
+        """
+        The goal of the test is to verify that only the standard json
+        module is available when orjson is not installed.
+        """
+        self.assertEqual([json_codec.JSON], json_codec.available_backends())
+
+    def test_decoded_like_json(self):
+        """
+        The goal of the test is to verify that all available backends
+        decode the texts the json module accepts to the same values,
+        including the integers above 64 bits, NaN and Infinity.
+        """
+        for text in ['[123456789012345678901234567890, -18446744073709551617]', '[Infinity, -Infinity]', '{"a": 1e400}']:
+            for backend in json_codec.available_backends():
+                json_codec.set_backend(backend)
+                self.assertEqual(json.loads(text), json_codec.loads(text))
+                self.assertEqual(json.loads(text), json_codec.loads(text.encode('utf-8')))
+        for backend in json_codec.available_backends():
+            json_codec.set_backend(backend)
+            self.assertTrue(math.isnan(json_codec.loads('NaN')))
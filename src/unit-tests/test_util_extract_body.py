@@ -29,6 +29,7 @@ class TestUtilExtractBody(unittest.TestCase):
             util.extract_json_body({'body': '{ [ "not quite" }'})
 
         self.assertEqual({ "json_key": "json_value" }, util.extract_json_body({'body': '{ "json_key": "json_value" }'}))
+        self.assertEqual({ "id": 123456789012345678901234567890 }, util.extract_json_body({'body': '{ "id": 123456789012345678901234567890 }'}))
 
 
     def test_extract_json_body_params(self):
@@ -4,10 +4,17 @@ from unittest.mock import Mock, patch
 import traceback
 
 import  util
+import json_codec
 
 
 class TestUtilReturn(unittest.TestCase):
 
+    def setUp(self):
+        # The expected bodies are formatted like the standard json module does.
+        backend = json_codec.get_backend()
+        json_codec.set_backend(json_codec.JSON)
+        self.addCleanup(json_codec.set_backend, backend)
+
     def test_return_error(self):
         """
         The goal of the test is to verify that return_error()